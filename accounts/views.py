@@ -5,7 +5,8 @@ from django.contrib.auth.decorators import login_required
 from django.contrib import messages 
 from .forms import LoginForm
 from school_messages.models import Notification
-from marks.models import Mark
+from marks.cache import cached
+from marks.models import Mark, StudentTermSummary
 from students.models import Student
 from teachers.models import Teacher
 
@@ -63,6 +64,36 @@ def logout_view(request):
     messages.info(request, f'Goodbye {username}! You have been logged out successfully.')
     return redirect('login')
 
+def _student_performance(student_profile):
+    """Averages, grade distribution and pass rate across a student's terms; None without marks"""
+    summaries = list(StudentTermSummary.objects.filter(student=student_profile))
+    if not summaries:
+        return None
+    
+    total_marks = sum(summary.subject_count for summary in summaries)
+    
+    # Calculate overall average (weighted by subjects per term)
+    total_score = sum(summary.average_score * summary.subject_count for summary in summaries)
+    
+    # Summaries are ordered latest term first
+    latest_term = summaries[0]
+    
+    # Calculate pass rate (A-E are passing grades)
+    passing_marks = sum(summary.pass_count for summary in summaries)
+    
+    return {
+        'overall_average': round(total_score / total_marks, 2),
+        'latest_term': f"{latest_term.term} {latest_term.academic_year}",
+        'latest_term_average': round(latest_term.average_score, 2),
+        # Count subjects with marks
+        'subjects_with_marks': Mark.objects.filter(student=student_profile).values('subject').distinct().count(),
+        'grade_counts': {
+            grade: sum(summary.grade_counts[grade] for summary in summaries)
+            for grade in ('A', 'B', 'C', 'D', 'E', 'F')
+        },
+        'pass_rate': round((passing_marks / total_marks) * 100, 1),
+    }
+
 @login_required
 def dashboard(request):
     """Main dashboard view - shows different content based on user role"""
@@ -148,51 +179,15 @@ def dashboard(request):
                     context['subjects_list'] = subjects_list
                     context['subjects_count'] = len(subjects_list)
                 
-                # Get academic performance data
+                # Get academic performance data from the per-term summaries,
+                # cached until one of the student's marks is written
                 try:
-                    marks = Mark.objects.filter(student=student_profile)
-                    
-                    if marks.exists():
-                        # Calculate overall average
-                        total_score = sum(mark.total_score for mark in marks)
-                        average_score = total_score / marks.count()
-                        context['overall_average'] = round(average_score, 2)
-                        
-                        # Get latest term marks
-                        latest_marks = marks.order_by('-academic_year', '-term')
-                        if latest_marks.exists():
-                            latest_term = latest_marks.first()
-                            context['latest_term'] = f"{latest_term.term} {latest_term.academic_year}"
-                            
-                            # Calculate latest term average
-                            term_marks = marks.filter(
-                                term=latest_term.term, 
-                                academic_year=latest_term.academic_year
-                            )
-                            if term_marks.exists():
-                                term_total = sum(mark.total_score for mark in term_marks)
-                                term_average = term_total / term_marks.count()
-                                context['latest_term_average'] = round(term_average, 2)
-                        
-                        # Count subjects with marks
-                        subjects_with_marks = marks.values('subject').distinct().count()
-                        context['subjects_with_marks'] = subjects_with_marks
-                        
-                        # Get grade distribution
-                        context['grade_counts'] = {
-                            'A': marks.filter(grade='A').count(),
-                            'B': marks.filter(grade='B').count(),
-                            'C': marks.filter(grade='C').count(),
-                            'D': marks.filter(grade='D').count(),
-                            'E': marks.filter(grade='E').count(),
-                            'F': marks.filter(grade='F').count(),
-                        }
-                        
-                        # Calculate pass rate (A-E are passing grades)
-                        total_marks = marks.count()
-                        passing_marks = marks.filter(grade__in=['A', 'B', 'C', 'D', 'E']).count()
-                        if total_marks > 0:
-                            context['pass_rate'] = round((passing_marks / total_marks) * 100, 1)
+                    performance = cached(
+                        'student_dashboard', [], (student_profile.id,),
+                        lambda: _student_performance(student_profile), students=[student_profile.id],
+                    )
+                    if performance:
+                        context.update(performance)
                     else:
                         context['no_marks_message'] = 'No academic records available yet.'
                         
@@ -1,7 +1,12 @@
 # marks/admin.py
+from decimal import Decimal, ROUND_HALF_UP
 from django.contrib import admin
+from django.shortcuts import render
+from django.urls import path
 from unfold.admin import ModelAdmin
-from .models import Subject, Mark, StudentReport, PerformanceTrend
+from .models import (
+    Subject, GradingScheme, AcademicTerm, Mark, StudentReport, PerformanceTrend, AnalyticsJob, RiskFlag,
+)
 
 @admin.register(Subject)
 class SubjectAdmin(ModelAdmin):
@@ -14,6 +19,39 @@ class SubjectAdmin(ModelAdmin):
         return obj.description[:50] + '...' if len(obj.description) > 50 else obj.description
     description_short.short_description = 'Description'
 
+@admin.register(GradingScheme)
+class GradingSchemeAdmin(ModelAdmin):
+    list_display = ('academic_year', 'version', 'name', 'weights_display', 'is_active', 'created_at')
+    list_filter = ('academic_year', 'is_active')
+    search_fields = ('name', 'academic_year')
+    readonly_fields = ('created_at',)
+    fieldsets = (
+        ('Scheme', {
+            'fields': ('academic_year', 'version', 'name', 'is_active')
+        }),
+        ('Weights (%)', {
+            'fields': ('cat1_weight', 'cat2_weight', 'main_exam_weight')
+        }),
+        ('Grade Boundaries (minimum total score)', {
+            'fields': ('grade_a_min', 'grade_b_min', 'grade_c_min', 'grade_d_min', 'grade_e_min')
+        }),
+        ('Timestamps', {
+            'fields': ('created_at',),
+            'classes': ('collapse',)
+        }),
+    )
+    
+    def weights_display(self, obj):
+        return f"{obj.cat1_weight}/{obj.cat2_weight}/{obj.main_exam_weight}"
+    weights_display.short_description = 'Weights'
+
+@admin.register(AcademicTerm)
+class AcademicTermAdmin(ModelAdmin):
+    list_display = ('__str__', 'academic_year', 'ordinal', 'start_date', 'end_date', 'is_current')
+    list_filter = ('academic_year', 'is_current')
+    readonly_fields = ('index',)
+    ordering = ('-index',)
+
 @admin.register(Mark)
 class MarkAdmin(ModelAdmin):
     list_display = ('student_info', 'subject_name', 'term_year', 'total_score', 'grade_display', 'teacher_name')
@@ -68,6 +106,44 @@ class MarkAdmin(ModelAdmin):
     def teacher_name(self, obj):
         return obj.teacher.user.get_full_name() if obj.teacher else 'N/A'
     teacher_name.short_description = 'Teacher'
+    
+    def get_urls(self):
+        urls = super().get_urls()
+        custom_urls = [
+            path('import/', self.admin_site.admin_view(self.import_marks_view), name='marks_mark_import'),
+        ]
+        return custom_urls + urls
+    
+    def import_marks_view(self, request):
+        """Upload a CSV/XLSX export and upsert its marks in batches"""
+        from .forms import MarkImportForm
+        from .importers import MarkImporter, MarkImportError, iter_rows
+        
+        importer = None
+        if request.method == 'POST':
+            form = MarkImportForm(request.POST, request.FILES)
+            if form.is_valid():
+                upload = form.cleaned_data['file']
+                try:
+                    importer = MarkImporter(
+                        term=form.cleaned_data['term'] or None,
+                        academic_year=form.cleaned_data['academic_year'] or None,
+                        batch_size=form.cleaned_data['batch_size'],
+                    ).run(iter_rows(upload, upload.name))
+                    self.message_user(request, f'Imported {importer.imported} marks ({len(importer.errors)} rows rejected).')
+                except MarkImportError as e:
+                    form.add_error('file', str(e))
+        else:
+            form = MarkImportForm()
+        
+        context = {
+            **self.admin_site.each_context(request),
+            'opts': self.model._meta,
+            'title': 'Import Marks',
+            'form': form,
+            'importer': importer,
+        }
+        return render(request, 'admin/marks/mark/import_marks.html', context)
 
 @admin.register(StudentReport)
 class StudentReportAdmin(ModelAdmin):
@@ -124,6 +200,19 @@ class StudentReportAdmin(ModelAdmin):
     def date_created_display(self, obj):
         return obj.date_created.strftime('%Y-%m-%d')
     date_created_display.short_description = 'Created'
+    
+    actions = ['recalculate_positions']
+    
+    @admin.action(description='Recalculate averages and class positions')
+    def recalculate_positions(self, request, queryset):
+        from .reports import generate_student_reports
+        
+        updated_count = 0
+        terms = queryset.values_list('term', 'academic_year', 'student__grade', 'student__section').distinct()
+        for term, academic_year, grade, section in terms:
+            updated_count += generate_student_reports(term, academic_year, grade=grade, section=section)
+        
+        self.message_user(request, f'Recalculated {updated_count} student reports.')
 
 @admin.register(PerformanceTrend)
 class PerformanceTrendAdmin(ModelAdmin):
@@ -214,17 +303,73 @@ class PerformanceTrendAdmin(ModelAdmin):
     @admin.action(description='Regenerate trend analysis')
     def regenerate_analysis(self, request, queryset):
         from .analytics import StudentPerformanceAnalyzer
+        from .grading import TWO_PLACES
         
-        updated_count = 0
-        for trend in queryset:
-            analyzer = StudentPerformanceAnalyzer()
-            analysis = analyzer.generate_trend_analysis(trend.student.id)
-            if analysis:
-                updated_count += 1
+        trends = list(queryset.select_related('strongest_subject', 'weakest_subject'))
+        analyses = StudentPerformanceAnalyzer().analyze_many({trend.student_id for trend in trends})
         
-        self.message_user(request, f'Regenerated analysis for {updated_count} trend records.')
+        updated, schemes = [], {}
+        for trend in trends:
+            analysis = analyses.get(trend.student_id)
+            if not analysis:
+                continue
+            keys = [(p['term'], p['year']) for p in analysis['performances']]
+            if (trend.term, trend.academic_year) not in keys:
+                continue
+            
+            index = keys.index((trend.term, trend.academic_year))
+            current = analysis['performances'][index]
+            trend.current_term_average = Decimal(str(current['average_score'])).quantize(TWO_PLACES, ROUND_HALF_UP)
+            if index > 0:
+                previous = analysis['performances'][index - 1]
+                trend.apply_previous_average(Decimal(str(previous['average_score'])).quantize(TWO_PLACES, ROUND_HALF_UP))
+            if trend.academic_year not in schemes:
+                schemes[trend.academic_year] = GradingScheme.for_year(trend.academic_year)
+            trend.grading_scheme = schemes[trend.academic_year]
+            trend.generate_analysis()
+            updated.append(trend)
+        
+        PerformanceTrend.objects.bulk_update(updated, [
+            'current_term_average', 'previous_term_average', 'score_change', 'percentage_change',
+            'trend', 'trend_direction', 'analysis_summary', 'recommendations', 'action_items',
+        ])
+        self.message_user(request, f'Regenerated analysis for {len(updated)} trend records.')
     
     @admin.action(description='Mark selected as inactive')
     def mark_as_inactive(self, request, queryset):
         updated = queryset.update(is_active=False)
-        self.message_user(request, f'Marked {updated} trend records as inactive.')
\ No newline at end of file
+        self.message_user(request, f'Marked {updated} trend records as inactive.')
+
+@admin.register(AnalyticsJob)
+class AnalyticsJobAdmin(ModelAdmin):
+    list_display = ('id', 'kind', 'status', 'progress_display', 'error_count', 'created_by', 'created_at', 'finished_at')
+    list_filter = ('kind', 'status')
+    readonly_fields = (
+        'kind', 'status', 'parameters', 'total', 'processed', 'error_count', 'errors',
+        'result', 'message', 'created_by', 'created_at', 'started_at', 'finished_at'
+    )
+    
+    def progress_display(self, obj):
+        return f"{obj.processed}/{obj.total} ({obj.progress_percent}%)"
+    progress_display.short_description = 'Progress'
+    
+    def has_add_permission(self, request):
+        return False
+
+
+@admin.register(RiskFlag)
+class RiskFlagAdmin(ModelAdmin):
+    list_display = (
+        'student', 'academic_term', 'reason', 'current_average', 'projected_average', 'slope',
+        'fail_count', 'is_active', 'notified_at',
+    )
+    list_filter = ('is_active', 'reason', 'academic_term')
+    search_fields = ('student__user__first_name', 'student__user__last_name', 'student__admission_number')
+    list_select_related = ('student__user', 'academic_term')
+    readonly_fields = (
+        'student', 'academic_term', 'reason', 'current_average', 'projected_average', 'slope', 'fail_count',
+        'previous_fail_count', 'terms_used', 'notified_at', 'created_at', 'updated_at',
+    )
+    
+    def has_add_permission(self, request):
+        return False
@@ -2,7 +2,7 @@
 from django.db.models import Avg, Count, Sum, Q, F
 from django.utils import timezone
 from datetime import datetime
-from .models import Mark, Student, Subject, PerformanceTrend
+from .models import Mark, Student, Subject, PerformanceTrend, StudentTermSummary
 
 class StudentPerformanceAnalyzer:
     def __init__(self, student_id=None):
@@ -10,18 +10,20 @@ class StudentPerformanceAnalyzer:
     
     def get_student_term_performance(self, student, term, year):
         """Get student performance for specific term"""
-        marks = Mark.objects.filter(
+        summary = StudentTermSummary.objects.filter(
             student=student,
             term=term,
             academic_year=year
-        ).select_related('subject')
+        ).first()
         
-        if not marks.exists():
+        if not summary:
             return None
         
-        # Calculate statistics
-        average_score = marks.aggregate(avg=Avg('total_score'))['avg']
-        grade_distribution = marks.values('grade').annotate(count=Count('id')).order_by('grade')
+        marks = Mark.objects.filter(
+            student=student,
+            term=term,
+            academic_year=year
+        ).select_related('subject')
         
         # Subject-wise performance
         subject_scores = {}
@@ -32,12 +34,17 @@ class StudentPerformanceAnalyzer:
                 'grade_label': mark.get_performance_label()
             }
         
+        grade_distribution = [
+            {'grade': grade, 'count': count}
+            for grade, count in summary.grade_counts.items() if count
+        ]
+        
         return {
             'term': term,
             'year': year,
-            'average_score': float(average_score),
-            'total_subjects': marks.count(),
-            'grade_distribution': list(grade_distribution),
+            'average_score': float(summary.average_score),
+            'total_subjects': summary.subject_count,
+            'grade_distribution': grade_distribution,
             'subject_scores': subject_scores
         }
     
@@ -104,41 +111,53 @@ class StudentPerformanceAnalyzer:
     
     def generate_trend_analysis(self, student_id, terms=None):
         """Generate comprehensive trend analysis for a student"""
-        try:
-            student = Student.objects.get(id=student_id)
-        except Student.DoesNotExist:
-            return None
-        
-        # Get all marks for the student
-        all_marks = Mark.objects.filter(student=student).order_by('academic_year', 'term')
-        
-        if not all_marks.exists():
-            return None
-        
-        # Group by term and year
-        term_performances = {}
-        for mark in all_marks:
-            key = f"{mark.term} {mark.academic_year}"
-            if key not in term_performances:
-                term_performances[key] = []
-            term_performances[key].append(mark)
+        return self.analyze_many([student_id]).get(int(student_id))
+    
+    def analyze_many(self, student_ids):
+        """
+        Trend analysis for a cohort of students, keyed by student id.
+        
+        All marks are read in one query with the subject name joined and
+        grouped into per-student term lists in chronological order; each
+        value has the same structure as generate_trend_analysis(). Students
+        without marks are left out.
+        """
+        students = Student.objects.select_related('user').in_bulk(student_ids)
+        rows = (
+            Mark.objects.filter(student_id__in=students)
+            .order_by('student_id', 'academic_year', 'term', 'subject__name')
+            .values_list('student_id', 'term', 'academic_year', 'subject__name', 'total_score', 'grade')
+        )
+        
+        # {student_id: [[term, year, [(subject, score, grade), ...]], ...]}
+        term_marks = {}
+        for student_id, term, year, subject_name, total_score, grade in rows:
+            terms = term_marks.setdefault(student_id, [])
+            if not terms or (terms[-1][0], terms[-1][1]) != (term, year):
+                terms.append([term, year, []])
+            terms[-1][2].append((subject_name, float(total_score), grade))
         
+        return {
+            student_id: self._trend_analysis(students[student_id], terms)
+            for student_id, terms in term_marks.items()
+        }
+    
+    def _trend_analysis(self, student, terms):
+        """Build the analysis for one student from their chronological term marks"""
         # Calculate performance for each term
         performances = []
-        term_keys = sorted(term_performances.keys())
-        
-        for i, term_key in enumerate(term_keys):
-            marks = term_performances[term_key]
-            avg_score = sum(m.total_score for m in marks) / len(marks)
-            
+        for term, year, marks in terms:
             performance = {
-                'term_key': term_key,
-                'term': marks[0].term,
-                'year': marks[0].academic_year,
-                'average_score': float(avg_score),
+                'term_key': f"{term} {year}",
+                'term': term,
+                'year': year,
+                'average_score': sum(score for _, score, _ in marks) / len(marks),
                 'subject_count': len(marks),
-                'subjects': {m.subject.name: float(m.total_score) for m in marks},
-                'grades': {m.subject.name: m.grade for m in marks}
+                'subjects': {subject: score for subject, score, _ in marks},
+                'grades': {subject: grade for subject, _, grade in marks},
+                'subject_scores': {
+                    subject: {'score': score, 'grade': grade} for subject, score, grade in marks
+                },
             }
             
             performances.append(performance)
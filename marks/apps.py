@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class MarksConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'marks'
+    
+    def ready(self):
+        # Import signals when the app is ready
+        import marks.signals
@@ -0,0 +1,46 @@
+# marks/bulk.py
+from django.db import transaction
+from .grading import grade_marks
+from .models import Mark
+from .refresh import subject_keys
+from .signals import marks_bulk_written, mark_keys
+from .terms import assign_academic_terms
+
+# Natural key of a mark (Mark.Meta.unique_together)
+MARK_KEY_FIELDS = ['student', 'subject', 'term', 'academic_year']
+
+# Columns overwritten when a mark for the same key already exists; the
+# teacher is not among them, so an existing mark keeps its owner
+MARK_UPDATE_FIELDS = [
+    'cat1_score', 'cat2_score', 'main_exam_score',
+    'total_score', 'grade', 'comments', 'last_modified', 'academic_term',
+]
+
+DEFAULT_BATCH_SIZE = 500
+
+
+def upsert_marks(marks, batch_size=DEFAULT_BATCH_SIZE, update_fields=MARK_UPDATE_FIELDS):
+    """
+    Grade and write a batch of unsaved Mark instances in one transaction.
+
+    Rows are inserted with a single multi-row INSERT per batch and rows that
+    already exist for the same student/subject/term/year are updated in place
+    (INSERT ... ON CONFLICT DO UPDATE), so Mark.save() is never called per row.
+    Callers check that existing marks may be overwritten before writing them;
+    `update_fields` picks the columns an existing mark takes from the new one.
+    """
+    marks = grade_marks(list(marks))
+    if not marks:
+        return 0
+    assign_academic_terms(marks)
+
+    with transaction.atomic():
+        Mark.objects.bulk_create(
+            marks,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=MARK_KEY_FIELDS,
+            update_fields=update_fields,
+        )
+        marks_bulk_written.send(sender=Mark, keys=mark_keys(marks), subjects=subject_keys(marks))
+    return len(marks)
@@ -0,0 +1,162 @@
+# marks/cache.py
+"""
+Caching of analytics computed from marks.
+
+Cached values are keyed by version numbers per term and per student; writing
+a mark bumps the versions of its term and its student (see marks.signals), so
+stale entries are never read again and simply expire. Works on any Django
+cache backend (settings.CACHES); use a shared one such as Redis in production
+so every process sees the same versions.
+"""
+import hashlib
+import time
+from django.conf import settings
+from django.core.cache import caches
+
+KEY_PREFIX = 'marks'
+
+# Version bumped by every mark write, for results that span all terms
+ALL_TERMS = ('*', '*')
+
+# Version bumped whenever an AcademicTerm is saved or deleted (marks.terms)
+TERMS_VERSION_KEY = f'{KEY_PREFIX}:version:academic-terms'
+
+_names_seen = set()
+
+
+def _cache():
+    return caches[getattr(settings, 'ANALYTICS_CACHE_ALIAS', 'default')]
+
+
+def _digest(*parts):
+    # Keeps keys short and free of spaces, which some cache backends reject
+    return hashlib.md5('|'.join(str(part) for part in parts).encode()).hexdigest()
+
+
+def _version_key(term, academic_year):
+    return f'{KEY_PREFIX}:version:{_digest(academic_year, term)}'
+
+
+def _student_version_key(student_id):
+    return f'{KEY_PREFIX}:version:student:{student_id}'
+
+
+def _initial_version():
+    # Versions start from the clock so a version evicted from the cache never
+    # comes back with a number that old entries were stored under
+    return int(time.time() * 1000)
+
+
+def _versions(keys):
+    cache = _cache()
+    versions = cache.get_many(keys)
+    for key in keys:
+        if key not in versions:
+            cache.add(key, _initial_version(), timeout=None)
+            versions[key] = cache.get(key)
+    return [versions[key] for key in keys]
+
+
+def _bump(keys):
+    cache = _cache()
+    for key in keys:
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, _initial_version(), timeout=None)
+
+
+def term_version(term, academic_year):
+    return _versions([_version_key(term, academic_year)])[0]
+
+
+def student_version(student_id):
+    return _versions([_student_version_key(student_id)])[0]
+
+
+def bump_term_versions(terms):
+    """Invalidate everything cached for the given (term, academic_year) pairs"""
+    _bump([_version_key(term, academic_year) for term, academic_year in set(terms) | {ALL_TERMS}])
+
+
+def bump_student_versions(student_ids):
+    """Invalidate everything cached for the given students"""
+    _bump([_student_version_key(student_id) for student_id in set(student_ids)])
+
+
+def terms_version():
+    return _versions([TERMS_VERSION_KEY])[0]
+
+
+def bump_terms_version():
+    """Have every process drop the AcademicTerm ids and current term it holds"""
+    _bump([TERMS_VERSION_KEY])
+
+
+def _count(name, outcome):
+    cache = _cache()
+    if name not in _names_seen:
+        names_key = f'{KEY_PREFIX}:stats:names'
+        cache.set(names_key, sorted(set(cache.get(names_key, [])) | {name}), timeout=None)
+        _names_seen.add(name)
+
+    key = f'{KEY_PREFIX}:stats:{name}:{outcome}'
+    if not cache.add(key, 1, timeout=None):
+        try:
+            cache.incr(key)
+        except ValueError:
+            cache.set(key, 1, timeout=None)
+
+
+def cached(name, terms, params, compute, timeout=None, students=()):
+    """
+    Return compute() cached under `name` and `params`, valid until a mark in
+    one of `terms` ((term, academic_year) pairs; None means all terms) or of
+    one of `students` is written.
+    """
+    terms = [ALL_TERMS] if terms is None else terms
+    version_keys = [_version_key(term, year) for term, year in terms]
+    version_keys += [_student_version_key(student_id) for student_id in students]
+    key = f'{KEY_PREFIX}:{name}:{_digest(*_versions(version_keys), *params)}'
+
+    cache = _cache()
+    # Stored wrapped in a tuple so a computed None is cached too
+    entry = cache.get(key)
+    if entry is not None:
+        _count(name, 'hits')
+        return entry[0]
+
+    _count(name, 'misses')
+    value = compute()
+    cache.set(key, (value,), timeout or getattr(settings, 'ANALYTICS_CACHE_TIMEOUT', 60 * 60 * 24))
+    return value
+
+
+def _stats_keys(names):
+    return [f'{KEY_PREFIX}:stats:{name}:{outcome}' for name in names for outcome in ('hits', 'misses')]
+
+
+def cache_stats(names=None):
+    """Hit and miss counts per cached name, across all processes sharing the cache"""
+    cache = _cache()
+    if names is None:
+        names = cache.get(f'{KEY_PREFIX}:stats:names', [])
+
+    counts = cache.get_many(_stats_keys(names))
+    stats = {}
+    for name in names:
+        hits = counts.get(f'{KEY_PREFIX}:stats:{name}:hits', 0)
+        misses = counts.get(f'{KEY_PREFIX}:stats:{name}:misses', 0)
+        stats[name] = {
+            'hits': hits,
+            'misses': misses,
+            'hit_rate': round(hits / (hits + misses) * 100, 1) if hits + misses else None,
+        }
+    return stats
+
+
+def reset_cache_stats(names=None):
+    cache = _cache()
+    if names is None:
+        names = cache.get(f'{KEY_PREFIX}:stats:names', [])
+    cache.delete_many(_stats_keys(names))
@@ -0,0 +1,132 @@
+# marks/comparison.py
+from django.db.models import Count, FloatField, Q, Sum
+from .cache import cached
+from .grading import FAIL_GRADE
+from .models import Mark
+from .trends import GRADE_LETTERS
+
+# Columns the comparison is grouped by; coarser breakdowns are summed from these
+GROUP_FIELDS = ('subject__name', 'student__grade', 'student__section')
+
+
+def _term_aggregates(prefix, in_term):
+    aggregates = {
+        f'{prefix}_total': Sum('total_score', filter=in_term, output_field=FloatField()),
+        f'{prefix}_count': Count('id', filter=in_term),
+        f'{prefix}_passed': Count('id', filter=in_term & ~Q(grade=FAIL_GRADE)),
+    }
+    for grade in GRADE_LETTERS:
+        aggregates[f'{prefix}_grade_{grade}'] = Count('id', filter=in_term & Q(grade=grade))
+    return aggregates
+
+
+def comparison_queryset(term1, year1, term2, year2):
+    """
+    Score totals, pass and grade counts for both terms per subject and class.
+
+    One grouped query over the marks of both terms; each term's figures are
+    conditional aggregates, so the rows come back already side by side.
+    """
+    in_term1 = Q(term=term1, academic_year=year1)
+    in_term2 = Q(term=term2, academic_year=year2)
+    return (
+        Mark.objects.filter(in_term1 | in_term2)
+        .values(*GROUP_FIELDS)
+        .annotate(**_term_aggregates('t1', in_term1), **_term_aggregates('t2', in_term2))
+        .order_by()
+    )
+
+
+def _empty_counts():
+    return {'total': 0.0, 'count': 0, 'passed': 0, 'grades': dict.fromkeys(GRADE_LETTERS, 0)}
+
+
+def _add(counts, row, prefix):
+    counts['total'] += row[f'{prefix}_total'] or 0
+    counts['count'] += row[f'{prefix}_count']
+    counts['passed'] += row[f'{prefix}_passed']
+    for grade in GRADE_LETTERS:
+        counts['grades'][grade] += row[f'{prefix}_grade_{grade}']
+
+
+def _term_summary(counts):
+    count = counts['count']
+    if not count:
+        return {'average': None, 'count': 0, 'pass_rate': None, 'distribution': {}}
+    return {
+        'average': round(counts['total'] / count, 2),
+        'count': count,
+        'pass_rate': round(counts['passed'] / count * 100, 2),
+        'distribution': {grade: round(n / count * 100, 2) for grade, n in counts['grades'].items()},
+    }
+
+
+def _change(before, after):
+    if before is None or after is None:
+        return None
+    return round(after - before, 2)
+
+
+def _compare(label, counts1, counts2):
+    term1, term2 = _term_summary(counts1), _term_summary(counts2)
+    average1, average2 = term1['average'], term2['average']
+    both = term1['count'] and term2['count']
+    return {
+        'label': label,
+        'term1': term1,
+        'term2': term2,
+        'difference': _change(average1, average2),
+        'percentage_change': (
+            round((average2 - average1) / average1 * 100, 2) if average1 else 0
+        ) if both else None,
+        'pass_rate_change': _change(term1['pass_rate'], term2['pass_rate']),
+        'grade_shift': [
+            {
+                'grade': grade,
+                'term1': term1['distribution'].get(grade),
+                'term2': term2['distribution'].get(grade),
+                'change': _change(term1['distribution'].get(grade), term2['distribution'].get(grade)),
+            }
+            for grade in GRADE_LETTERS
+        ] if both else [],
+    }
+
+
+def _pivot(rows, key):
+    groups = {}
+    for row in rows:
+        label = key(row)
+        counts1, counts2 = groups.setdefault(label, (_empty_counts(), _empty_counts()))
+        _add(counts1, row, 't1')
+        _add(counts2, row, 't2')
+    return [_compare(label, *groups[label]) for label in sorted(groups)]
+
+
+def compare_terms(term1, year1, term2, year2):
+    """
+    Compare two terms overall and by subject, grade and section.
+
+    Each comparison has both terms' average, mark count, pass rate and grade
+    distribution (percent of marks per grade), plus the average, pass-rate
+    and distribution changes from term1 to term2. Returns None if either term
+    has no marks. Cached until marks in either term are written.
+    """
+    def compute():
+        rows = list(comparison_queryset(term1, year1, term2, year2))
+        overall = _pivot(rows, lambda row: 'All')
+        if not overall or not (overall[0]['term1']['count'] and overall[0]['term2']['count']):
+            return None
+
+        comparison = overall[0]
+        comparison['term1'].update(term=term1, year=year1)
+        comparison['term2'].update(term=term2, year=year2)
+        comparison['subjects'] = _pivot(rows, lambda row: row['subject__name'])
+        comparison['grades'] = _pivot(rows, lambda row: row['student__grade'])
+        comparison['sections'] = _pivot(
+            rows, lambda row: f"{row['student__grade']} {row['student__section']}".strip()
+        )
+        return comparison
+
+    return cached(
+        'term_comparison', [(term1, year1), (term2, year2)], (term1, year1, term2, year2), compute
+    )
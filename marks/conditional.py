@@ -0,0 +1,101 @@
+# marks/conditional.py
+"""
+Conditional GET for pages and JSON endpoints showing one student's results.
+
+A response's validator is built from the latest modification time and the
+number of the student's marks and reports, read in a single query. A client
+that already holds the current version gets a 304 Not Modified before the
+view runs any of its own queries or renders a template. Counting rows as
+well as taking the latest time means a deleted mark or report changes the
+validator.
+
+HTML pages extending base.html carry more than the results: flash messages
+queued for the next page and a CSRF token for the logout form. With
+page=True no 304 is sent while messages are queued, and the validator also
+covers the CSRF secret and the user's last login, which replaces it.
+"""
+import hashlib
+from django.contrib import messages
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.middleware.csrf import get_token
+from django.views.decorators.http import condition
+from students.models import Student
+from .models import Mark, StudentReport
+
+
+def _latest(queryset, field):
+    """(latest `field`, row count) subqueries over one student's rows of a queryset"""
+    rows = queryset.filter(student_id=OuterRef('pk')).order_by().values('student_id')
+    return (
+        Subquery(rows.annotate(latest=Max(field)).values('latest')),
+        Subquery(rows.annotate(count=Count('pk')).values('count'), output_field=IntegerField()),
+    )
+
+
+def results_validator(student_id):
+    """
+    (ETag, last modified datetime) of a student's results from one query;
+    (None, None) when there is no such student.
+    """
+    marks_modified, marks_count = _latest(Mark.objects.all(), 'last_modified')
+    reports_modified, reports_count = _latest(StudentReport.objects.all(), 'date_modified')
+    row = Student.objects.filter(pk=student_id).annotate(
+        marks_modified=marks_modified, marks_count=marks_count,
+        reports_modified=reports_modified, reports_count=reports_count,
+    ).values_list('marks_modified', 'marks_count', 'reports_modified', 'reports_count').first()
+    if row is None:
+        return None, None
+
+    etag = hashlib.md5('|'.join(str(part) for part in (student_id, *row)).encode()).hexdigest()
+    modified = [value for value in (row[0], row[2]) if value is not None]
+    return etag, max(modified) if modified else None
+
+
+def _request_validator(request, student_id):
+    # condition() asks for the ETag and the last modified time separately
+    validators = request.__dict__.setdefault('_results_validators', {})
+    if student_id not in validators:
+        validators[student_id] = results_validator(student_id)
+    return validators[student_id]
+
+
+def _page_blocked(request):
+    # A 304 would leave queued messages undelivered until some other page renders
+    return len(messages.get_messages(request)) > 0
+
+
+def results_condition(get_student_id, page=False):
+    """
+    Decorator answering conditional GETs of a view of one student's results
+    with a 304 when they have not changed.
+
+    get_student_id(request, *args, **kwargs) gives the id of the student the
+    page shows, or None when the user may not see it; the view then runs as
+    usual. The ETag also covers the user, since pages differ between viewers.
+    Pass page=True for views rendering HTML pages (see the module docstring).
+    """
+    def etag(request, *args, **kwargs):
+        student_id = get_student_id(request, *args, **kwargs)
+        if student_id is None or (page and _page_blocked(request)):
+            return None
+        value, _ = _request_validator(request, student_id)
+        if not value:
+            return None
+        if page:
+            # get_token() settles the CSRF secret now, before the page uses it
+            get_token(request)
+            page_state = (value, request.META['CSRF_COOKIE'], request.user.last_login)
+            value = hashlib.md5('|'.join(str(part) for part in page_state).encode()).hexdigest()
+        return f'{request.user.pk}-{value}'
+
+    def last_modified(request, *args, **kwargs):
+        student_id = get_student_id(request, *args, **kwargs)
+        if student_id is None or (page and _page_blocked(request)):
+            return None
+        modified = _request_validator(request, student_id)[1]
+        if page and modified and request.user.last_login:
+            # Logging in again gives a new CSRF secret the cached page lacks
+            modified = max(modified, request.user.last_login)
+        return modified
+
+    return condition(etag_func=etag, last_modified_func=last_modified)
@@ -0,0 +1,260 @@
+# marks/early_warning.py
+"""
+Early warning for students whose results are heading the wrong way.
+
+Every student's term averages and failed-subject counts are laid out in a
+padded student x term matrix (NaN where a student has no results), and a
+straight line is fitted to each row by least squares, all students at once.
+Students whose line projects next term's average below the threshold, or
+whose failed subjects are growing, get a RiskFlag; their teachers then get
+one notification each listing their flagged students. A term still being
+marked is left out until it is over or has most of its results, so the
+previous term's flags stand meanwhile.
+"""
+from collections import defaultdict
+import numpy as np
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Sum
+from django.urls import reverse
+from django.utils import timezone
+from school_messages.models import Notification
+from teachers.models import Teacher
+from .models import AcademicTerm, RiskFlag, StudentTermSummary
+from .terms import parse_term_ordinal
+
+# Defaults for settings.RISK_* values
+AVERAGE_THRESHOLD = 40
+MIN_TERMS = 2
+TERM_COVERAGE = 0.8
+
+
+def _setting(name, default):
+    return getattr(settings, f'RISK_{name}', default)
+
+
+def _results_per_term(terms):
+    """{(academic_year, ordinal): subject results summarised} for the terms, from one query"""
+    totals = defaultdict(int)
+    rows = StudentTermSummary.objects.filter(
+        academic_year__in={term.academic_year for term in terms},
+    ).values_list('academic_year', 'term').annotate(results=Sum('subject_count')).order_by()
+    for academic_year, term, results in rows:
+        totals[(academic_year, parse_term_ordinal(term))] += results or 0
+    return totals
+
+
+def settled_terms(coverage=None, today=None):
+    """
+    Terms with marks, oldest first, up to the latest one far enough along
+    to judge: its end date has passed, or it has at least `coverage` times
+    as many subject results as the term before it. A term's first results
+    would otherwise stand in for its whole average.
+    """
+    coverage = _setting('TERM_COVERAGE', TERM_COVERAGE) if coverage is None else coverage
+    today = today or timezone.localdate()
+    terms = list(AcademicTerm.with_marks())
+    if len(terms) < 2:
+        return terms
+
+    results = _results_per_term(terms)
+    while len(terms) > 1:
+        latest, previous = terms[-1], terms[-2]
+        if latest.end_date and latest.end_date <= today:
+            break
+        if results[(latest.academic_year, latest.ordinal)] >= coverage * results[(previous.academic_year, previous.ordinal)]:
+            break
+        terms.pop()
+    return terms
+
+
+def term_matrices(terms):
+    """
+    (student ids, averages, fail counts) with one row per student and one
+    column per AcademicTerm in `terms` (oldest first), from one query.
+    """
+    columns = {(term.academic_year, term.ordinal): i for i, term in enumerate(terms)}
+    rows = [
+        (student_id, columns.get((academic_year, parse_term_ordinal(term))), average, fails)
+        for student_id, term, academic_year, average, fails in StudentTermSummary.objects.values_list(
+            'student_id', 'term', 'academic_year', 'average_score', 'grade_f_count',
+        ).order_by()
+    ]
+    rows = [row for row in rows if row[1] is not None]
+
+    student_ids = np.unique(np.array([row[0] for row in rows], dtype=np.int64))
+    averages = np.full((len(student_ids), len(terms)), np.nan)
+    fails = np.full((len(student_ids), len(terms)), np.nan)
+    if rows:
+        positions = np.searchsorted(student_ids, [row[0] for row in rows])
+        term_columns = np.array([row[1] for row in rows])
+        averages[positions, term_columns] = [float(row[2]) for row in rows]
+        fails[positions, term_columns] = [row[3] for row in rows]
+    return student_ids, averages, fails
+
+
+def fit_trends(values):
+    """
+    Least-squares line through each row of a padded matrix, ignoring NaNs.
+
+    x is the column index. Returns (intercepts, slopes, points per row);
+    rows with fewer than two points get NaN.
+    """
+    present = ~np.isnan(values)
+    x = np.broadcast_to(np.arange(values.shape[1], dtype=np.float64), values.shape)
+    y = np.where(present, values, 0.0)
+    w = present.astype(np.float64)
+
+    # Normal equations of every row, stacked: [[n, sx], [sx, sxx]] @ [a, b] = [sy, sxy]
+    n, sx, sxx = w.sum(axis=1), (w * x).sum(axis=1), (w * x * x).sum(axis=1)
+    sy, sxy = (w * y).sum(axis=1), (w * x * y).sum(axis=1)
+    lhs = np.stack([np.stack([n, sx], axis=-1), np.stack([sx, sxx], axis=-1)], axis=-2)
+    rhs = np.stack([sy, sxy], axis=-1)
+
+    solvable = n >= 2
+    coefficients = np.full((len(values), 2), np.nan)
+    if solvable.any():
+        coefficients[solvable] = np.linalg.solve(lhs[solvable], rhs[solvable][..., None])[..., 0]
+    return coefficients[:, 0], coefficients[:, 1], n.astype(int)
+
+
+def _latest_and_previous(values):
+    """Each row's value in the last column, and its last value before that (NaN if none)"""
+    if values.shape[1] < 2:
+        return values[:, -1], np.full(len(values), np.nan)
+    earlier = values[:, :-1]
+    present = ~np.isnan(earlier)
+    has_previous = present.any(axis=1)
+    # Index of the last present column: flip, find the first, flip back
+    previous_columns = earlier.shape[1] - 1 - np.argmax(present[:, ::-1], axis=1)
+    previous = np.where(has_previous, earlier[np.arange(len(values)), np.clip(previous_columns, 0, None)], np.nan)
+    return values[:, -1], previous
+
+
+def find_at_risk(terms=None, threshold=None, min_terms=None, coverage=None):
+    """
+    Students with results in the latest term who are at risk.
+
+    `terms` defaults to settled_terms(coverage). Returns (latest
+    AcademicTerm, [dict per flag]); a student can be flagged for both
+    reasons.
+    """
+    terms = settled_terms(coverage) if terms is None else terms
+    threshold = _setting('AVERAGE_THRESHOLD', AVERAGE_THRESHOLD) if threshold is None else threshold
+    min_terms = _setting('MIN_TERMS', MIN_TERMS) if min_terms is None else min_terms
+    if not terms:
+        return None, []
+
+    student_ids, averages, fails = term_matrices(terms)
+    last = len(terms) - 1
+    intercepts, slopes, counts = fit_trends(averages)
+    _, fail_slopes, _ = fit_trends(fails)
+
+    projected = intercepts + slopes * (last + 1)
+    current_average, _ = _latest_and_previous(averages)
+    fail_count, previous_fail_count = _latest_and_previous(fails)
+
+    eligible = ~np.isnan(current_average) & (counts >= max(min_terms, 2))
+    reasons = {
+        'declining': eligible & (slopes < 0) & (projected < threshold),
+        'failing': eligible & (fail_slopes > 0) & (fail_count > np.nan_to_num(previous_fail_count)),
+    }
+
+    flags = []
+    for reason, flagged in reasons.items():
+        for i in np.flatnonzero(flagged):
+            flags.append({
+                'student_id': int(student_ids[i]),
+                'reason': reason,
+                'current_average': round(float(current_average[i]), 2),
+                'projected_average': round(float(np.clip(projected[i], -999, 999)), 2),
+                'slope': round(float(slopes[i]), 4),
+                'fail_count': int(fail_count[i]),
+                'previous_fail_count': int(np.nan_to_num(previous_fail_count[i])),
+                'terms_used': int(counts[i]),
+            })
+    return terms[-1], flags
+
+
+def _teachers_by_class():
+    """{grade: [user ids of teachers who teach it]} from one query"""
+    teachers = defaultdict(list)
+    for user_id, classes in Teacher.objects.values_list('user_id', 'classes'):
+        for grade in (c.strip() for c in (classes or '').split(',')):
+            if grade:
+                teachers[grade].append(user_id)
+    return teachers
+
+
+def notify_teachers(flags):
+    """
+    One notification per teacher listing their newly flagged students, created
+    in a single bulk insert. Returns the number of notifications.
+    """
+    teachers = _teachers_by_class()
+    students_by_teacher = defaultdict(set)
+    for flag in flags:
+        for user_id in teachers.get(flag.student.grade, []):
+            students_by_teacher[user_id].add(flag.student)
+
+    link = reverse('at_risk_students')
+    notifications = []
+    for user_id, students in students_by_teacher.items():
+        names = sorted(str(student) for student in students)
+        content = ', '.join(names)
+        notifications.append(Notification(
+            user_id=user_id,
+            notification_type='risk',
+            title=f"{len(names)} student{'s' if len(names) != 1 else ''} at risk",
+            content=f"Results trending down: {content}",
+            short_content=content[:100],
+            link=link,
+            related_object_type='risk_flag',
+        ))
+    Notification.objects.bulk_create(notifications, batch_size=500)
+    return len(notifications)
+
+
+def flag_at_risk_students(notify=True, **options):
+    """
+    Raise RiskFlags for the latest term and retire flags no longer raised.
+
+    Flags are upserted in one statement; teachers are notified once about
+    flags they have not been told about. Returns a summary dict.
+    """
+    academic_term, found = find_at_risk(**options)
+    if academic_term is None:
+        return {'flagged': 0, 'retired': 0, 'notifications': 0}
+
+    flags = [RiskFlag(academic_term=academic_term, is_active=True, **flag) for flag in found]
+    with transaction.atomic():
+        RiskFlag.objects.bulk_create(
+            flags,
+            batch_size=500,
+            update_conflicts=True,
+            unique_fields=['student', 'academic_term', 'reason'],
+            update_fields=[
+                'current_average', 'projected_average', 'slope', 'fail_count', 'previous_fail_count',
+                'terms_used', 'is_active', 'updated_at',
+            ],
+        )
+        raised = {(flag['student_id'], flag['reason']) for flag in found}
+        stale = [
+            pk for pk, student_id, reason, term_id in RiskFlag.objects.filter(is_active=True).values_list(
+                'pk', 'student_id', 'reason', 'academic_term_id',
+            )
+            if term_id != academic_term.pk or (student_id, reason) not in raised
+        ]
+        RiskFlag.objects.filter(pk__in=stale).update(is_active=False)
+
+        notifications = 0
+        if notify:
+            pending = list(
+                RiskFlag.objects.filter(academic_term=academic_term, is_active=True, notified_at__isnull=True)
+                .select_related('student__user')
+            )
+            if pending:
+                notifications = notify_teachers(pending)
+                RiskFlag.objects.filter(pk__in=[flag.pk for flag in pending]).update(notified_at=timezone.now())
+
+    return {'flagged': len(flags), 'retired': len(stale), 'notifications': notifications}
@@ -1,5 +1,5 @@
 from django import forms
-from .models import Mark, Subject, StudentReport
+from .models import AcademicTerm, Mark, Subject, StudentReport
 from students.models import Student
 from teachers.models import Teacher
 
@@ -84,4 +84,106 @@ class StudentReportForm(forms.ModelForm):
             'principal_comment': forms.Textarea(attrs={'class': 'form-control', 'rows': 3}),
             'days_present': forms.NumberInput(attrs={'class': 'form-control'}),
             'total_days': forms.NumberInput(attrs={'class': 'form-control'}),
-        }
\ No newline at end of file
+        }
+
+TERM_CHOICES = [
+    ('Term 1', 'Term 1'),
+    ('Term 2', 'Term 2'),
+    ('Term 3', 'Term 3'),
+    ('Term 4', 'Term 4'),
+]
+
+class MarkFilterForm(forms.Form):
+    """Filters for the mark list; every field is optional"""
+    student_grade = forms.CharField(label='Class', max_length=10, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., Form 1'}))
+    section = forms.CharField(max_length=10, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., A'}))
+    subject = forms.ModelChoiceField(queryset=Subject.objects.all(), required=False, widget=forms.Select(attrs={'class': 'form-control'}))
+    term = forms.ChoiceField(choices=[('', 'All terms')] + TERM_CHOICES, required=False, widget=forms.Select(attrs={'class': 'form-control'}))
+    academic_year = forms.CharField(max_length=20, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., 2024'}))
+    grade = forms.ChoiceField(choices=[('', 'All grades')] + list(Mark.GRADE_CHOICES), required=False, widget=forms.Select(attrs={'class': 'form-control'}))
+    top_percent = forms.IntegerField(label='Top %', min_value=1, max_value=100, required=False, widget=forms.NumberInput(attrs={'class': 'form-control', 'placeholder': 'e.g., 10'}))
+    
+    def filter(self, marks):
+        """Apply the cleaned filters to a Mark queryset"""
+        data = self.cleaned_data
+        if data.get('student_grade'):
+            marks = marks.filter(student__grade=data['student_grade'])
+        if data.get('section'):
+            marks = marks.filter(student__section=data['section'])
+        if data.get('subject'):
+            marks = marks.filter(subject=data['subject'])
+        if data.get('term'):
+            marks = marks.filter(term=data['term'])
+        if data.get('academic_year'):
+            marks = marks.filter(academic_year=data['academic_year'])
+        if data.get('grade'):
+            marks = marks.filter(grade=data['grade'])
+        if data.get('top_percent'):
+            # Percentile ranks are within the subject and term (marks.stats)
+            marks = marks.filter(percentile_rank__gte=100 - data['top_percent'])
+        return marks
+
+class MarkSheetForm(forms.Form):
+    """Selects the class, subject and term a mark sheet covers"""
+    grade = forms.CharField(max_length=10, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., Form 1'}))
+    section = forms.CharField(max_length=10, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., A'}))
+    subject = forms.ModelChoiceField(queryset=Subject.objects.all(), widget=forms.Select(attrs={'class': 'form-control'}))
+    term = forms.ChoiceField(choices=TERM_CHOICES, widget=forms.Select(attrs={'class': 'form-control'}))
+    academic_year = forms.CharField(max_length=20, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., 2024'}))
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Default to the current term
+        academic_term = AcademicTerm.current()
+        if academic_term:
+            self.fields['term'].initial = academic_term.term
+            self.fields['academic_year'].initial = academic_term.academic_year
+    
+    def get_students(self):
+        """Students in the selected class"""
+        students = Student.objects.filter(grade=self.cleaned_data['grade'])
+        if self.cleaned_data.get('section'):
+            students = students.filter(section=self.cleaned_data['section'])
+        return students
+
+class ReportCardForm(forms.Form):
+    """Selects the class and term to print report cards for"""
+    OUTPUT_CHOICES = (
+        ('pdf', 'One PDF for printing'),
+        ('zip', 'ZIP of one PDF per student'),
+    )
+    
+    grade = forms.CharField(label='Class', max_length=10, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., Form 1'}))
+    section = forms.CharField(max_length=10, required=False, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., A'}))
+    term = forms.ChoiceField(choices=TERM_CHOICES, widget=forms.Select(attrs={'class': 'form-control'}))
+    academic_year = forms.CharField(max_length=20, widget=forms.TextInput(attrs={'class': 'form-control', 'placeholder': 'e.g., 2024'}))
+    output = forms.ChoiceField(choices=OUTPUT_CHOICES, initial='pdf', widget=forms.Select(attrs={'class': 'form-control'}))
+    
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # Default to the current term
+        academic_term = AcademicTerm.current()
+        if academic_term:
+            self.fields['term'].initial = academic_term.term
+            self.fields['academic_year'].initial = academic_term.academic_year
+
+class MarkSheetRowForm(forms.Form):
+    """One student's row on a mark sheet (validated without touching the database)"""
+    student_id = forms.IntegerField()
+    cat1_score = forms.DecimalField(max_digits=5, decimal_places=2, min_value=0, max_value=100, required=False)
+    cat2_score = forms.DecimalField(max_digits=5, decimal_places=2, min_value=0, max_value=100, required=False)
+    main_exam_score = forms.DecimalField(max_digits=5, decimal_places=2, min_value=0, max_value=100)
+    comments = forms.CharField(required=False)
+
+class MarkImportForm(forms.Form):
+    """Upload form for importing marks from exam software exports"""
+    file = forms.FileField(help_text='CSV or XLSX with columns: admission_number, subject_code, cat1_score, cat2_score, main_exam_score, term, academic_year, comments')
+    term = forms.ChoiceField(choices=[('', 'From file')] + TERM_CHOICES, required=False, help_text='Used for rows without a term column')
+    academic_year = forms.CharField(max_length=20, required=False, help_text='Used for rows without an academic_year column')
+    batch_size = forms.IntegerField(min_value=1, max_value=5000, initial=500)
+    
+    def clean_file(self):
+        file = self.cleaned_data['file']
+        if not file.name.lower().endswith(('.csv', '.xlsx', '.xlsm')):
+            raise forms.ValidationError('Upload a .csv or .xlsx file.')
+        return file
@@ -0,0 +1,90 @@
+# marks/grading.py
+from decimal import Decimal, ROUND_HALF_UP
+import numpy as np
+
+# Default weighting of the assessment components in percent (CAT1, CAT2, Main Exam)
+DEFAULT_WEIGHTS = (Decimal('20'), Decimal('20'), Decimal('60'))
+
+# Default lowest total score for each grade, highest grade first
+DEFAULT_BOUNDARIES = (
+    ('A', Decimal('80')),
+    ('B', Decimal('70')),
+    ('C', Decimal('60')),
+    ('D', Decimal('50')),
+    ('E', Decimal('40')),
+)
+FAIL_GRADE = 'F'
+
+PERFORMANCE_LEVELS = {
+    'A': 'Excellent',
+    'B': 'Very Good',
+    'C': 'Good',
+    'D': 'Satisfactory',
+    'E': 'Sufficient',
+    'F': 'Needs Improvement',
+}
+
+TWO_PLACES = Decimal('0.01')
+
+
+def calculate_total(cat1_score, cat2_score, main_exam_score, weights=DEFAULT_WEIGHTS):
+    """Weighted total score for one mark, rounded half-up to two decimal places"""
+    scores = (cat1_score, cat2_score, main_exam_score)
+    total = sum(Decimal(score or 0) * Decimal(weight) for score, weight in zip(scores, weights)) / 100
+    return total.quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+
+
+def grade_for_score(total_score, boundaries=DEFAULT_BOUNDARIES):
+    """Letter grade for a total score"""
+    for grade, minimum in boundaries:
+        if total_score >= minimum:
+            return grade
+    return FAIL_GRADE
+
+
+def grade_arrays(cat1_scores, cat2_scores, main_exam_scores, weights=DEFAULT_WEIGHTS, boundaries=DEFAULT_BOUNDARIES):
+    """
+    Vectorised calculate_total/grade_for_score over whole columns of scores.
+
+    Missing scores (None/NaN) count as 0. Returns (totals, grades) as NumPy
+    arrays; totals are rounded half-up to two decimal places like the scalar path.
+    """
+    scores = np.array([cat1_scores, cat2_scores, main_exam_scores], dtype=float)
+    scores = np.nan_to_num(scores, nan=0.0)
+    raw = np.asarray([float(w) for w in weights]) @ scores / 100
+
+    # Round half-up to cents; the epsilon absorbs binary float error (e.g. 56.125)
+    totals = np.floor(raw * 100 + 0.5 + 1e-9) / 100
+
+    # Boundaries ascending, so searchsorted gives the number of boundaries reached
+    minimums = np.array([float(minimum) for _, minimum in reversed(boundaries)])
+    letters = np.array([FAIL_GRADE] + [grade for grade, _ in reversed(boundaries)])
+    grades = letters[np.searchsorted(minimums, totals, side='right')]
+    return totals, grades
+
+
+def grade_marks(marks, scheme=None):
+    """
+    Fill in total_score and grade on a batch of Mark instances in one NumPy pass
+    per academic year, using the grading scheme for that year unless one is given.
+    """
+    from .models import GradingScheme
+
+    by_year = {}
+    for mark in marks:
+        by_year.setdefault(mark.academic_year, []).append(mark)
+
+    for academic_year, year_marks in by_year.items():
+        year_scheme = scheme or GradingScheme.for_year(academic_year)
+        totals, grades = grade_arrays(
+            [mark.cat1_score for mark in year_marks],
+            [mark.cat2_score for mark in year_marks],
+            [mark.main_exam_score for mark in year_marks],
+            weights=year_scheme.weights,
+            boundaries=year_scheme.boundaries,
+        )
+        for mark, total, grade in zip(year_marks, totals.tolist(), grades.tolist()):
+            mark.total_score = Decimal(f'{total:.2f}')
+            mark.grade = grade
+    return marks
+
@@ -0,0 +1,83 @@
+# marks/hot_queries.py
+"""
+Registry of the queries the marks pages run most, used by the
+explain_hot_queries command to print their plans against real data.
+
+Each entry builds its QuerySet with parameters sampled from the database
+(the latest term, a teacher, a class), or returns None when there is
+nothing to sample.
+"""
+from django.db.models import Avg, Count
+from students.models import Student
+from teachers.models import Teacher
+from .models import AcademicTerm, Mark
+
+HOT_QUERIES = {}
+
+
+def hot_query(name):
+    """Register a function returning a QuerySet under `name`"""
+    def register(function):
+        HOT_QUERIES[name] = function
+        return function
+    return register
+
+
+def _latest_term():
+    return AcademicTerm.with_marks().last()
+
+
+@hot_query('term_student_averages')
+def term_student_averages():
+    """Per-student averages for one term (analytics dashboard, term comparison, rankings)"""
+    term = _latest_term()
+    if term:
+        return (
+            Mark.objects.filter(term=term.term, academic_year=term.academic_year)
+            .values('student_id')
+            .annotate(average=Avg('total_score'), subjects=Count('id'))
+            .order_by()
+        )
+
+
+@hot_query('term_trend_statistics')
+def term_trend_statistics():
+    """Per-student grade counts for one AcademicTerm (trend builder)"""
+    from .trends import term_statistics_queryset
+    term = _latest_term()
+    if term:
+        return term_statistics_queryset(term)
+
+
+@hot_query('mark_list_teacher')
+def mark_list_teacher():
+    """First page of the mark list for a teacher's classes"""
+    grades = Student.objects.values_list('grade', flat=True)[:2]
+    return Mark.objects.filter(student__grade__in=list(grades)).select_related('student', 'subject')[:50]
+
+
+@hot_query('teacher_recent_marks')
+def teacher_recent_marks():
+    """Most recent marks entered by a teacher (teacher dashboard)"""
+    teacher = Teacher.objects.first()
+    if teacher:
+        return Mark.objects.filter(teacher=teacher).order_by('-date_entered')[:10]
+
+
+@hot_query('student_marks')
+def student_marks():
+    """All marks of one student with subjects (results page, performance detail)"""
+    student = Student.objects.filter(marks__isnull=False).first()
+    if student:
+        return Mark.objects.filter(student=student).select_related('subject')
+
+
+@hot_query('subject_top_percent')
+def subject_top_percent():
+    """Top 10% of a subject in the latest term (mark list "Top %" filter)"""
+    term = _latest_term()
+    mark = term and Mark.objects.filter(academic_term=term).first()
+    if mark:
+        return Mark.objects.filter(
+            subject_id=mark.subject_id, term=term.term, academic_year=term.academic_year, percentile_rank__gte=90,
+        )
@@ -0,0 +1,193 @@
+# marks/importers.py
+import csv
+import io
+from decimal import Decimal, InvalidOperation
+from students.models import Student
+from .bulk import upsert_marks, DEFAULT_BATCH_SIZE, MARK_UPDATE_FIELDS
+from .refresh import deferred_refresh
+from .models import Mark, Subject
+
+# Columns understood in an import file (header names are case-insensitive)
+IMPORT_COLUMNS = (
+    'admission_number', 'subject_code', 'cat1_score', 'cat2_score',
+    'main_exam_score', 'term', 'academic_year', 'comments',
+)
+REQUIRED_COLUMNS = ('admission_number', 'subject_code', 'main_exam_score')
+
+
+class MarkImportError(Exception):
+    """Raised when an import file cannot be read at all"""
+
+
+def iter_csv_rows(file):
+    """Stream rows from a CSV file object (text or binary)"""
+    if isinstance(file.read(0), bytes):
+        file = io.TextIOWrapper(file, encoding='utf-8-sig', newline='')
+    yield from csv.reader(file)
+
+
+def _cell_text(value):
+    """
+    An XLSX cell as the text a CSV would hold. Excel stores every number as
+    a float, so whole numbers lose their ".0" (admission number 1001 would
+    otherwise read as "1001.0" and match no student).
+    """
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return str(value)
+
+
+def iter_xlsx_rows(file):
+    """Stream rows from the first sheet of an XLSX file without loading the workbook"""
+    from openpyxl import load_workbook
+
+    workbook = load_workbook(file, read_only=True, data_only=True)
+    try:
+        for row in workbook.worksheets[0].iter_rows(values_only=True):
+            yield [_cell_text(value) for value in row]
+    finally:
+        workbook.close()
+
+
+def iter_rows(file, filename):
+    """Pick a row reader from the file extension"""
+    if filename.lower().endswith(('.xlsx', '.xlsm')):
+        return iter_xlsx_rows(file)
+    if filename.lower().endswith('.csv'):
+        return iter_csv_rows(file)
+    raise MarkImportError('Unsupported file type. Upload a .csv or .xlsx file.')
+
+
+def parse_score(value, required=False):
+    """Parse a 0-100 score; blank optional scores become None"""
+    value = (value or '').strip()
+    if not value:
+        if required:
+            raise ValueError('is required')
+        return None
+    try:
+        score = Decimal(value).quantize(Decimal('0.01'))
+    except InvalidOperation:
+        raise ValueError(f'"{value}" is not a number')
+    if score < 0 or score > 100:
+        raise ValueError(f'{value} is outside 0-100')
+    return score
+
+
+class MarkImporter:
+    """
+    Import marks from CSV/XLSX rows in batches.
+
+    Students and subjects are resolved through dicts loaded once up front and
+    rows are written with upsert_marks() every `batch_size` rows, so the cost
+    is a handful of queries per batch no matter how large the file is.
+    """
+
+    def __init__(self, term=None, academic_year=None, teacher=None, batch_size=DEFAULT_BATCH_SIZE):
+        self.term = term
+        self.academic_year = academic_year
+        self.teacher = teacher
+        self.batch_size = batch_size
+        self.imported = 0
+        self.errors = []
+        self.students = dict(Student.objects.values_list('admission_number', 'id'))
+        self.subjects = dict(Subject.objects.values_list('code', 'id'))
+
+    def run(self, rows):
+        """Import an iterable of rows whose first row is the header"""
+        rows = iter(rows)
+        try:
+            header = next(rows)
+        except StopIteration:
+            raise MarkImportError('The file is empty.')
+        columns = self._map_header(header)
+
+        # Ranks are refreshed once for the whole file, not per batch
+        with deferred_refresh():
+            batch = {}
+            # Row 1 is the header, so data rows are numbered from 2
+            for row_number, row in enumerate(rows, start=2):
+                if not any((cell or '').strip() for cell in row):
+                    continue
+                try:
+                    mark = self._build_mark(columns, row)
+                except ValueError as e:
+                    self.errors.append((row_number, str(e)))
+                    continue
+
+                # Later rows for the same key win; a batch must not repeat a key
+                key = (mark.student_id, mark.subject_id, mark.term, mark.academic_year)
+                batch[key] = mark
+                if len(batch) >= self.batch_size:
+                    self._flush(batch)
+
+            self._flush(batch)
+        return self
+
+    def _map_header(self, header):
+        columns = {}
+        for index, name in enumerate(header):
+            name = (name or '').strip().lower().replace(' ', '_')
+            if name in IMPORT_COLUMNS:
+                columns[name] = index
+
+        # Term and year may be given once for the whole file instead of per row
+        required = list(REQUIRED_COLUMNS)
+        if not self.term:
+            required.append('term')
+        if not self.academic_year:
+            required.append('academic_year')
+
+        missing = [name for name in required if name not in columns]
+        if missing:
+            raise MarkImportError(f"Missing column(s): {', '.join(missing)}")
+        return columns
+
+    def _build_mark(self, columns, row):
+        def cell(name):
+            index = columns.get(name)
+            if index is None or index >= len(row):
+                return ''
+            return (row[index] or '').strip()
+
+        admission_number = cell('admission_number')
+        student_id = self.students.get(admission_number)
+        if student_id is None:
+            raise ValueError(f'Unknown admission number "{admission_number}"')
+
+        subject_code = cell('subject_code')
+        subject_id = self.subjects.get(subject_code)
+        if subject_id is None:
+            raise ValueError(f'Unknown subject code "{subject_code}"')
+
+        scores = {}
+        for name in ('cat1_score', 'cat2_score', 'main_exam_score'):
+            try:
+                scores[name] = parse_score(cell(name), required=(name == 'main_exam_score'))
+            except ValueError as e:
+                raise ValueError(f'{name} {e}')
+
+        term = cell('term') or self.term
+        academic_year = cell('academic_year') or self.academic_year
+        if not term or not academic_year:
+            raise ValueError('term and academic_year are required')
+
+        return Mark(
+            student_id=student_id,
+            subject_id=subject_id,
+            teacher=self.teacher,
+            term=term,
+            academic_year=academic_year,
+            comments=cell('comments'),
+            **scores,
+        )
+
+    def _flush(self, batch):
+        if batch:
+            # Marks imported under a teacher are handed to them; without one
+            # (the admin upload) existing marks keep the teacher they have
+            update_fields = MARK_UPDATE_FIELDS + ['teacher'] if self.teacher else MARK_UPDATE_FIELDS
+            self.imported += upsert_marks(batch.values(), batch_size=self.batch_size, update_fields=update_fields)
+            batch.clear()
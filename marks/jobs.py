@@ -0,0 +1,200 @@
+# marks/jobs.py
+import logging
+import threading
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from datetime import timedelta
+from django.conf import settings
+from django.db import connections, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from .models import Mark, AnalyticsJob
+
+logger = logging.getLogger(__name__)
+
+# Errors kept on the job row; the count keeps going past this
+MAX_STORED_ERRORS = 50
+
+# Times a job is started before a lost run fails it instead of requeueing it
+MAX_ATTEMPTS = 3
+
+
+def enqueue_job(job):
+    """
+    Hand a saved AnalyticsJob to a worker once the current transaction commits.
+
+    Uses Celery when CELERY_BROKER_URL is configured. Without a broker the job
+    runs in a background thread of this process, or inline when
+    CELERY_TASK_ALWAYS_EAGER is set.
+    """
+    def dispatch():
+        if settings.CELERY_TASK_ALWAYS_EAGER:
+            run_job(job.pk)
+        elif settings.CELERY_BROKER_URL:
+            from .tasks import run_analytics_job
+            run_analytics_job.delay(job.pk)
+        else:
+            threading.Thread(target=_run_in_thread, args=(job.pk,), daemon=True).start()
+
+    transaction.on_commit(dispatch)
+    return job
+
+
+def _run_in_thread(job_id):
+    try:
+        run_job(job_id)
+    finally:
+        connections.close_all()
+
+
+def run_job(job_id):
+    """Claim a queued job and run it to completion; returns the job"""
+    now = timezone.now()
+    claimed = AnalyticsJob.objects.filter(pk=job_id, status='queued').update(
+        status='running', started_at=now, heartbeat_at=now, attempts=F('attempts') + 1,
+    )
+    job = AnalyticsJob.objects.get(pk=job_id)
+    if not claimed:
+        # Another worker has it, or it already ran
+        return job
+
+    try:
+        JOB_RUNNERS[job.kind](job)
+    except Exception as exc:
+        logger.exception("Analytics job %s failed", job.pk)
+        job.status = 'failed'
+        job.message = str(exc)
+    else:
+        job.status = 'completed'
+    job.finished_at = timezone.now()
+    job.save(update_fields=['status', 'message', 'result', 'finished_at'])
+    return job
+
+
+def recover_stale_jobs(now=None):
+    """
+    Put back jobs left 'running' by a worker that stopped (a web process
+    restarted under a background thread, say): a running job whose heartbeat
+    is older than ANALYTICS_JOB_STALE_AFTER seconds is queued again from the
+    start, or failed once it has been started MAX_ATTEMPTS times.
+    Returns the ids of the requeued jobs.
+    """
+    now = now or timezone.now()
+    cutoff = now - timedelta(seconds=settings.ANALYTICS_JOB_STALE_AFTER)
+    stale = AnalyticsJob.objects.filter(status='running').filter(
+        Q(heartbeat_at__lt=cutoff) | Q(heartbeat_at__isnull=True, started_at__lt=cutoff)
+    )
+    stale.filter(attempts__gte=MAX_ATTEMPTS).update(
+        status='failed', finished_at=now,
+        message=f'The job stopped responding {MAX_ATTEMPTS} times and was abandoned.',
+    )
+    requeued = list(stale.values_list('pk', flat=True))
+    if requeued:
+        logger.warning("Requeueing stale analytics jobs %s", requeued)
+        AnalyticsJob.objects.filter(pk__in=requeued, status='running').update(
+            status='queued', processed=0, error_count=0, errors=[], result={}, heartbeat_at=None,
+        )
+    return requeued
+
+
+def run_queued_jobs():
+    """Requeue stale jobs, then run every queued job in turn; returns how many were run"""
+    recover_stale_jobs()
+    count = 0
+    for job_id in AnalyticsJob.objects.filter(status='queued').order_by('created_at').values_list('pk', flat=True):
+        run_job(job_id)
+        count += 1
+    return count
+
+
+def _record_chunk(job, size, error=None):
+    job.processed += size
+    if error:
+        job.error_count += 1
+        if len(job.errors) < MAX_STORED_ERRORS:
+            job.errors.append(error)
+    job.heartbeat_at = timezone.now()
+    job.save(update_fields=['processed', 'error_count', 'errors', 'result', 'heartbeat_at'])
+
+
+def _init_worker():
+    # Spawned workers start without Django; forked ones already have it
+    import django
+    django.setup()
+
+
+def _run_chunks(job, function, chunks, options, workers):
+    """
+    Call function(chunk, options) for every chunk, in this process or across a
+    process pool, recording progress and errors on the job after each chunk.
+    Yields the result of every chunk that succeeded.
+    """
+    if workers <= 1:
+        for chunk in chunks:
+            try:
+                result = function(chunk, options)
+            except Exception as exc:
+                logger.exception("Analytics job %s chunk failed", job.pk)
+                _record_chunk(job, len(chunk), f"{chunk[0]}-{chunk[-1]}: {exc}")
+            else:
+                yield result
+                _record_chunk(job, len(chunk))
+        return
+
+    # Workers must open their own database connections
+    connections.close_all()
+    with ProcessPoolExecutor(max_workers=workers, initializer=_init_worker) as pool:
+        futures = {pool.submit(function, chunk, options): chunk for chunk in chunks}
+        for future in as_completed(futures):
+            chunk = futures[future]
+            try:
+                result = future.result()
+            except Exception as exc:
+                logger.error("Analytics job %s chunk failed: %s", job.pk, exc)
+                _record_chunk(job, len(chunk), f"{chunk[0]}-{chunk[-1]}: {exc}")
+            else:
+                yield result
+                _record_chunk(job, len(chunk))
+
+
+def _trend_chunk(student_ids, options):
+    from .trends import build_performance_trends
+    return build_performance_trends(student_ids=student_ids, **options)
+
+
+def run_performance_trends(job):
+    """Build performance trends for every student with marks, a chunk of students at a time"""
+    parameters = job.parameters
+    marks = Mark.objects.all()
+    if parameters.get('academic_year'):
+        marks = marks.filter(academic_year=parameters['academic_year'])
+    if parameters.get('term'):
+        marks = marks.filter(term=parameters['term'])
+    student_ids = sorted(set(marks.values_list('student_id', flat=True)))
+
+    chunk_size = parameters.get('chunk_size') or settings.ANALYTICS_JOB_CHUNK_SIZE
+    chunks = [student_ids[i:i + chunk_size] for i in range(0, len(student_ids), chunk_size)]
+    job.total = len(student_ids)
+    job.result = {'created': 0, 'updated': 0}
+    job.save(update_fields=['total', 'result'])
+
+    options = {
+        'academic_year': parameters.get('academic_year') or None,
+        'term': parameters.get('term') or None,
+        'include_recommendations': parameters.get('include_recommendations', True),
+        'update_existing': parameters.get('update_existing', True),
+        'generated_by': job.created_by,
+    }
+    workers = parameters.get('workers') or settings.ANALYTICS_JOB_WORKERS
+    for created, updated in _run_chunks(job, _trend_chunk, chunks, options, workers):
+        job.result['created'] += created
+        job.result['updated'] += updated
+
+    job.message = (
+        f"Generated {job.result['created'] + job.result['updated']} performance trends for {job.total} students "
+        f"({job.result['created']} new, {job.result['updated']} updated)."
+    )
+
+
+JOB_RUNNERS = {
+    'performance_trends': run_performance_trends,
+}
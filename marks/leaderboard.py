@@ -0,0 +1,110 @@
+# marks/leaderboard.py
+from django.db.models import Avg, Count, FloatField
+from django.db.models.functions import Rank
+from .cache import cached
+from .models import Mark, Subject
+from .reports import GroupedWindow, scored_marks
+
+
+def _ranking_queryset(term=None, academic_year=None, grade=None, section=None, subject_id=None, score='raw'):
+    marks = Mark.objects.all()
+    if term:
+        marks = marks.filter(term=term)
+    if academic_year:
+        marks = marks.filter(academic_year=academic_year)
+    if grade:
+        marks = marks.filter(student__grade=grade)
+    if section:
+        marks = marks.filter(student__section=section)
+    if subject_id:
+        marks = marks.filter(subject_id=subject_id)
+    marks, field = scored_marks(marks, score)
+
+    return (
+        marks.values(
+            'student_id', 'student__user__first_name', 'student__user__last_name',
+            'student__admission_number', 'student__grade', 'student__section',
+        )
+        .annotate(
+            average=Avg(field, output_field=FloatField()),
+            subject_count=Count('id'),
+            rank=GroupedWindow(
+                expression=Rank(),
+                order_by=Avg(field, output_field=FloatField()).desc(),
+            ),
+        )
+        .order_by('rank', 'student_id')
+    )
+
+
+def _entry(row):
+    return {
+        'rank': row['rank'],
+        'student_id': row['student_id'],
+        'name': f"{row['student__user__first_name']} {row['student__user__last_name']}".strip(),
+        'admission_number': row['student__admission_number'],
+        'grade': row['student__grade'],
+        'section': row['student__section'],
+        'average': round(row['average'], 2),
+        'subjects': row['subject_count'],
+    }
+
+
+def ranking(term=None, academic_year=None, grade=None, section=None, subject=None, score='raw'):
+    """
+    Every student in a scope, ranked by average score (1, 2, 2, 4).
+
+    The scope is the school, narrowed by any of grade, section and subject,
+    over one term (term and academic_year), one year or all marks. `score`
+    is 'raw' or 'standardized' (see marks.reports.SCORE_FIELDS). Computed
+    with one query and cached until a mark in the term is written.
+    """
+    subject_id = subject.pk if isinstance(subject, Subject) else subject
+    terms = [(term, academic_year)] if term and academic_year else None
+
+    def compute():
+        return [_entry(row) for row in _ranking_queryset(term, academic_year, grade, section, subject_id, score)]
+
+    return cached('leaderboard', terms, (term, academic_year, grade, section, subject_id, score), compute)
+
+
+def leaderboard(limit=10, **scope):
+    """Top and bottom `limit` students of a ranking() scope; bottom is worst first"""
+    entries = ranking(**scope)
+    return {
+        'size': len(entries),
+        'top': entries[:limit],
+        'bottom': entries[::-1][:limit],
+    }
+
+
+def top(limit=10, **scope):
+    return ranking(**scope)[:limit]
+
+
+def bottom(limit=10, **scope):
+    return ranking(**scope)[::-1][:limit]
+
+
+def at_a_glance(term, academic_year, limit=5, score='raw'):
+    """School, per-grade and per-subject leaderboards for a term"""
+    school = leaderboard(limit, term=term, academic_year=academic_year, score=score)
+    entries = ranking(term=term, academic_year=academic_year, score=score)
+    grades = sorted({entry['grade'] for entry in entries})
+
+    return {
+        'term': term,
+        'academic_year': academic_year,
+        'score': score,
+        'students': school['size'],
+        'average': round(sum(e['average'] for e in entries) / len(entries), 2) if entries else None,
+        'school': school,
+        'grades': {
+            grade: leaderboard(limit, term=term, academic_year=academic_year, grade=grade, score=score)
+            for grade in grades
+        },
+        'subjects': {
+            subject.name: leaderboard(limit, term=term, academic_year=academic_year, subject=subject.pk, score=score)
+            for subject in Subject.objects.order_by('name')
+        },
+    }
@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from marks.cache import cache_stats, reset_cache_stats
+
+class Command(BaseCommand):
+    help = 'Shows hit and miss counts of the analytics cache per cached result'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after printing them')
+    
+    def handle(self, *args, **options):
+        stats = cache_stats()
+        if not stats:
+            self.stdout.write('No analytics cache activity recorded')
+        
+        for name, counts in sorted(stats.items()):
+            hit_rate = f"{counts['hit_rate']}%" if counts['hit_rate'] is not None else '-'
+            self.stdout.write(f"{name:<24} hits {counts['hits']:>8}  misses {counts['misses']:>8}  hit rate {hit_rate}")
+        
+        if options['reset']:
+            reset_cache_stats()
+            self.stdout.write(self.style.SUCCESS('Counters reset'))
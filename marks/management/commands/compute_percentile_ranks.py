@@ -0,0 +1,24 @@
+from django.core.management.base import BaseCommand
+from marks.models import Mark
+from marks.stats import store_percentile_ranks
+
+class Command(BaseCommand):
+    help = "Stores every mark's percentile rank within its subject and term (also refreshed in the background as marks are written)"
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--term', help='Only this term, e.g. "Term 1" (needs --year)')
+        parser.add_argument('--year', dest='academic_year', help='Only this academic year')
+    
+    def handle(self, *args, **options):
+        terms = Mark.objects.values_list('term', 'academic_year').distinct().order_by('academic_year', 'term')
+        if options['academic_year']:
+            terms = terms.filter(academic_year=options['academic_year'])
+        if options['term']:
+            terms = terms.filter(term=options['term'])
+        
+        updated = 0
+        for term, academic_year in terms:
+            count = store_percentile_ranks(term, academic_year)
+            updated += count
+            self.stdout.write(f"{term} {academic_year}: {count} marks updated")
+        self.stdout.write(self.style.SUCCESS(f"Updated {updated} percentile ranks"))
@@ -0,0 +1,37 @@
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from marks.hot_queries import HOT_QUERIES
+
+class Command(BaseCommand):
+    help = 'Prints the query plan (EXPLAIN ANALYZE on PostgreSQL) of every registered hot query'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('names', nargs='*', help='Only explain these queries (default: all)')
+        parser.add_argument('--no-analyze', action='store_true',
+                            help='Plan only; do not execute the queries')
+        parser.add_argument('--list', action='store_true', help='List the registered queries and exit')
+    
+    def handle(self, *args, **options):
+        if options['list']:
+            for name, function in HOT_QUERIES.items():
+                self.stdout.write(f'{name}: {function.__doc__}')
+            return
+        
+        unknown = set(options['names']) - set(HOT_QUERIES)
+        if unknown:
+            raise CommandError(f"Unknown hot queries: {', '.join(sorted(unknown))}")
+        
+        # ANALYZE and BUFFERS are PostgreSQL options; other databases get their plain plan
+        explain_options = {}
+        if connection.vendor == 'postgresql' and not options['no_analyze']:
+            explain_options = {'analyze': True, 'buffers': True}
+        
+        for name in options['names'] or HOT_QUERIES:
+            queryset = HOT_QUERIES[name]()
+            self.stdout.write(self.style.MIGRATE_HEADING(f'== {name}'))
+            if queryset is None:
+                self.stdout.write('  no data to sample, skipped')
+                continue
+            self.stdout.write(str(queryset.query))
+            self.stdout.write(queryset.explain(**explain_options))
+            self.stdout.write('')
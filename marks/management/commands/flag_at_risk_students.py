@@ -0,0 +1,25 @@
+import time
+from django.core.management.base import BaseCommand
+from marks.early_warning import flag_at_risk_students
+
+class Command(BaseCommand):
+    help = 'Flags students whose results are trending towards failing and notifies their teachers (run nightly)'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--threshold', type=float, help='Projected average to flag below (default RISK_AVERAGE_THRESHOLD)')
+        parser.add_argument('--min-terms', type=int, help='Terms of results needed (default RISK_MIN_TERMS)')
+        parser.add_argument('--coverage', type=float, help="Share of the previous term's results a term in progress needs to count (default RISK_TERM_COVERAGE)")
+        parser.add_argument('--no-notify', action='store_true', help='Update flags without notifying teachers')
+    
+    def handle(self, *args, **options):
+        started = time.monotonic()
+        result = flag_at_risk_students(
+            notify=not options['no_notify'],
+            threshold=options['threshold'],
+            min_terms=options['min_terms'],
+            coverage=options['coverage'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"{result['flagged']} active flags, {result['retired']} retired, "
+            f"{result['notifications']} teachers notified in {time.monotonic() - started:.1f}s"
+        ))
@@ -0,0 +1,28 @@
+from django.core.management.base import BaseCommand
+from marks.reports import generate_student_reports, RANK_FUNCTIONS, SCORE_FIELDS
+
+class Command(BaseCommand):
+    help = 'Generates student reports with class positions for a term from the marks'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--term', required=True, help='Term, e.g. "Term 1"')
+        parser.add_argument('--year', dest='academic_year', required=True, help='Academic year, e.g. 2024')
+        parser.add_argument('--grade', help='Only this grade/class')
+        parser.add_argument('--section', help='Only this section')
+        parser.add_argument('--rank', dest='rank_method', choices=sorted(RANK_FUNCTIONS), default='competition',
+                            help='competition (1, 2, 2, 4) or dense (1, 2, 2, 3) ranking')
+        parser.add_argument('--score', choices=sorted(SCORE_FIELDS), default='raw',
+                            help='Rank on raw or standardized scores (run standardize_scores first)')
+    
+    def handle(self, *args, **options):
+        count = generate_student_reports(
+            options['term'],
+            options['academic_year'],
+            grade=options['grade'],
+            section=options['section'],
+            rank_method=options['rank_method'],
+            score=options['score'],
+        )
+        self.stdout.write(self.style.SUCCESS(
+            f"Generated {count} student reports for {options['term']} {options['academic_year']}"
+        ))
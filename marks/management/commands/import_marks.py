@@ -0,0 +1,52 @@
+import csv
+from django.core.management.base import BaseCommand, CommandError
+from marks.bulk import DEFAULT_BATCH_SIZE
+from marks.importers import MarkImporter, MarkImportError, iter_rows
+from teachers.models import Teacher
+
+class Command(BaseCommand):
+    help = 'Imports marks from a CSV or XLSX file (columns: admission_number, subject_code, cat1_score, cat2_score, main_exam_score, term, academic_year, comments)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='CSV or XLSX file to import')
+        parser.add_argument('--term', help='Term for rows without a term column, e.g. "Term 1"')
+        parser.add_argument('--year', dest='academic_year', help='Academic year for rows without an academic_year column')
+        parser.add_argument('--teacher', help='Employee ID of the teacher the marks are recorded under')
+        parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE, help='Rows written per upsert batch')
+        parser.add_argument('--errors', help='Write the per-row error report to this CSV file')
+
+    def handle(self, *args, **options):
+        teacher = None
+        if options['teacher']:
+            try:
+                teacher = Teacher.objects.get(employee_id=options['teacher'])
+            except Teacher.DoesNotExist:
+                raise CommandError(f"Teacher {options['teacher']} not found")
+
+        importer = MarkImporter(
+            term=options['term'],
+            academic_year=options['academic_year'],
+            teacher=teacher,
+            batch_size=options['batch_size'],
+        )
+
+        try:
+            with open(options['path'], 'rb') as f:
+                importer.run(iter_rows(f, options['path']))
+        except (OSError, MarkImportError) as e:
+            raise CommandError(str(e))
+
+        if options['errors'] and importer.errors:
+            with open(options['errors'], 'w', newline='') as f:
+                writer = csv.writer(f)
+                writer.writerow(['row', 'error'])
+                writer.writerows(importer.errors)
+
+        for row_number, error in importer.errors[:20]:
+            self.stdout.write(self.style.WARNING(f'Row {row_number}: {error}'))
+        if len(importer.errors) > 20:
+            self.stdout.write(self.style.WARNING(f'... and {len(importer.errors) - 20} more errors'))
+
+        self.stdout.write(self.style.SUCCESS(
+            f'Imported {importer.imported} marks ({len(importer.errors)} rows rejected)'
+        ))
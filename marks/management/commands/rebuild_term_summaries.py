@@ -0,0 +1,12 @@
+from django.core.management.base import BaseCommand
+from marks.summaries import rebuild_term_summaries
+
+class Command(BaseCommand):
+    help = 'Recomputes the per-student term summaries from the marks table'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--year', dest='academic_year', help='Only rebuild this academic year')
+    
+    def handle(self, *args, **options):
+        count = rebuild_term_summaries(academic_year=options['academic_year'])
+        self.stdout.write(self.style.SUCCESS(f'Rebuilt {count} term summaries'))
@@ -0,0 +1,55 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+from marks.grading import grade_marks
+from marks.models import Mark, GradingScheme
+from marks.refresh import deferred_refresh, subject_keys
+from marks.signals import marks_bulk_written, mark_keys
+
+class Command(BaseCommand):
+    help = 'Recomputes total scores and grades for a year with its current grading scheme'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--year', dest='academic_year', required=True, help='Academic year to regrade, e.g. 2024')
+        parser.add_argument('--term', help='Only regrade this term')
+        parser.add_argument('--batch-size', type=int, default=2000, help='Marks loaded and updated per chunk')
+    
+    def handle(self, *args, **options):
+        scheme = GradingScheme.for_year(options['academic_year'])
+        self.stdout.write(f'Regrading {options["academic_year"]} with {scheme}')
+        
+        marks = Mark.objects.filter(academic_year=options['academic_year'])
+        if options['term']:
+            marks = marks.filter(term=options['term'])
+        marks = marks.only(
+            'id', 'student_id', 'subject_id', 'term', 'academic_year', 'cat1_score', 'cat2_score', 'main_exam_score', 'total_score', 'grade'
+        ).order_by('id')
+        
+        # Ranks are refreshed once for the whole run, not per chunk
+        with deferred_refresh():
+            checked = changed = 0
+            last_id = 0
+            while True:
+                # Walk the table by primary key so each chunk is an index range scan
+                chunk = list(marks.filter(id__gt=last_id)[:options['batch_size']])
+                if not chunk:
+                    break
+                last_id = chunk[-1].id
+                
+                previous = {mark.id: (mark.total_score, mark.grade) for mark in chunk}
+                grade_marks(chunk, scheme)
+                updated = [mark for mark in chunk if previous[mark.id] != (mark.total_score, mark.grade)]
+                
+                if updated:
+                    # bulk_update() leaves auto_now fields alone
+                    now = timezone.now()
+                    for mark in updated:
+                        mark.last_modified = now
+                    with transaction.atomic():
+                        Mark.objects.bulk_update(updated, ['total_score', 'grade', 'last_modified'])
+                        marks_bulk_written.send(sender=Mark, keys=mark_keys(updated), subjects=subject_keys(updated))
+                
+                checked += len(chunk)
+                changed += len(updated)
+        
+        self.stdout.write(self.style.SUCCESS(f'Checked {checked} marks, regraded {changed}'))
@@ -0,0 +1,39 @@
+import time
+from django.core.management.base import BaseCommand, CommandError
+from marks.report_cards import merged_report_cards, render_report_cards, report_card_data, stream_report_cards_zip
+
+class Command(BaseCommand):
+    help = 'Renders report card PDFs for a term, optionally writing them to one PDF or a ZIP file'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--term', required=True, help='Term, e.g. "Term 1"')
+        parser.add_argument('--year', dest='academic_year', required=True, help='Academic year, e.g. 2024')
+        parser.add_argument('--grade', help='Only this grade/class')
+        parser.add_argument('--section', help='Only this section')
+        parser.add_argument('--workers', type=int, help='Worker processes (default REPORT_CARD_WORKERS)')
+        parser.add_argument('--output', help='Write a merged .pdf or a .zip of single cards to this path')
+    
+    def handle(self, *args, **options):
+        output = options['output']
+        if output and not output.endswith(('.pdf', '.zip')):
+            raise CommandError('--output must end in .pdf or .zip')
+        
+        started = time.monotonic()
+        cards = report_card_data(options['term'], options['academic_year'], options['grade'], options['section'])
+        if not cards:
+            raise CommandError('No student reports for this term; run generate_student_reports first')
+        
+        if output and output.endswith('.pdf'):
+            with open(output, 'wb') as merged:
+                merged.write(merged_report_cards(cards))
+        else:
+            rendered = render_report_cards(cards, workers=options['workers'])
+            if output:
+                with open(output, 'wb') as archive:
+                    for chunk in stream_report_cards_zip(rendered):
+                        archive.write(chunk)
+        
+        self.stdout.write(self.style.SUCCESS(
+            f"Rendered {len(cards)} report cards in {time.monotonic() - started:.1f}s"
+            + (f" to {output}" if output else '')
+        ))
@@ -0,0 +1,9 @@
+from django.core.management.base import BaseCommand
+from marks.jobs import run_queued_jobs
+
+class Command(BaseCommand):
+    help = 'Requeues analytics jobs lost with their worker, then runs queued jobs in this process (for deployments without a Celery broker)'
+    
+    def handle(self, *args, **options):
+        count = run_queued_jobs()
+        self.stdout.write(self.style.SUCCESS(f'Ran {count} analytics jobs'))
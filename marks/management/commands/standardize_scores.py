@@ -0,0 +1,21 @@
+from django.core.management.base import BaseCommand
+from marks.models import Mark
+from marks.stats import store_standardized_scores
+
+class Command(BaseCommand):
+    help = 'Stores standardized scores (adjusted for the class each mark was given in) for a year'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--year', dest='academic_year', help='Academic year, e.g. 2024 (default: every year)')
+        parser.add_argument('--term', help='Only this term, e.g. "Term 1"')
+    
+    def handle(self, *args, **options):
+        if options['academic_year']:
+            years = [options['academic_year']]
+        else:
+            years = Mark.objects.values_list('academic_year', flat=True).distinct().order_by('academic_year')
+        
+        for academic_year in years:
+            count = store_standardized_scores(academic_year, options['term'])
+            self.stdout.write(f"{academic_year}: {count} marks updated")
+        self.stdout.write(self.style.SUCCESS('Standardized scores stored'))
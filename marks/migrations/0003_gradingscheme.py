@@ -0,0 +1,38 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:35
+
+from decimal import Decimal
+import django.core.validators
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0002_performancetrend'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='GradingScheme',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('academic_year', models.CharField(max_length=20)),
+                ('version', models.PositiveIntegerField(default=1)),
+                ('name', models.CharField(blank=True, max_length=100)),
+                ('cat1_weight', models.DecimalField(decimal_places=2, default=Decimal('20'), max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('cat2_weight', models.DecimalField(decimal_places=2, default=Decimal('20'), max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('main_exam_weight', models.DecimalField(decimal_places=2, default=Decimal('60'), max_digits=5, validators=[django.core.validators.MinValueValidator(0), django.core.validators.MaxValueValidator(100)])),
+                ('grade_a_min', models.DecimalField(decimal_places=2, default=Decimal('80'), max_digits=5)),
+                ('grade_b_min', models.DecimalField(decimal_places=2, default=Decimal('70'), max_digits=5)),
+                ('grade_c_min', models.DecimalField(decimal_places=2, default=Decimal('60'), max_digits=5)),
+                ('grade_d_min', models.DecimalField(decimal_places=2, default=Decimal('50'), max_digits=5)),
+                ('grade_e_min', models.DecimalField(decimal_places=2, default=Decimal('40'), max_digits=5)),
+                ('is_active', models.BooleanField(default=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+            ],
+            options={
+                'ordering': ['-academic_year', '-version'],
+                'unique_together': {('academic_year', 'version')},
+            },
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:36
+
+from django.db import migrations
+from django.db.models import Count, Max
+
+
+def remove_duplicate_reports(apps, schema_editor):
+    """Keep only the newest report per student/term/year before adding the constraint"""
+    StudentReport = apps.get_model('marks', 'StudentReport')
+    # Only groups that hold more than one report; the rest need no DELETE
+    duplicates = (
+        StudentReport.objects.values('student', 'term', 'academic_year')
+        .annotate(latest_id=Max('id'), n=Count('id'))
+        .filter(n__gt=1)
+    )
+    for duplicate in duplicates:
+        StudentReport.objects.filter(
+            student=duplicate['student'],
+            term=duplicate['term'],
+            academic_year=duplicate['academic_year'],
+        ).exclude(id=duplicate['latest_id']).delete()
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0002_student_initial_password'),
+        ('marks', '0003_gradingscheme'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_reports, migrations.RunPython.noop),
+        migrations.AlterUniqueTogether(
+            name='studentreport',
+            unique_together={('student', 'term', 'academic_year')},
+        ),
+    ]
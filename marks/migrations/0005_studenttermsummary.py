@@ -0,0 +1,60 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:38
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def populate_term_summaries(apps, schema_editor):
+    from marks.summaries import MARK_COLUMNS, summarize_rows
+    
+    Mark = apps.get_model('marks', 'Mark')
+    StudentTermSummary = apps.get_model('marks', 'StudentTermSummary')
+    
+    rows = Mark.objects.order_by('student_id', 'term', 'academic_year').values_list(*MARK_COLUMNS)
+    batch = []
+    for summary in summarize_rows(rows.iterator(chunk_size=5000), model=StudentTermSummary):
+        batch.append(summary)
+        if len(batch) >= 1000:
+            StudentTermSummary.objects.bulk_create(batch)
+            batch = []
+    StudentTermSummary.objects.bulk_create(batch)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0002_student_initial_password'),
+        ('marks', '0004_studentreport_unique'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentTermSummary',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('term', models.CharField(max_length=20)),
+                ('academic_year', models.CharField(max_length=20)),
+                ('average_score', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('subject_count', models.PositiveIntegerField(default=0)),
+                ('pass_count', models.PositiveIntegerField(default=0)),
+                ('grade_a_count', models.PositiveIntegerField(default=0)),
+                ('grade_b_count', models.PositiveIntegerField(default=0)),
+                ('grade_c_count', models.PositiveIntegerField(default=0)),
+                ('grade_d_count', models.PositiveIntegerField(default=0)),
+                ('grade_e_count', models.PositiveIntegerField(default=0)),
+                ('grade_f_count', models.PositiveIntegerField(default=0)),
+                ('best_score', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('worst_score', models.DecimalField(blank=True, decimal_places=2, max_digits=5, null=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('best_subject', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='marks.subject')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='term_summaries', to='students.student')),
+                ('worst_subject', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='marks.subject')),
+            ],
+            options={
+                'ordering': ['-academic_year', '-term', 'student'],
+                'indexes': [models.Index(fields=['academic_year', 'term'], name='marks_stude_academi_4f5d6e_idx')],
+                'unique_together': {('student', 'term', 'academic_year')},
+            },
+        ),
+        migrations.RunPython(populate_term_summaries, migrations.RunPython.noop),
+    ]
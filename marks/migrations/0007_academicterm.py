@@ -0,0 +1,56 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_academic_terms(apps, schema_editor):
+    from marks.terms import link_academic_terms
+    
+    link_academic_terms(
+        apps.get_model('marks', 'AcademicTerm'),
+        [apps.get_model('marks', name) for name in ('Mark', 'StudentReport', 'PerformanceTrend')],
+    )
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0006_analyticsjob'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='AcademicTerm',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('academic_year', models.CharField(max_length=20)),
+                ('ordinal', models.PositiveSmallIntegerField(help_text='Term number within the year, e.g. 1 for Term 1')),
+                ('index', models.PositiveIntegerField(db_index=True, editable=False, help_text='Chronological position, e.g. 20241 for Term 1 2024')),
+                ('start_date', models.DateField(blank=True, null=True)),
+                ('end_date', models.DateField(blank=True, null=True)),
+                ('is_current', models.BooleanField(default=False)),
+            ],
+            options={
+                'verbose_name': 'Academic Term',
+                'verbose_name_plural': 'Academic Terms',
+                'ordering': ['-index'],
+                'unique_together': {('academic_year', 'ordinal')},
+            },
+        ),
+        migrations.AddField(
+            model_name='mark',
+            name='academic_term',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='marks', to='marks.academicterm'),
+        ),
+        migrations.AddField(
+            model_name='performancetrend',
+            name='academic_term',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='performance_trends', to='marks.academicterm'),
+        ),
+        migrations.AddField(
+            model_name='studentreport',
+            name='academic_term',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='reports', to='marks.academicterm'),
+        ),
+        migrations.RunPython(link_academic_terms, migrations.RunPython.noop),
+    ]
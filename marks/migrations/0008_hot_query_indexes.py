@@ -0,0 +1,25 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0007_academicterm'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mark',
+            index=models.Index(fields=['academic_year', 'term', 'student'], include=('total_score', 'grade'), name='mark_term_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mark',
+            index=models.Index(fields=['academic_term', 'student'], include=('subject', 'total_score', 'grade'), name='mark_acterm_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='mark',
+            index=models.Index(fields=['teacher', '-date_entered'], name='mark_teacher_entered_idx'),
+        ),
+    ]
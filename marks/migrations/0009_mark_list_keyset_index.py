@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:51
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0008_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='mark',
+            index=models.Index(fields=['academic_year', 'term', 'id'], name='mark_list_keyset_idx'),
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0009_mark_list_keyset_index'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mark',
+            name='percentile_rank',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+        migrations.AddIndex(
+            model_name='mark',
+            index=models.Index(fields=['subject', 'academic_year', 'term', 'percentile_rank'], name='mark_subject_pct_idx'),
+        ),
+    ]
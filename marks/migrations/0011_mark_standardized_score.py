@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:02
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0010_mark_percentile_rank'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='mark',
+            name='standardized_score',
+            field=models.DecimalField(blank=True, decimal_places=2, editable=False, max_digits=5, null=True),
+        ),
+    ]
@@ -0,0 +1,39 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:04
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0003_student_class_index'),
+        ('marks', '0011_mark_standardized_score'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RiskFlag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('reason', models.CharField(choices=[('declining', 'Projected average below threshold'), ('failing', 'Number of failed subjects growing')], max_length=20)),
+                ('current_average', models.DecimalField(decimal_places=2, max_digits=5)),
+                ('projected_average', models.DecimalField(decimal_places=2, max_digits=6)),
+                ('slope', models.FloatField(help_text='Change in average per term')),
+                ('fail_count', models.PositiveIntegerField(default=0)),
+                ('previous_fail_count', models.PositiveIntegerField(default=0)),
+                ('terms_used', models.PositiveIntegerField(default=0)),
+                ('is_active', models.BooleanField(default=True)),
+                ('notified_at', models.DateTimeField(blank=True, null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('updated_at', models.DateTimeField(auto_now=True)),
+                ('academic_term', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='risk_flags', to='marks.academicterm')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='risk_flags', to='students.student')),
+            ],
+            options={
+                'ordering': ['-academic_term__index', 'projected_average'],
+                'indexes': [models.Index(fields=['is_active', 'academic_term'], name='riskflag_active_term_idx'), models.Index(fields=['student', 'is_active'], name='riskflag_student_active_idx')],
+                'unique_together': {('student', 'academic_term', 'reason')},
+            },
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:08
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0012_riskflag'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='mark',
+            name='last_modified',
+            field=models.DateTimeField(auto_now=True),
+        ),
+    ]
@@ -0,0 +1,23 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0013_mark_last_modified_datetime'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='analyticsjob',
+            name='attempts',
+            field=models.PositiveSmallIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='analyticsjob',
+            name='heartbeat_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -3,6 +3,12 @@ from students.models import Student
 # Remove: from teachers.models import Teacher
 from django.core.validators import MinValueValidator, MaxValueValidator
 from django.db.models import Avg, Sum, Count
+from django.core.exceptions import ValidationError
+from django.utils.functional import cached_property
+from .grading import (
+    calculate_total, grade_for_score, DEFAULT_WEIGHTS, DEFAULT_BOUNDARIES, PERFORMANCE_LEVELS,
+)
+from .terms import term_index, term_label, current_term, assign_academic_terms
 
 class Subject(models.Model):
     SUBJECT_CATEGORIES = (
@@ -24,6 +30,116 @@ class Subject(models.Model):
     class Meta:
         ordering = ['category', 'name']
 
+class GradingScheme(models.Model):
+    """Assessment weights and grade boundaries, versioned per academic year"""
+    academic_year = models.CharField(max_length=20)
+    version = models.PositiveIntegerField(default=1)
+    name = models.CharField(max_length=100, blank=True)
+    
+    # Weights in percent; must add up to 100
+    cat1_weight = models.DecimalField(max_digits=5, decimal_places=2, default=DEFAULT_WEIGHTS[0], validators=[MinValueValidator(0), MaxValueValidator(100)])
+    cat2_weight = models.DecimalField(max_digits=5, decimal_places=2, default=DEFAULT_WEIGHTS[1], validators=[MinValueValidator(0), MaxValueValidator(100)])
+    main_exam_weight = models.DecimalField(max_digits=5, decimal_places=2, default=DEFAULT_WEIGHTS[2], validators=[MinValueValidator(0), MaxValueValidator(100)])
+    
+    # Lowest total score for each grade; anything below grade_e_min is an F
+    grade_a_min = models.DecimalField(max_digits=5, decimal_places=2, default=DEFAULT_BOUNDARIES[0][1])
+    grade_b_min = models.DecimalField(max_digits=5, decimal_places=2, default=DEFAULT_BOUNDARIES[1][1])
+    grade_c_min = models.DecimalField(max_digits=5, decimal_places=2, default=DEFAULT_BOUNDARIES[2][1])
+    grade_d_min = models.DecimalField(max_digits=5, decimal_places=2, default=DEFAULT_BOUNDARIES[3][1])
+    grade_e_min = models.DecimalField(max_digits=5, decimal_places=2, default=DEFAULT_BOUNDARIES[4][1])
+    
+    is_active = models.BooleanField(default=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['-academic_year', '-version']
+        unique_together = ['academic_year', 'version']
+    
+    def __str__(self):
+        return f"{self.name or 'Grading scheme'} {self.academic_year} v{self.version}"
+    
+    def clean(self):
+        if sum(self.weights) != 100:
+            raise ValidationError('CAT1, CAT2 and main exam weights must add up to 100.')
+        minimums = [minimum for _, minimum in self.boundaries]
+        if minimums != sorted(minimums, reverse=True):
+            raise ValidationError('Grade boundaries must decrease from A to E.')
+    
+    @property
+    def weights(self):
+        return (self.cat1_weight, self.cat2_weight, self.main_exam_weight)
+    
+    @property
+    def boundaries(self):
+        return (
+            ('A', self.grade_a_min),
+            ('B', self.grade_b_min),
+            ('C', self.grade_c_min),
+            ('D', self.grade_d_min),
+            ('E', self.grade_e_min),
+        )
+    
+    @classmethod
+    def for_year(cls, academic_year):
+        """Latest active scheme for a year, or an unsaved default scheme"""
+        scheme = cls.objects.filter(academic_year=academic_year, is_active=True).order_by('-version').first()
+        return scheme or cls(academic_year=academic_year)
+    
+    def total_for(self, cat1_score, cat2_score, main_exam_score):
+        return calculate_total(cat1_score, cat2_score, main_exam_score, self.weights)
+    
+    def grade_for(self, total_score):
+        return grade_for_score(total_score, self.boundaries)
+
+class AcademicTerm(models.Model):
+    """A term of an academic year; `index` orders terms chronologically"""
+    academic_year = models.CharField(max_length=20)
+    ordinal = models.PositiveSmallIntegerField(help_text="Term number within the year, e.g. 1 for Term 1")
+    index = models.PositiveIntegerField(db_index=True, editable=False,
+                                        help_text="Chronological position, e.g. 20241 for Term 1 2024")
+    start_date = models.DateField(null=True, blank=True)
+    end_date = models.DateField(null=True, blank=True)
+    is_current = models.BooleanField(default=False)
+    
+    class Meta:
+        ordering = ['-index']
+        unique_together = ['academic_year', 'ordinal']
+        verbose_name = "Academic Term"
+        verbose_name_plural = "Academic Terms"
+    
+    def __str__(self):
+        return f"{self.term} {self.academic_year}"
+    
+    @property
+    def term(self):
+        """Label used by the term fields of marks, reports and trends"""
+        return term_label(self.ordinal)
+    
+    def save(self, *args, **kwargs):
+        self.index = term_index(self.academic_year, self.ordinal)
+        if self.is_current:
+            AcademicTerm.objects.filter(is_current=True).exclude(pk=self.pk).update(is_current=False)
+        super().save(*args, **kwargs)
+    
+    def get_previous(self):
+        return AcademicTerm.objects.filter(index__lt=self.index).order_by('-index').first()
+    
+    def get_next(self):
+        return AcademicTerm.objects.filter(index__gt=self.index).order_by('index').first()
+    
+    @classmethod
+    def current(cls):
+        """The current term, cached process-wide"""
+        return current_term()
+    
+    @classmethod
+    def with_marks(cls):
+        """Terms that have marks, oldest first"""
+        return cls.objects.filter(
+            models.Exists(Mark.objects.filter(academic_term=models.OuterRef('pk')))
+        ).order_by('index')
+
+
 class Mark(models.Model):
     GRADE_CHOICES = (
         ('A', 'A (Excellent)'),
@@ -47,42 +163,52 @@ class Mark(models.Model):
     # Calculated fields
     total_score = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0), MaxValueValidator(100)])
     grade = models.CharField(max_length=1, choices=GRADE_CHOICES)
+    # Percent of the term's marks in the subject below this one (marks.stats)
+    percentile_rank = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, editable=False)
+    # Score adjusted for the class it was marked in (marks.stats.store_standardized_scores)
+    standardized_score = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True, editable=False)
     
     term = models.CharField(max_length=20)  # e.g., "Term 1 2024"
     academic_year = models.CharField(max_length=20)
+    academic_term = models.ForeignKey(AcademicTerm, on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='marks', editable=False)
     
     comments = models.TextField(blank=True)
     date_entered = models.DateField(auto_now_add=True)
-    last_modified = models.DateField(auto_now=True)
+    # A timestamp rather than a date so results pages can be validated by it
+    last_modified = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-academic_year', 'term', 'student']
         unique_together = ['student', 'subject', 'term', 'academic_year']
+        indexes = [
+            # Term filters grouped by student (term analytics, rankings, summaries);
+            # the included columns let PostgreSQL answer them from the index alone
+            models.Index(fields=['academic_year', 'term', 'student'], include=['total_score', 'grade'],
+                         name='mark_term_student_idx'),
+            # Same access by AcademicTerm (trend builder)
+            models.Index(fields=['academic_term', 'student'], include=['subject', 'total_score', 'grade'],
+                         name='mark_acterm_student_idx'),
+            # Teacher dashboard: a teacher's most recent marks
+            models.Index(fields=['teacher', '-date_entered'], name='mark_teacher_entered_idx'),
+            # Keyset pagination of the mark list (scanned backwards, newest first)
+            models.Index(fields=['academic_year', 'term', 'id'], name='mark_list_keyset_idx'),
+            # "Top N% in a subject" filters
+            models.Index(fields=['subject', 'academic_year', 'term', 'percentile_rank'], name='mark_subject_pct_idx'),
+        ]
     
     def save(self, *args, **kwargs):
-        # Calculate total score (CAT1: 20%, CAT2: 20%, Main Exam: 60%)
-        cat1 = self.cat1_score or 0
-        cat2 = self.cat2_score or 0
-        main_exam = self.main_exam_score or 0
-        
-        self.total_score = (cat1 * 0.2) + (cat2 * 0.2) + (main_exam * 0.6)
-        
-        # Determine grade
-        if self.total_score >= 80:
-            self.grade = 'A'
-        elif self.total_score >= 70:
-            self.grade = 'B'
-        elif self.total_score >= 60:
-            self.grade = 'C'
-        elif self.total_score >= 50:
-            self.grade = 'D'
-        elif self.total_score >= 40:
-            self.grade = 'E'
-        else:
-            self.grade = 'F'
+        # Calculate total score and grade with the grading scheme for the year
+        scheme = GradingScheme.for_year(self.academic_year)
+        self.total_score = scheme.total_for(self.cat1_score, self.cat2_score, self.main_exam_score)
+        self.grade = scheme.grade_for(self.total_score)
+        assign_academic_terms([self])
         
         super().save(*args, **kwargs)
     
+    def get_performance_label(self):
+        return PERFORMANCE_LEVELS.get(self.grade, '')
+    
     def __str__(self):
         return f"{self.student} - {self.subject} - {self.total_score}% ({self.grade})"
 
@@ -90,6 +216,8 @@ class StudentReport(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='reports')
     term = models.CharField(max_length=20)
     academic_year = models.CharField(max_length=20)
+    academic_term = models.ForeignKey(AcademicTerm, on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='reports', editable=False)
     
     # Overall performance
     average_score = models.DecimalField(max_digits=5, decimal_places=2, validators=[MinValueValidator(0), MaxValueValidator(100)])
@@ -111,8 +239,70 @@ class StudentReport(models.Model):
     def __str__(self):
         return f"{self.student} - {self.term} {self.academic_year}"
     
+    def save(self, *args, **kwargs):
+        assign_academic_terms([self])
+        super().save(*args, **kwargs)
+    
     class Meta:
         ordering = ['-academic_year', 'term', 'student']
+        unique_together = ['student', 'term', 'academic_year']
+
+
+class StudentTermSummary(models.Model):
+    """
+    Per-student, per-term aggregates of the marks table.
+    
+    Maintained by marks.summaries whenever marks are written so pages can read
+    one row instead of aggregating marks on every request.
+    """
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='term_summaries')
+    term = models.CharField(max_length=20)
+    academic_year = models.CharField(max_length=20)
+    
+    average_score = models.DecimalField(max_digits=5, decimal_places=2)
+    subject_count = models.PositiveIntegerField(default=0)
+    pass_count = models.PositiveIntegerField(default=0)
+    
+    grade_a_count = models.PositiveIntegerField(default=0)
+    grade_b_count = models.PositiveIntegerField(default=0)
+    grade_c_count = models.PositiveIntegerField(default=0)
+    grade_d_count = models.PositiveIntegerField(default=0)
+    grade_e_count = models.PositiveIntegerField(default=0)
+    grade_f_count = models.PositiveIntegerField(default=0)
+    
+    best_subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    best_score = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    worst_subject = models.ForeignKey(Subject, on_delete=models.SET_NULL, null=True, blank=True, related_name='+')
+    worst_score = models.DecimalField(max_digits=5, decimal_places=2, null=True, blank=True)
+    
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-academic_year', '-term', 'student']
+        unique_together = ['student', 'term', 'academic_year']
+        indexes = [
+            models.Index(fields=['academic_year', 'term']),
+        ]
+    
+    def __str__(self):
+        return f"{self.student} - {self.term} {self.academic_year}: {self.average_score}"
+    
+    @property
+    def grade_counts(self):
+        return {
+            'A': self.grade_a_count,
+            'B': self.grade_b_count,
+            'C': self.grade_c_count,
+            'D': self.grade_d_count,
+            'E': self.grade_e_count,
+            'F': self.grade_f_count,
+        }
+    
+    @property
+    def pass_rate(self):
+        if self.subject_count > 0:
+            return (self.pass_count / self.subject_count) * 100
+        return 0
 
 
     # Add this at the end of marks/models.py, before the closing of the file
@@ -138,6 +328,8 @@ class PerformanceTrend(models.Model):
     student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='performance_trends')
     term = models.CharField(max_length=20)
     academic_year = models.CharField(max_length=20)
+    academic_term = models.ForeignKey(AcademicTerm, on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='performance_trends', editable=False)
     
     # Performance metrics
     current_term_average = models.DecimalField(max_digits=5, decimal_places=2)
@@ -208,25 +400,22 @@ class PerformanceTrend(models.Model):
     def __str__(self):
         return f"{self.student.full_name} - {self.term} {self.academic_year} ({self.get_trend_display()})"
     
+    def save(self, *args, **kwargs):
+        assign_academic_terms([self])
+        super().save(*args, **kwargs)
+    
     @property
     def student_name(self):
         return self.student.full_name
     
+    @cached_property
+    def grading_scheme(self):
+        return GradingScheme.for_year(self.academic_year)
+    
     @property
     def performance_level(self):
         """Determine performance level based on average score"""
-        if self.current_term_average >= 80:
-            return 'Excellent'
-        elif self.current_term_average >= 70:
-            return 'Very Good'
-        elif self.current_term_average >= 60:
-            return 'Good'
-        elif self.current_term_average >= 50:
-            return 'Satisfactory'
-        elif self.current_term_average >= 40:
-            return 'Sufficient'
-        else:
-            return 'Needs Improvement'
+        return PERFORMANCE_LEVELS[self.grading_scheme.grade_for(self.current_term_average)]
     
     @property
     def trend_indicator(self):
@@ -270,59 +459,66 @@ class PerformanceTrend(models.Model):
         else:
             self.pass_rate = 0
     
-    def update_from_marks(self, marks_queryset):
-        """Update trend data from marks queryset"""
-        if not marks_queryset.exists():
+    def update_from_marks(self):
+        """Update trend data from the student's term summary"""
+        summary = StudentTermSummary.objects.filter(
+            student=self.student,
+            term=self.term,
+            academic_year=self.academic_year
+        ).select_related('best_subject', 'worst_subject').first()
+        
+        if not summary:
             return False
         
-        # Calculate average score
-        avg_score = marks_queryset.aggregate(avg=Avg('total_score'))['avg']
-        self.current_term_average = avg_score or 0
+        self.update_from_summary(summary)
+        self.save()
+        return True
+    
+    def update_from_summary(self, summary):
+        """Copy averages, grade counts and strongest/weakest subject from a term summary"""
+        self.current_term_average = summary.average_score
         
         # Count subjects and passed subjects
-        self.total_subjects = marks_queryset.count()
-        self.subjects_passed = marks_queryset.filter(grade__in=['A', 'B', 'C', 'D', 'E']).count()
+        self.total_subjects = summary.subject_count
+        self.subjects_passed = summary.pass_count
         
         # Calculate pass rate
         self.calculate_pass_rate()
         
         # Count grades
-        self.grade_a_count = marks_queryset.filter(grade='A').count()
-        self.grade_b_count = marks_queryset.filter(grade='B').count()
-        self.grade_c_count = marks_queryset.filter(grade='C').count()
-        self.grade_d_count = marks_queryset.filter(grade='D').count()
-        self.grade_e_count = marks_queryset.filter(grade='E').count()
-        self.grade_f_count = marks_queryset.filter(grade='F').count()
-        
-        # Find strongest and weakest subjects
-        subject_scores = {}
-        for mark in marks_queryset.select_related('subject'):
-            subject_scores[mark.subject] = mark.total_score
+        self.grade_a_count = summary.grade_a_count
+        self.grade_b_count = summary.grade_b_count
+        self.grade_c_count = summary.grade_c_count
+        self.grade_d_count = summary.grade_d_count
+        self.grade_e_count = summary.grade_e_count
+        self.grade_f_count = summary.grade_f_count
         
-        if subject_scores:
-            strongest = max(subject_scores.items(), key=lambda x: x[1])
-            weakest = min(subject_scores.items(), key=lambda x: x[1])
-            
-            self.strongest_subject = strongest[0]
-            self.strongest_subject_score = strongest[1]
-            self.weakest_subject = weakest[0]
-            self.weakest_subject_score = weakest[1]
-        
-        self.save()
-        return True
+        # Strongest and weakest subjects
+        self.strongest_subject_id = summary.best_subject_id
+        self.strongest_subject_score = summary.best_score
+        self.weakest_subject_id = summary.worst_subject_id
+        self.weakest_subject_score = summary.worst_score
     
     def compare_with_previous(self, previous_trend):
         """Compare with previous term trend"""
         if not previous_trend:
             return
         
-        self.previous_term_average = previous_trend.current_term_average
+        self.apply_previous_average(previous_trend.current_term_average)
+        
+        # Generate analysis
+        self.generate_analysis(previous_trend)
+        self.save()
+    
+    def apply_previous_average(self, previous_average):
+        """Set change metrics and trend direction against the previous term's average"""
+        self.previous_term_average = previous_average
         
         # Calculate changes
-        self.score_change = self.current_term_average - previous_trend.current_term_average
+        self.score_change = self.current_term_average - previous_average
         
-        if previous_trend.current_term_average > 0:
-            self.percentage_change = (self.score_change / previous_trend.current_term_average) * 100
+        if previous_average > 0:
+            self.percentage_change = (self.score_change / previous_average) * 100
         else:
             self.percentage_change = 0
         
@@ -342,10 +538,6 @@ class PerformanceTrend(models.Model):
         else:
             self.trend = 'significant_decline'
             self.trend_direction = 'negative'
-        
-        # Generate analysis
-        self.generate_analysis(previous_trend)
-        self.save()
     
     def generate_analysis(self, previous_trend=None):
         """Generate analysis and recommendations"""
@@ -416,4 +608,118 @@ class PerformanceTrend(models.Model):
         if self.grade_f_count > 0:
             action_items.append("Request extra classes for failed subjects")
         
-        self.action_items = "\n".join(action_items)
\ No newline at end of file
+        self.action_items = "\n".join(action_items)
+
+class AnalyticsJob(models.Model):
+    """A long analytics run executed outside the request, with its progress"""
+    KIND_CHOICES = (
+        ('performance_trends', 'Performance Trends'),
+    )
+    
+    STATUS_CHOICES = (
+        ('queued', 'Queued'),
+        ('running', 'Running'),
+        ('completed', 'Completed'),
+        ('failed', 'Failed'),
+    )
+    
+    kind = models.CharField(max_length=30, choices=KIND_CHOICES)
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='queued')
+    parameters = models.JSONField(default=dict, blank=True)
+    
+    # Progress
+    total = models.PositiveIntegerField(default=0)
+    processed = models.PositiveIntegerField(default=0)
+    error_count = models.PositiveIntegerField(default=0)
+    errors = models.JSONField(default=list, blank=True)
+    result = models.JSONField(default=dict, blank=True)
+    message = models.TextField(blank=True)
+    
+    created_by = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    started_at = models.DateTimeField(null=True, blank=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    
+    # Touched by the worker after every chunk; a running job whose heartbeat
+    # stops was lost with its worker and is requeued by marks.jobs
+    heartbeat_at = models.DateTimeField(null=True, blank=True)
+    attempts = models.PositiveSmallIntegerField(default=0)
+    
+    class Meta:
+        ordering = ['-created_at']
+        verbose_name = "Analytics Job"
+        verbose_name_plural = "Analytics Jobs"
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_kind_display()} #{self.pk} ({self.get_status_display()})"
+    
+    @property
+    def is_finished(self):
+        return self.status in ('completed', 'failed')
+    
+    @property
+    def progress_percent(self):
+        if self.total:
+            return round(self.processed * 100 / self.total)
+        return 100 if self.status == 'completed' else 0
+    
+    def as_dict(self):
+        """Progress payload for the polling endpoint"""
+        return {
+            'id': self.pk,
+            'kind': self.kind,
+            'status': self.status,
+            'total': self.total,
+            'processed': self.processed,
+            'percent': self.progress_percent,
+            'error_count': self.error_count,
+            'errors': self.errors,
+            'result': self.result,
+            'message': self.message,
+            'is_finished': self.is_finished,
+        }
+
+
+class RiskFlag(models.Model):
+    """
+    Early warning that a student's results are heading the wrong way.
+
+    Raised by marks.early_warning from the student's trend across all terms;
+    one flag per student, term and reason, kept active until a later run no
+    longer raises it.
+    """
+    REASON_CHOICES = (
+        ('declining', 'Projected average below threshold'),
+        ('failing', 'Number of failed subjects growing'),
+    )
+    
+    student = models.ForeignKey(Student, on_delete=models.CASCADE, related_name='risk_flags')
+    academic_term = models.ForeignKey(AcademicTerm, on_delete=models.CASCADE, related_name='risk_flags')
+    reason = models.CharField(max_length=20, choices=REASON_CHOICES)
+    
+    # Trend the flag was raised on
+    current_average = models.DecimalField(max_digits=5, decimal_places=2)
+    projected_average = models.DecimalField(max_digits=6, decimal_places=2)
+    slope = models.FloatField(help_text="Change in average per term")
+    fail_count = models.PositiveIntegerField(default=0)
+    previous_fail_count = models.PositiveIntegerField(default=0)
+    terms_used = models.PositiveIntegerField(default=0)
+    
+    is_active = models.BooleanField(default=True)
+    notified_at = models.DateTimeField(null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    
+    class Meta:
+        ordering = ['-academic_term__index', 'projected_average']
+        unique_together = ['student', 'academic_term', 'reason']
+        indexes = [
+            models.Index(fields=['is_active', 'academic_term'], name='riskflag_active_term_idx'),
+            models.Index(fields=['student', 'is_active'], name='riskflag_student_active_idx'),
+        ]
+    
+    def __str__(self):
+        return f"{self.student} - {self.get_reason_display()} ({self.academic_term})"
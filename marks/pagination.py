@@ -0,0 +1,80 @@
+# marks/pagination.py
+import base64
+import json
+import math
+from decimal import Decimal
+from django.core.exceptions import ValidationError
+from django.db.models import Q
+
+
+class InvalidCursor(ValueError):
+    pass
+
+
+def encode_cursor(values):
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode().rstrip('=')
+
+
+def decode_cursor(cursor, size, fields=None):
+    """
+    The values a cursor holds. With `fields` (model fields, one per value)
+    each value is converted with its field's to_python() and must be a
+    finite, non-null scalar; anything else is an InvalidCursor.
+    """
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor + '=' * (-len(cursor) % 4)))
+    except (ValueError, TypeError) as exc:
+        raise InvalidCursor(cursor) from exc
+    if not isinstance(values, list) or len(values) != size:
+        raise InvalidCursor(cursor)
+    if fields is None:
+        return values
+
+    converted = []
+    for field, value in zip(fields, values):
+        if value is None or isinstance(value, (bool, list, dict)):
+            raise InvalidCursor(cursor)
+        try:
+            value = field.to_python(value)
+        except ValidationError as exc:
+            raise InvalidCursor(cursor) from exc
+        if value is None or (isinstance(value, Decimal) and not value.is_finite()) or (
+            isinstance(value, float) and not math.isfinite(value)
+        ):
+            raise InvalidCursor(cursor)
+        converted.append(value)
+    return converted
+
+
+def _after(fields, values):
+    """Rows strictly after `values` in descending order of `fields`"""
+    condition = Q()
+    for i, field in enumerate(fields):
+        step = Q(**{f'{field}__lt': values[i]})
+        for prior, value in zip(fields[:i], values[:i]):
+            step &= Q(**{prior: value})
+        condition |= step
+    return condition
+
+
+def keyset_page(queryset, fields, cursor=None, page_size=50):
+    """
+    One page of `queryset` in descending order of `fields`, seeking past the
+    row a cursor points at instead of using OFFSET, so every page costs the
+    same however deep it is. The last field must be unique (e.g. 'id').
+
+    Returns (rows, next_cursor); next_cursor is None on the last page.
+    Raises InvalidCursor for a cursor that was not produced here.
+    """
+    queryset = queryset.order_by(*[f'-{field}' for field in fields])
+    if cursor:
+        opts = queryset.model._meta
+        model_fields = [opts.pk if field == 'pk' else opts.get_field(field) for field in fields]
+        queryset = queryset.filter(_after(fields, decode_cursor(cursor, len(fields), model_fields)))
+
+    rows = list(queryset[:page_size + 1])
+    if len(rows) <= page_size:
+        return rows, None
+    rows = rows[:page_size]
+    last = rows[-1]
+    return rows, encode_cursor([getattr(last, field) for field in fields])
@@ -0,0 +1,126 @@
+# marks/refresh.py
+"""
+Deferred refresh of the statistics stored on each mark: percentile ranks,
+and standardized scores when STANDARDIZE_SCORES is on.
+
+Both depend on every mark of a subject in a term, so they are not worked
+out inside the write that changed a mark. Writes report the (term,
+academic_year, subject_id) groups they touched; once the transaction commits
+those subjects alone are handed to a worker to re-rank. Inside
+deferred_refresh() (an import, a regrade) the groups are gathered and handed
+over once at the end, and without a broker a single background thread
+waits DEBOUNCE seconds before it starts, taking in whatever else was
+written meanwhile.
+"""
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from django.conf import settings
+from django.db import connections, transaction
+
+logger = logging.getLogger(__name__)
+
+# Seconds the background thread collects writes before re-ranking
+DEBOUNCE = 2
+
+_local = threading.local()
+
+# Subjects waiting for the background thread, and whether it is running
+_pending = set()
+_pending_lock = threading.Lock()
+_worker_running = False
+
+
+def subject_keys(marks):
+    """(term, academic_year, subject_id) groups touched by a batch of marks"""
+    return {(mark.term, mark.academic_year, mark.subject_id) for mark in marks}
+
+
+def schedule_refresh(subjects):
+    """Re-rank the given (term, academic_year, subject_id) groups once the current transaction commits"""
+    subjects = set(subjects)
+    if not subjects:
+        return
+    collecting = getattr(_local, 'collecting', None)
+    if collecting is not None:
+        collecting.update(subjects)
+        return
+    transaction.on_commit(lambda: _dispatch(subjects))
+
+
+@contextmanager
+def deferred_refresh():
+    """Gather the refreshes of every write inside the block and schedule them once, at the end"""
+    if getattr(_local, 'collecting', None) is not None:
+        # An enclosing block hands them over
+        yield
+        return
+    _local.collecting = set()
+    try:
+        yield
+    finally:
+        subjects, _local.collecting = _local.collecting, None
+        schedule_refresh(subjects)
+
+
+def _dispatch(subjects):
+    if settings.CELERY_TASK_ALWAYS_EAGER:
+        refresh_mark_statistics(subjects)
+    elif settings.CELERY_BROKER_URL:
+        from .tasks import refresh_mark_statistics as task
+        task.delay(sorted(subjects))
+    else:
+        _queue(subjects)
+
+
+def _queue(subjects):
+    global _worker_running
+    with _pending_lock:
+        _pending.update(subjects)
+        if _worker_running:
+            # The running thread picks them up before it stops
+            return
+        _worker_running = True
+    # Not a daemon, so a management command that wrote marks waits for it
+    threading.Thread(target=_work_in_thread, name='mark-statistics-refresh').start()
+
+
+def _work_in_thread():
+    global _worker_running
+    try:
+        while True:
+            time.sleep(DEBOUNCE)
+            with _pending_lock:
+                if not _pending:
+                    _worker_running = False
+                    return
+                subjects = set(_pending)
+                _pending.clear()
+            refresh_mark_statistics(subjects)
+    except Exception:
+        logger.exception("Refreshing mark statistics failed")
+        with _pending_lock:
+            _worker_running = False
+    finally:
+        connections.close_all()
+
+
+def refresh_mark_statistics(subjects):
+    """
+    Store percentile ranks (and standardized scores, if STANDARDIZE_SCORES
+    is on) for the given (term, academic_year, subject_id) groups: one load
+    and one bulk update per term. Returns the number of marks updated.
+    """
+    from .stats import store_percentile_ranks, store_standardized_scores
+
+    by_term = {}
+    for term, academic_year, subject_id in subjects:
+        by_term.setdefault((term, academic_year), set()).add(subject_id)
+
+    updated = 0
+    for (term, academic_year), subject_ids in by_term.items():
+        updated += store_percentile_ranks(term, academic_year, subject_ids=sorted(subject_ids))
+        if getattr(settings, 'STANDARDIZE_SCORES', False):
+            updated += store_standardized_scores(academic_year, term, subject_ids=sorted(subject_ids))
+    return updated
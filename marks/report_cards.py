@@ -0,0 +1,281 @@
+# marks/report_cards.py
+"""
+Report card PDFs drawn with reportlab from StudentReport and Mark rows.
+
+Cards are gathered as plain dicts (two queries for a whole class or grade),
+so they can be rendered in worker processes that never touch Django. Every
+rendered PDF is kept in default storage under the hash of its content; an
+unchanged card is read back instead of drawn again.
+"""
+import hashlib
+import io
+import json
+import zipfile
+from concurrent.futures import ProcessPoolExecutor
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from reportlab.lib import colors
+from reportlab.lib.pagesizes import A4
+from reportlab.lib.units import mm
+from reportlab.pdfgen import canvas as pdf_canvas
+from .models import Mark, StudentReport
+
+# Bump when the layout changes so cached PDFs are drawn again
+LAYOUT_VERSION = 1
+
+STORAGE_DIR = 'report_cards'
+
+# Cards handed to a worker process at a time
+WORKER_CHUNK_SIZE = 50
+
+PAGE_WIDTH, PAGE_HEIGHT = A4
+MARGIN = 18 * mm
+
+
+def report_card_data(term, academic_year, grade=None, section=None, student_ids=None):
+    """
+    Report cards for a term as plain dicts, ordered by class and position.
+
+    One query for the reports and one for their marks, whatever the number
+    of students.
+    """
+    reports = StudentReport.objects.filter(term=term, academic_year=academic_year).select_related('student__user')
+    marks = Mark.objects.filter(term=term, academic_year=academic_year)
+    if grade:
+        reports = reports.filter(student__grade=grade)
+        marks = marks.filter(student__grade=grade)
+    if section:
+        reports = reports.filter(student__section=section)
+        marks = marks.filter(student__section=section)
+    if student_ids is not None:
+        reports = reports.filter(student_id__in=student_ids)
+        marks = marks.filter(student_id__in=student_ids)
+
+    subjects = {}
+    for student_id, *row in marks.order_by('subject__name').values_list(
+        'student_id', 'subject__name', 'cat1_score', 'cat2_score', 'main_exam_score', 'total_score', 'grade',
+    ):
+        subjects.setdefault(student_id, []).append([str(value) if value is not None else '' for value in row])
+
+    cards = []
+    for report in reports.order_by('student__grade', 'student__section', 'class_position', 'student_id'):
+        student = report.student
+        cards.append({
+            'student_id': student.pk,
+            'name': student.user.get_full_name(),
+            'admission_number': student.admission_number,
+            'grade': student.grade,
+            'section': student.section,
+            'term': term,
+            'academic_year': academic_year,
+            'average_score': str(report.average_score),
+            'overall_grade': report.overall_grade,
+            'class_position': report.class_position,
+            'total_students': report.total_students,
+            'teacher_comment': report.teacher_comment,
+            'principal_comment': report.principal_comment,
+            'days_present': report.days_present,
+            'total_days': report.total_days,
+            'marks': subjects.get(student.pk, []),
+        })
+    return cards
+
+
+def content_hash(card, school_name):
+    payload = json.dumps([LAYOUT_VERSION, school_name, card], sort_keys=True)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def storage_path(digest):
+    return f'{STORAGE_DIR}/{digest[:2]}/{digest}.pdf'
+
+
+def card_filename(card):
+    return f"{card['admission_number']}_{card['term']}_{card['academic_year']}.pdf".replace(' ', '_')
+
+
+def _school_name():
+    return getattr(settings, 'SCHOOL_NAME', '') or settings.UNFOLD.get('SITE_TITLE', 'School')
+
+
+def _wrap(canvas, text, width):
+    """Split text into lines that fit `width` in the canvas' current font"""
+    lines = []
+    for paragraph in (text or '').splitlines() or ['']:
+        line = ''
+        for word in paragraph.split():
+            candidate = f'{line} {word}'.strip()
+            if line and canvas.stringWidth(candidate) > width:
+                lines.append(line)
+                line = word
+            else:
+                line = candidate
+        lines.append(line)
+    return lines
+
+
+def draw_report_card(canvas, card, school_name):
+    """Draw one report card on the current page of a reportlab canvas"""
+    left, right = MARGIN, PAGE_WIDTH - MARGIN
+    y = PAGE_HEIGHT - MARGIN
+
+    canvas.setFont('Helvetica-Bold', 16)
+    canvas.drawCentredString(PAGE_WIDTH / 2, y, school_name)
+    y -= 7 * mm
+    canvas.setFont('Helvetica', 11)
+    canvas.drawCentredString(PAGE_WIDTH / 2, y, f"Report Card - {card['term']} {card['academic_year']}")
+    y -= 5 * mm
+    canvas.line(left, y, right, y)
+
+    y -= 8 * mm
+    canvas.setFont('Helvetica', 10)
+    canvas.drawString(left, y, f"Name: {card['name']}")
+    canvas.drawString(left + 100 * mm, y, f"Admission No: {card['admission_number']}")
+    y -= 6 * mm
+    canvas.drawString(left, y, f"Class: {card['grade']} {card['section']}")
+    canvas.drawString(left + 100 * mm, y, f"Position: {card['class_position']} of {card['total_students']}")
+
+    # Marks table
+    columns = [('Subject', 0), ('CAT 1', 70), ('CAT 2', 90), ('Exam', 110), ('Total', 130), ('Grade', 150)]
+    y -= 12 * mm
+    canvas.setFillColor(colors.HexColor('#e9ecef'))
+    canvas.rect(left, y - 2 * mm, right - left, 7 * mm, stroke=0, fill=1)
+    canvas.setFillColor(colors.black)
+    canvas.setFont('Helvetica-Bold', 10)
+    for title, offset in columns:
+        canvas.drawString(left + 2 * mm + offset * mm, y, title)
+
+    canvas.setFont('Helvetica', 10)
+    for row in card['marks']:
+        y -= 7 * mm
+        for (_, offset), value in zip(columns, row):
+            canvas.drawString(left + 2 * mm + offset * mm, y, value)
+        canvas.setStrokeColor(colors.HexColor('#dee2e6'))
+        canvas.line(left, y - 2 * mm, right, y - 2 * mm)
+    canvas.setStrokeColor(colors.black)
+
+    y -= 10 * mm
+    canvas.setFont('Helvetica-Bold', 11)
+    canvas.drawString(left, y, f"Average: {card['average_score']}%")
+    canvas.drawString(left + 70 * mm, y, f"Overall Grade: {card['overall_grade']}")
+    if card['total_days']:
+        canvas.drawString(left + 120 * mm, y, f"Attendance: {card['days_present']}/{card['total_days']}")
+
+    for title, comment in (("Class Teacher's Comment", card['teacher_comment']),
+                           ("Principal's Comment", card['principal_comment'])):
+        y -= 12 * mm
+        canvas.setFont('Helvetica-Bold', 10)
+        canvas.drawString(left, y, title)
+        canvas.setFont('Helvetica', 10)
+        for line in _wrap(canvas, comment, right - left):
+            y -= 5 * mm
+            canvas.drawString(left, y, line)
+
+    canvas.setFont('Helvetica', 9)
+    canvas.drawString(left, MARGIN, 'Signature: ____________________')
+    canvas.drawRightString(right, MARGIN, 'Stamp: ____________________')
+
+
+def render_pdf(cards, school_name):
+    """One PDF with a page per card"""
+    buffer = io.BytesIO()
+    canvas = pdf_canvas.Canvas(buffer, pagesize=A4, pageCompression=1)
+    canvas.setTitle(f"Report Cards {cards[0]['term']} {cards[0]['academic_year']}" if cards else 'Report Cards')
+    for card in cards:
+        draw_report_card(canvas, card, school_name)
+        canvas.showPage()
+    canvas.save()
+    return buffer.getvalue()
+
+
+def _render_chunk(cards, school_name):
+    # Runs in worker processes: reportlab only, no Django
+    return [render_pdf([card], school_name) for card in cards]
+
+
+def _render_missing(cards, school_name, workers):
+    chunks = [cards[i:i + WORKER_CHUNK_SIZE] for i in range(0, len(cards), WORKER_CHUNK_SIZE)]
+    if workers <= 1 or len(chunks) <= 1:
+        for chunk in chunks:
+            yield from _render_chunk(chunk, school_name)
+        return
+
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        for pdfs in pool.map(_render_chunk, chunks, [school_name] * len(chunks)):
+            yield from pdfs
+
+
+def render_report_cards(cards, workers=None):
+    """
+    Make sure every card has a PDF in storage, drawing only new or changed
+    ones, across `workers` processes (settings.REPORT_CARD_WORKERS by default).
+
+    Returns [(card, storage path)] in the order of `cards`.
+    """
+    school_name = _school_name()
+    workers = workers or getattr(settings, 'REPORT_CARD_WORKERS', 1)
+
+    paths = [storage_path(content_hash(card, school_name)) for card in cards]
+    missing = [(card, path) for card, path in zip(cards, paths) if not default_storage.exists(path)]
+
+    rendered = _render_missing([card for card, _ in missing], school_name, workers)
+    for (card, path), pdf in zip(missing, rendered):
+        # Another request may have stored the same card meanwhile; same content either way
+        if not default_storage.exists(path):
+            default_storage.save(path, ContentFile(pdf))
+
+    return list(zip(cards, paths))
+
+
+def merged_report_cards(cards):
+    """
+    One print-ready PDF of all cards, cached in storage like single cards.
+
+    Drawn in one pass rather than joined from the single-card files, which
+    would need a PDF merging library.
+    """
+    school_name = _school_name()
+    digest = hashlib.sha256(''.join(content_hash(card, school_name) for card in cards).encode()).hexdigest()
+    path = storage_path(digest)
+    if default_storage.exists(path):
+        with default_storage.open(path, 'rb') as stored:
+            return stored.read()
+
+    pdf = render_pdf(cards, school_name)
+    default_storage.save(path, ContentFile(pdf))
+    return pdf
+
+
+class _ZipStream(io.RawIOBase):
+    """Write-only, unseekable buffer that zipfile writes into and we drain"""
+
+    def __init__(self):
+        self._chunks = []
+
+    def writable(self):
+        return True
+
+    def write(self, data):
+        self._chunks.append(bytes(data))
+        return len(data)
+
+    def drain(self):
+        data = b''.join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+def stream_report_cards_zip(rendered):
+    """
+    Yield a ZIP archive of rendered cards ([(card, storage path)]) piece by
+    piece, one stored PDF at a time, so the archive is never held in memory.
+    """
+    stream = _ZipStream()
+    # PDFs are compressed already; storing them keeps the archive cheap to build
+    with zipfile.ZipFile(stream, mode='w', compression=zipfile.ZIP_STORED) as archive:
+        for card, path in rendered:
+            with default_storage.open(path, 'rb') as stored:
+                archive.writestr(card_filename(card), stored.read())
+            yield stream.drain()
+    yield stream.drain()
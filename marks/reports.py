@@ -0,0 +1,114 @@
+# marks/reports.py
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from django.db.models import Avg, Count, F, FloatField, Window
+from django.db.models.functions import DenseRank, Rank
+from .grading import TWO_PLACES
+from .models import Mark, StudentReport, GradingScheme
+from .terms import assign_academic_terms
+
+class GroupedWindow(Window):
+    """
+    Window evaluated over the rows of an aggregate query.
+
+    Django adds non-aggregate annotations to GROUP BY, which databases reject
+    for window functions; the partition columns are already grouped on.
+    """
+
+    def get_group_by_cols(self):
+        return []
+
+
+RANK_FUNCTIONS = {
+    'competition': Rank,  # 1, 2, 2, 4
+    'dense': DenseRank,   # 1, 2, 2, 3
+}
+
+# Mark columns students can be ranked on; standardized scores take out
+# differences in marking between classes (marks.stats)
+SCORE_FIELDS = {
+    'raw': 'total_score',
+    'standardized': 'standardized_score',
+}
+
+
+def scored_marks(marks, score='raw'):
+    """(marks with a value for the score, its column name)"""
+    field = SCORE_FIELDS[score]
+    if Mark._meta.get_field(field).null:
+        marks = marks.filter(**{f'{field}__isnull': False})
+    return marks, field
+
+
+def class_rankings(term, academic_year, grade=None, section=None, rank_method='competition', score='raw'):
+    """
+    Per-student average, class position and class size for a term in one query.
+
+    Students are grouped by their marks and ranked inside each grade/section
+    with window functions, so the whole school is ranked by the database.
+    `score` picks the score students are ranked on, raw or standardized (see
+    SCORE_FIELDS); `average` is the average of that score and `raw_average`
+    always the average of the raw total scores. A student with no
+    standardized scores yet is ranked last.
+    """
+    marks = Mark.objects.filter(term=term, academic_year=academic_year)
+    if grade:
+        marks = marks.filter(student__grade=grade)
+    if section:
+        marks = marks.filter(student__section=section)
+    # Avg() skips marks without the score, so no mark is dropped from the raw average
+    ranking_average = Avg(SCORE_FIELDS[score], output_field=FloatField())
+
+    class_partition = [F('student__grade'), F('student__section')]
+    return (
+        marks.values('student_id', 'student__grade', 'student__section')
+        .annotate(
+            average=ranking_average,
+            raw_average=Avg('total_score', output_field=FloatField()),
+            subject_count=Count('id'),
+            position=GroupedWindow(
+                expression=RANK_FUNCTIONS[rank_method](),
+                partition_by=class_partition,
+                order_by=ranking_average.desc(nulls_last=True),
+            ),
+            class_size=GroupedWindow(expression=Count('student_id'), partition_by=class_partition),
+        )
+        .order_by('student__grade', 'student__section', 'position')
+    )
+
+
+def generate_student_reports(term, academic_year, grade=None, section=None, rank_method='competition', batch_size=500,
+                             score='raw'):
+    """
+    Create or refresh StudentReport rows for a term from the marks.
+
+    Runs one ranking query plus one bulk upsert; comments and attendance typed
+    into existing reports are kept. With score='standardized' the positions
+    come from standardized scores; the stored average and grade are always
+    the raw ones printed on report cards.
+    """
+    scheme = GradingScheme.for_year(academic_year)
+
+    reports = []
+    for row in class_rankings(term, academic_year, grade, section, rank_method, score):
+        average = Decimal(str(row['raw_average'])).quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+        reports.append(StudentReport(
+            student_id=row['student_id'],
+            term=term,
+            academic_year=academic_year,
+            average_score=average,
+            overall_grade=scheme.grade_for(average),
+            class_position=row['position'],
+            total_students=row['class_size'],
+        ))
+
+    assign_academic_terms(reports)
+    with transaction.atomic():
+        StudentReport.objects.bulk_create(
+            reports,
+            batch_size=batch_size,
+            update_conflicts=True,
+            unique_fields=['student', 'term', 'academic_year'],
+            update_fields=['average_score', 'overall_grade', 'class_position', 'total_students', 'date_modified', 'academic_term'],
+        )
+    return len(reports)
@@ -0,0 +1,88 @@
+from django.db.models.signals import post_save, post_delete
+from django.db import transaction
+from django.dispatch import receiver, Signal
+from .models import AcademicTerm, Mark
+
+# Sent by bulk write paths (bulk_create/bulk_update) that bypass Mark.save().
+# `keys` is a set of (student_id, term, academic_year) tuples that were written,
+# `subjects` the (term, academic_year, subject_id) groups (marks.refresh.subject_keys).
+marks_bulk_written = Signal()
+
+
+def mark_keys(marks):
+    """(student_id, term, academic_year) keys touched by a batch of marks"""
+    return {(mark.student_id, mark.term, mark.academic_year) for mark in marks}
+
+
+@receiver(post_save, sender=Mark)
+@receiver(post_delete, sender=Mark)
+def update_summary_on_mark_change(sender, instance, **kwargs):
+    """Keep the student's term summary in step with a single mark write"""
+    from .summaries import refresh_term_summaries
+    refresh_term_summaries(mark_keys([instance]))
+
+
+@receiver(marks_bulk_written)
+def update_summaries_on_bulk_write(sender, keys, **kwargs):
+    """Keep term summaries in step with bulk mark writes"""
+    from .summaries import refresh_term_summaries
+    refresh_term_summaries(keys)
+
+
+@receiver(post_save, sender=Mark)
+@receiver(post_delete, sender=Mark)
+def invalidate_analytics_on_mark_change(sender, instance, **kwargs):
+    """Expire cached analytics for the mark's term and student once the write commits"""
+    _invalidate_analytics(mark_keys([instance]))
+
+
+@receiver(marks_bulk_written)
+def invalidate_analytics_on_bulk_write(sender, keys, **kwargs):
+    """Expire cached analytics for every term and student a bulk write touched"""
+    _invalidate_analytics(keys)
+
+
+def _invalidate_analytics(keys):
+    from .cache import bump_student_versions, bump_term_versions
+    terms = {(term, academic_year) for _, term, academic_year in keys}
+    student_ids = {student_id for student_id, _, _ in keys}
+
+    def bump():
+        bump_term_versions(terms)
+        bump_student_versions(student_ids)
+
+    # After commit, so a reader can't cache the old rows under the new version
+    transaction.on_commit(bump)
+
+
+@receiver(post_save, sender=Mark)
+@receiver(post_delete, sender=Mark)
+def refresh_statistics_on_mark_change(sender, instance, **kwargs):
+    """Have the mark's subject re-ranked (and re-standardized) for its term in the background"""
+    from .refresh import schedule_refresh, subject_keys
+    schedule_refresh(subject_keys([instance]))
+
+
+@receiver(marks_bulk_written)
+def refresh_statistics_on_bulk_write(sender, keys, subjects=(), **kwargs):
+    """Have the subjects a bulk write touched re-ranked (and re-standardized) in the background"""
+    from .refresh import schedule_refresh
+    schedule_refresh(subjects)
+
+
+@receiver(post_save, sender=AcademicTerm)
+@receiver(post_delete, sender=AcademicTerm)
+def clear_term_caches_on_change(sender, **kwargs):
+    """Drop the cached current term and term ids, here now and in every process once the change commits"""
+    from .cache import bump_terms_version
+    from .terms import clear_term_caches
+    clear_term_caches()
+    transaction.on_commit(bump_terms_version)
+
+
+@receiver(post_save, sender=AcademicTerm)
+def relink_recreated_term(sender, instance, created, **kwargs):
+    """Give a term recreated after deletion back the rows left without one"""
+    if created and not kwargs.get('raw'):
+        from .terms import relink_academic_term
+        relink_academic_term(instance)
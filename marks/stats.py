@@ -0,0 +1,290 @@
+# marks/stats.py
+"""
+Subject statistics for a term computed with NumPy.
+
+A term's (or year's) marks are loaded in one query into flat arrays, one
+entry per mark with subject, class and term codes; statistics are then
+computed per group on those arrays without another trip to the database.
+"""
+from decimal import Decimal
+import numpy as np
+from django.db import transaction
+from students.models import Student
+from .cache import bump_term_versions, cached
+from .models import Mark
+
+# Fixed histogram bins: 0-10, 10-20, ... 90-100 (the last bin includes 100)
+HISTOGRAM_EDGES = np.linspace(0, 100, 11)
+
+QUARTILES = (25, 50, 75)
+
+
+# Columns loaded per mark, in TermScores row order
+SCORE_COLUMNS = (
+    'id', 'student_id', 'subject__name', 'student__grade', 'student__section', 'term',
+    'total_score', 'percentile_rank', 'standardized_score',
+)
+
+
+class TermScores:
+    """
+    Marks as parallel NumPy arrays.
+
+    subject_codes, class_codes and term_codes index into `subjects`,
+    `classes` and `terms`; `matrix()` gives the student x subject view of a
+    single term, NaN where a student has no mark in a subject.
+    """
+
+    def __init__(self, rows):
+        rows = list(rows)
+        self.mark_ids = np.array([row[0] for row in rows], dtype=np.int64)
+        self.student_ids = np.array([row[1] for row in rows], dtype=np.int64)
+        self.subjects, self.subject_codes = _codes([row[2] for row in rows])
+        self.classes, self.class_codes = _codes([f'{row[3]} {row[4]}'.strip() for row in rows])
+        self.terms, self.term_codes = _codes([row[5] for row in rows])
+        self.scores = _floats(row[6] for row in rows)
+        self.stored_ranks = _floats(row[7] for row in rows)
+        self.stored_standardized = _floats(row[8] for row in rows)
+
+    def __len__(self):
+        return len(self.scores)
+
+    def matrix(self):
+        """(student ids, student x subject score matrix)"""
+        students, rows = np.unique(self.student_ids, return_inverse=True)
+        matrix = np.full((len(students), len(self.subjects)), np.nan)
+        matrix[rows, self.subject_codes] = self.scores
+        return students, matrix
+
+    def group_codes(self, *codes):
+        """(number of groups, group code per mark) for every combination of the given code arrays"""
+        if not len(self):
+            return 0, np.zeros(0, dtype=np.int64)
+        unique, inverse = np.unique(np.stack(codes, axis=1), axis=0, return_inverse=True)
+        return len(unique), inverse.reshape(-1)
+
+    def groups(self, *codes):
+        """
+        Yield (key, positions) for every combination of the given code arrays,
+        positions being indexes into the flat arrays.
+        """
+        if not len(self):
+            return
+        keys = np.stack(codes, axis=1)
+        unique, inverse = np.unique(keys, axis=0, return_inverse=True)
+        inverse = inverse.reshape(-1)
+        order = np.argsort(inverse, kind='stable')
+        bounds = np.searchsorted(inverse[order], np.arange(len(unique) + 1))
+        for i, key in enumerate(unique):
+            yield tuple(int(code) for code in key), order[bounds[i]:bounds[i + 1]]
+
+
+def _codes(labels):
+    names, codes = np.unique(np.array(labels, dtype=object), return_inverse=True)
+    return [str(name) for name in names], codes.reshape(-1).astype(np.int64)
+
+
+def _floats(values):
+    return np.array([np.nan if value is None else float(value) for value in values], dtype=np.float64)
+
+
+def load_scores(academic_year, term=None, grade=None, section=None, subject_ids=None):
+    """One query for every mark of a year or term (optionally one class or some subjects)"""
+    marks = Mark.objects.filter(academic_year=academic_year)
+    if term:
+        marks = marks.filter(term=term)
+    if grade:
+        marks = marks.filter(student__grade=grade)
+    if section:
+        marks = marks.filter(student__section=section)
+    if subject_ids is not None:
+        marks = marks.filter(subject_id__in=subject_ids)
+    return TermScores(marks.values_list(*SCORE_COLUMNS).order_by())
+
+
+def percentile_ranks(scores):
+    """
+    Percent of scores below each score, ties counting half (the mid-rank
+    definition): 50 for everyone when all scores tie.
+    """
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(scores):
+        return scores
+    ordered = np.sort(scores)
+    below = np.searchsorted(ordered, scores, side='left')
+    equal = np.searchsorted(ordered, scores, side='right') - below
+    return (below + equal / 2) / len(scores) * 100
+
+
+def z_scores(scores):
+    """Standard scores with the population standard deviation; 0 when all scores are equal"""
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(scores):
+        return scores
+    std = scores.std()
+    if std == 0:
+        return np.zeros_like(scores)
+    return (scores - scores.mean()) / std
+
+
+def z_score_matrix(matrix):
+    """z_scores() down each subject column of a student x subject matrix, NaN where there is no mark"""
+    z = np.full_like(matrix, np.nan)
+    for column in range(matrix.shape[1]):
+        present = ~np.isnan(matrix[:, column])
+        z[present, column] = z_scores(matrix[present, column])
+    return z
+
+
+def describe(scores):
+    """Count, mean, median, standard deviation, quartiles, range and histogram of scores"""
+    scores = np.asarray(scores, dtype=np.float64)
+    if not len(scores):
+        return {'count': 0}
+    q1, median, q3 = np.percentile(scores, QUARTILES)
+    histogram, _ = np.histogram(scores, bins=HISTOGRAM_EDGES)
+    return {
+        'count': int(len(scores)),
+        'mean': round(float(scores.mean()), 2),
+        'median': round(float(median), 2),
+        'std': round(float(scores.std()), 2),
+        'q1': round(float(q1), 2),
+        'q3': round(float(q3), 2),
+        'min': round(float(scores.min()), 2),
+        'max': round(float(scores.max()), 2),
+        'histogram': [int(count) for count in histogram],
+    }
+
+
+def subject_statistics(term, academic_year, grade=None, section=None):
+    """
+    Statistics per subject for a term, each with the same statistics per
+    class, and every student's z-score in each subject (in the order of
+    `subjects`, None where the student has no mark). Cached until marks in
+    the term are written.
+    """
+    def compute():
+        data = load_scores(academic_year, term, grade, section)
+        by_class = {}
+        for (subject, klass), positions in data.groups(data.subject_codes, data.class_codes):
+            by_class.setdefault(subject, []).append({
+                'class': data.classes[klass],
+                **describe(data.scores[positions]),
+            })
+
+        student_ids, matrix = data.matrix()
+        z = z_score_matrix(matrix)
+        names = {
+            row[0]: row[1:]
+            for row in Student.objects.filter(pk__in=student_ids.tolist()).values_list(
+                'id', 'admission_number', 'user__first_name', 'user__last_name',
+            )
+        }
+        students = []
+        for student_id, row in zip(student_ids.tolist(), z):
+            admission_number, first_name, last_name = names[student_id]
+            students.append({
+                'student_id': student_id,
+                'admission_number': admission_number,
+                'name': f'{first_name} {last_name}'.strip(),
+                'z_scores': [None if np.isnan(value) else round(float(value), 2) for value in row],
+            })
+
+        return {
+            'term': term,
+            'academic_year': academic_year,
+            'histogram_edges': [int(edge) for edge in HISTOGRAM_EDGES],
+            'subjects': [
+                {
+                    'subject': data.subjects[subject],
+                    **describe(data.scores[positions]),
+                    'classes': by_class[subject],
+                }
+                for (subject,), positions in data.groups(data.subject_codes)
+            ],
+            'students': sorted(students, key=lambda student: (student['name'], student['admission_number'])),
+        }
+
+    return cached('subject_statistics', [(term, academic_year)], (term, academic_year, grade, section), compute)
+
+
+def store_percentile_ranks(term, academic_year, subject_ids=None, batch_size=1000):
+    """
+    Store each mark's percentile rank within its subject for the term.
+
+    One query to load the term, then one bulk update of the marks whose
+    rank changed. Returns the number of marks updated.
+    """
+    data = load_scores(academic_year, term, subject_ids=subject_ids)
+    ranks = np.full(len(data), np.nan)
+    for _, positions in data.groups(data.subject_codes):
+        ranks[positions] = percentile_ranks(data.scores[positions])
+    ranks = np.round(ranks, 2)
+
+    changed = np.flatnonzero(~np.isclose(ranks, data.stored_ranks))
+    marks = [
+        Mark(pk=int(data.mark_ids[i]), percentile_rank=Decimal(f'{ranks[i]:.2f}'))
+        for i in changed
+    ]
+    with transaction.atomic():
+        Mark.objects.bulk_update(marks, ['percentile_rank'], batch_size=batch_size)
+    return len(marks)
+
+
+def _group_moments(scores, codes, size):
+    """Mean and population standard deviation of scores per group code"""
+    counts = np.bincount(codes, minlength=size)
+    means = np.bincount(codes, weights=scores, minlength=size) / counts
+    variances = np.bincount(codes, weights=scores ** 2, minlength=size) / counts - means ** 2
+    return means, np.sqrt(np.clip(variances, 0, None))
+
+
+def standardized_scores(data):
+    """
+    Scores with the marking of each class taken out.
+
+    Each mark is turned into a z-score within its (subject, term, class) and
+    mapped back onto the spread of the whole subject that term:
+    subject mean + z * subject standard deviation, clipped to 0-100. A class
+    marked more leniently than the rest loses its advantage, while scores
+    stay on the familiar percentage scale.
+    """
+    if not len(data):
+        return data.scores
+    class_count, class_groups = data.group_codes(data.subject_codes, data.term_codes, data.class_codes)
+    subject_count, subject_groups = data.group_codes(data.subject_codes, data.term_codes)
+
+    class_means, class_stds = _group_moments(data.scores, class_groups, class_count)
+    subject_means, subject_stds = _group_moments(data.scores, subject_groups, subject_count)
+
+    stds = class_stds[class_groups]
+    z = np.divide(data.scores - class_means[class_groups], stds, out=np.zeros_like(data.scores), where=stds > 0)
+    return np.clip(subject_means[subject_groups] + z * subject_stds[subject_groups], 0, 100)
+
+
+def store_standardized_scores(academic_year, term=None, subject_ids=None, batch_size=1000):
+    """
+    Store standardized_score on every mark of a year (or one term, or some
+    of its subjects; each subject is standardized on its own).
+
+    The marks are loaded in one query and standardized in one pass; marks
+    whose stored value changed are written with chunked bulk updates.
+    Returns the number of marks updated.
+    """
+    data = load_scores(academic_year, term, subject_ids=subject_ids)
+    standardized = np.round(standardized_scores(data), 2)
+
+    changed = np.flatnonzero(~np.isclose(standardized, data.stored_standardized))
+    with transaction.atomic():
+        # Rankings on standardized scores are cached per term
+        terms = {(data.terms[code], academic_year) for code in np.unique(data.term_codes[changed])}
+        transaction.on_commit(lambda: bump_term_versions(terms))
+        for start in range(0, len(changed), batch_size):
+            Mark.objects.bulk_update(
+                [
+                    Mark(pk=int(data.mark_ids[i]), standardized_score=Decimal(f'{standardized[i]:.2f}'))
+                    for i in changed[start:start + batch_size]
+                ],
+                ['standardized_score'],
+            )
+    return len(changed)
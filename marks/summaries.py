@@ -0,0 +1,118 @@
+# marks/summaries.py
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from .grading import TWO_PLACES
+from .models import Mark, StudentTermSummary
+
+SUMMARY_KEY_FIELDS = ['student', 'term', 'academic_year']
+SUMMARY_UPDATE_FIELDS = [
+    'average_score', 'subject_count', 'pass_count',
+    'grade_a_count', 'grade_b_count', 'grade_c_count',
+    'grade_d_count', 'grade_e_count', 'grade_f_count',
+    'best_subject', 'best_score', 'worst_subject', 'worst_score', 'updated_at',
+]
+
+# Columns a summary is built from, in the order summarize_rows() expects them
+MARK_COLUMNS = ('student_id', 'term', 'academic_year', 'subject_id', 'total_score', 'grade')
+
+
+def summarize_rows(rows, model=StudentTermSummary):
+    """
+    Build unsaved StudentTermSummary objects from mark rows.
+
+    `rows` are tuples in MARK_COLUMNS order, sorted by (student, term, year);
+    they are consumed in one streaming pass. `model` lets migrations pass the
+    historical model.
+    """
+    summary = None
+    total = Decimal(0)
+    for student_id, term, academic_year, subject_id, total_score, grade in rows:
+        if summary is None or (summary.student_id, summary.term, summary.academic_year) != (student_id, term, academic_year):
+            if summary is not None:
+                yield _finish(summary, total)
+            summary = model(student_id=student_id, term=term, academic_year=academic_year)
+            total = Decimal(0)
+
+        total_score = Decimal(total_score)
+        total += total_score
+        summary.subject_count += 1
+        if grade != 'F':
+            summary.pass_count += 1
+        field = f'grade_{grade.lower()}_count'
+        setattr(summary, field, getattr(summary, field) + 1)
+
+        if summary.best_score is None or total_score > summary.best_score:
+            summary.best_subject_id, summary.best_score = subject_id, total_score
+        if summary.worst_score is None or total_score < summary.worst_score:
+            summary.worst_subject_id, summary.worst_score = subject_id, total_score
+
+    if summary is not None:
+        yield _finish(summary, total)
+
+
+def _finish(summary, total):
+    summary.average_score = (total / summary.subject_count).quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+    return summary
+
+
+def _mark_rows(marks):
+    return marks.order_by('student_id', 'term', 'academic_year').values_list(*MARK_COLUMNS)
+
+
+def _save(summaries, batch_size=500):
+    StudentTermSummary.objects.bulk_create(
+        summaries,
+        batch_size=batch_size,
+        update_conflicts=True,
+        unique_fields=SUMMARY_KEY_FIELDS,
+        update_fields=SUMMARY_UPDATE_FIELDS,
+    )
+
+
+def refresh_term_summaries(keys):
+    """
+    Recompute the summaries for a set of (student_id, term, academic_year) keys.
+
+    Called after marks are written; reads only the marks of the affected
+    students, one query per term touched.
+    """
+    by_term = {}
+    for student_id, term, academic_year in keys:
+        by_term.setdefault((term, academic_year), set()).add(student_id)
+
+    with transaction.atomic():
+        for (term, academic_year), student_ids in by_term.items():
+            marks = Mark.objects.filter(term=term, academic_year=academic_year, student_id__in=student_ids)
+            summaries = list(summarize_rows(_mark_rows(marks)))
+            _save(summaries)
+
+            # Students whose last mark for the term was deleted lose their summary
+            summarized = {summary.student_id for summary in summaries}
+            stale = student_ids - summarized
+            if stale:
+                StudentTermSummary.objects.filter(
+                    term=term, academic_year=academic_year, student_id__in=stale
+                ).delete()
+
+
+def rebuild_term_summaries(academic_year=None, batch_size=1000):
+    """Recompute every summary (optionally for one year) from the marks table"""
+    marks = Mark.objects.all()
+    summaries = StudentTermSummary.objects.all()
+    if academic_year:
+        marks = marks.filter(academic_year=academic_year)
+        summaries = summaries.filter(academic_year=academic_year)
+
+    count = 0
+    with transaction.atomic():
+        summaries.delete()
+        batch = []
+        for summary in summarize_rows(_mark_rows(marks).iterator(chunk_size=5000)):
+            batch.append(summary)
+            if len(batch) >= batch_size:
+                _save(batch, batch_size)
+                count += len(batch)
+                batch = []
+        _save(batch, batch_size)
+        count += len(batch)
+    return count
@@ -0,0 +1,23 @@
+# marks/tasks.py
+from celery import shared_task
+
+
+@shared_task
+def run_analytics_job(job_id):
+    """Celery entry point for AnalyticsJob rows queued by marks.jobs.enqueue_job"""
+    from .jobs import run_job
+    run_job(job_id)
+
+
+@shared_task
+def refresh_mark_statistics(subjects):
+    """Re-rank the [term, academic_year, subject_id] groups handed over by marks.refresh"""
+    from .refresh import refresh_mark_statistics as refresh
+    return refresh({tuple(subject) for subject in subjects})
+
+
+@shared_task
+def flag_at_risk_students():
+    """Nightly early-warning run (schedule with celery beat or the flag_at_risk_students command)"""
+    from .early_warning import flag_at_risk_students as run
+    return run()
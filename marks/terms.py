@@ -0,0 +1,173 @@
+# marks/terms.py
+import re
+import time
+from datetime import date
+from django.db.models import SET_NULL
+
+# How long a process trusts its cached current term, in seconds, since the
+# term whose dates contain today changes with the date
+CURRENT_TERM_TTL = 300
+
+_current_term = {'term': None, 'loaded_at': None}
+
+# (term label, academic_year) -> AcademicTerm id, filled as labels are resolved
+_term_ids = {}
+
+# Terms version (marks.cache) the caches above were filled under. Saving or
+# deleting a term bumps it, so every process sharing the Django cache drops
+# its copies on its next lookup rather than keep the id of a deleted term.
+_loaded_version = {'version': None}
+
+
+def parse_term_ordinal(label):
+    """Term number from a label such as "Term 2", "term2" or "2"; None if there is none"""
+    match = re.search(r'\d+', label or '')
+    return int(match.group()) if match else None
+
+
+def term_index(academic_year, ordinal):
+    """
+    Integer that orders terms chronologically: the first year in the academic
+    year label followed by the term number ("2024", 2 -> 20242).
+    """
+    match = re.search(r'\d{4}', academic_year or '')
+    year = int(match.group()) if match else 0
+    return year * 10 + ordinal
+
+
+def term_label(ordinal):
+    return f"Term {ordinal}"
+
+
+def _check_version():
+    from .cache import terms_version
+
+    version = terms_version()
+    if version != _loaded_version['version']:
+        clear_term_caches()
+        _loaded_version['version'] = version
+
+
+def term_ids_for(pairs):
+    """
+    AcademicTerm ids for (term label, academic_year) pairs, creating missing
+    terms. Returns {(term, academic_year): id}; pairs whose label has no term
+    number map to None.
+    """
+    from .models import AcademicTerm
+
+    _check_version()
+    # Creating a term below clears _term_ids (marks.signals), so the answer is
+    # gathered separately
+    resolved = {pair: _term_ids[pair] for pair in pairs if pair in _term_ids}
+    missing = set(pairs) - set(resolved)
+    if missing:
+        wanted = {}
+        for term, academic_year in missing:
+            ordinal = parse_term_ordinal(term)
+            if ordinal is None:
+                resolved[(term, academic_year)] = None
+            else:
+                wanted.setdefault((academic_year, ordinal), []).append((term, academic_year))
+
+        if wanted:
+            existing = {
+                (academic_term.academic_year, academic_term.ordinal): academic_term.pk
+                for academic_term in AcademicTerm.objects.filter(
+                    academic_year__in={academic_year for academic_year, _ in wanted}
+                )
+            }
+            for key, labels in wanted.items():
+                if key not in existing:
+                    academic_year, ordinal = key
+                    existing[key] = AcademicTerm.objects.get_or_create(
+                        academic_year=academic_year, ordinal=ordinal
+                    )[0].pk
+                for label in labels:
+                    resolved[label] = existing[key]
+        _term_ids.update({pair: resolved[pair] for pair in missing})
+
+    return resolved
+
+
+def assign_academic_terms(objects):
+    """Set academic_term_id on model instances from their term/academic_year labels"""
+    objects = list(objects)
+    ids = term_ids_for({(obj.term, obj.academic_year) for obj in objects})
+    for obj in objects:
+        obj.academic_term_id = ids[(obj.term, obj.academic_year)]
+    return objects
+
+
+def current_term():
+    """
+    The current AcademicTerm, cached for the whole process until a term is
+    saved or deleted, or for CURRENT_TERM_TTL seconds.
+
+    The term flagged is_current wins; otherwise the term whose dates contain
+    today, otherwise the latest term. None when there are no terms.
+    """
+    _check_version()
+    loaded_at = _current_term['loaded_at']
+    if loaded_at is None or time.monotonic() - loaded_at > CURRENT_TERM_TTL:
+        from .models import AcademicTerm
+
+        today = date.today()
+        terms = AcademicTerm.objects.order_by('-index')
+        _current_term['term'] = (
+            terms.filter(is_current=True).first()
+            or terms.filter(start_date__lte=today, end_date__gte=today).first()
+            or terms.first()
+        )
+        _current_term['loaded_at'] = time.monotonic()
+    return _current_term['term']
+
+
+def clear_term_caches():
+    _current_term['term'] = _current_term['loaded_at'] = None
+    _term_ids.clear()
+
+
+def relink_academic_term(academic_term):
+    """
+    Point rows back at a term recreated after being deleted: rows whose
+    labels name it but whose academic_term was cleared with the old one.
+    Returns how many rows were linked.
+    """
+    linked = 0
+    for relation in type(academic_term)._meta.related_objects:
+        if relation.on_delete is not SET_NULL:
+            continue
+        orphans = relation.related_model.objects.filter(
+            **{f'{relation.field.name}__isnull': True}, academic_year=academic_term.academic_year,
+        )
+        labels = [
+            label for label in orphans.order_by().values_list('term', flat=True).distinct()
+            if parse_term_ordinal(label) == academic_term.ordinal
+        ]
+        if labels:
+            linked += orphans.filter(term__in=labels).update(**{relation.field.name: academic_term})
+    return linked
+
+
+def link_academic_terms(academic_term_model, models):
+    """
+    Create an AcademicTerm for every term/year label pair used by `models`
+    and point their academic_term at it. Takes the models as arguments so
+    data migrations can pass historical ones.
+    """
+    pairs = set()
+    for model in models:
+        pairs.update(model.objects.values_list('term', 'academic_year').distinct())
+
+    for term, academic_year in pairs:
+        ordinal = parse_term_ordinal(term)
+        if ordinal is None:
+            continue
+        academic_term, _ = academic_term_model.objects.get_or_create(
+            academic_year=academic_year,
+            ordinal=ordinal,
+            defaults={'index': term_index(academic_year, ordinal)},
+        )
+        for model in models:
+            model.objects.filter(term=term, academic_year=academic_year).update(academic_term=academic_term)
@@ -1,3 +1,1171 @@
-from django.test import TestCase
+import csv
+import datetime
+import io
+import json
+import random
+import tempfile
+import zipfile
+from decimal import Decimal
+from unittest import mock, skipUnless
+import numpy as np
+import openpyxl
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import CommandError, call_command
+from django.db import connection, transaction
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from accounts.models import User
+from school_messages.models import Notification
+from students.models import Student
+from teachers.models import Teacher
+from .analytics import StudentPerformanceAnalyzer
+from .bulk import upsert_marks
+from .comparison import compare_terms
+from .cache import cache_stats, student_version, term_version, terms_version
+from .early_warning import find_at_risk, fit_trends, flag_at_risk_students
+from .exporters import CONTENT_TYPES, EXPORT_COLUMNS, stream_export
+from .grading import DEFAULT_WEIGHTS, calculate_total, grade_arrays, grade_for_score
+from .importers import MarkImporter, iter_csv_rows, iter_xlsx_rows
+from .jobs import MAX_ATTEMPTS, recover_stale_jobs, run_job
+from .leaderboard import leaderboard, ranking
+from .models import (
+    AcademicTerm, AnalyticsJob, Mark, PerformanceTrend, RiskFlag, StudentReport, StudentTermSummary, Subject,
+)
+from .pagination import InvalidCursor, decode_cursor, encode_cursor, keyset_page
+from .report_cards import render_pdf, render_report_cards, report_card_data
+from .reports import class_rankings, generate_student_reports
+from .stats import store_standardized_scores, subject_statistics
+from .terms import clear_term_caches, current_term, parse_term_ordinal, term_ids_for, term_index
+from .trends import build_performance_trends
 
-# Create your tests here.
+
+def make_student(admission_number, grade='Form 1', section='A'):
+    user = User.objects.create_user(username=admission_number, password='pw', role='student')
+    return Student.objects.create(
+        user=user, admission_number=admission_number, grade=grade, section=section,
+        date_of_birth=datetime.date(2010, 1, 1), address='-', parent_name='-', parent_phone='-',
+    )
+
+
+def make_teacher(username='teach', classes='Form 1'):
+    user = User.objects.create_user(username=username, password='pw', role='teacher')
+    return Teacher.objects.create(
+        user=user, employee_id=username, department='Sciences', subjects='Mathematics', classes=classes,
+        qualification='B.Ed', experience='5 years', phone='0700000000',
+    )
+
+
+class MarksTestCase(TestCase):
+    """Term ids and analytics are cached per process; rolled-back tests must not leave theirs behind"""
+
+    @classmethod
+    def setUpClass(cls):
+        # Before setUpTestData(), whose marks look up term ids too
+        clear_term_caches()
+        super().setUpClass()
+
+    def setUp(self):
+        clear_term_caches()
+        cache.clear()
+
+
+class GradingParityTests(SimpleTestCase):
+    """grade_arrays() (NumPy) must agree with calculate_total()/grade_for_score() (Decimal)"""
+
+    def assertSameGrading(self, rows, weights=DEFAULT_WEIGHTS):
+        totals, grades = grade_arrays(*zip(*rows), weights=weights)
+        for row, total, grade in zip(rows, totals.tolist(), grades.tolist()):
+            expected = calculate_total(*row, weights=weights)
+            self.assertEqual(Decimal(f'{total:.2f}'), expected, row)
+            self.assertEqual(grade, grade_for_score(expected), row)
+
+    def test_random_scores(self):
+        rng = random.Random(2024)
+
+        def score():
+            return None if rng.random() < 0.1 else Decimal(rng.randint(0, 10000)) / 100
+
+        self.assertSameGrading([(score(), score(), score()) for _ in range(5000)])
+
+    def test_half_cent_totals_round_up(self):
+        # With 25/25/50 weights totals can land on half a cent, e.g. 56.125
+        weights = (Decimal('25'), Decimal('25'), Decimal('50'))
+        rows = [
+            (Decimal('0.02'), None, Decimal('0')),
+            (Decimal('56.25'), Decimal('56.25'), Decimal('56.00')),
+            (Decimal('79.99'), Decimal('80.00'), Decimal('79.99')),
+            (Decimal('12.34'), Decimal('56.77'), Decimal('91.23')),
+        ]
+        self.assertSameGrading(rows, weights)
+        rng = random.Random(7)
+        self.assertSameGrading(
+            [tuple(Decimal(rng.randint(0, 10000)) / 100 for _ in range(3)) for _ in range(5000)], weights,
+        )
+
+    def test_grade_boundaries(self):
+        # Totals on and a cent under the A, D and E minimums (80, 50, 40)
+        full = Decimal('100')
+        rows = [
+            (full, full, Decimal('66.67')), (full, full, Decimal('66.65')),
+            (full, full, Decimal('16.67')), (full, full, Decimal('16.65')),
+            (None, None, Decimal('66.67')), (None, None, Decimal('66.65')),
+            (full, full, full), (None, None, Decimal('0')),
+        ]
+        self.assertEqual(
+            [str(calculate_total(*row)) for row in rows[:6]],
+            ['80.00', '79.99', '50.00', '49.99', '40.00', '39.99'],
+        )
+        self.assertSameGrading(rows)
+
+
+class MarkSheetSaveTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.teacher = make_teacher()
+        cls.subject = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        cls.students = [make_student(f'S{i}') for i in range(3)]
+        cls.outsider = make_student('X1', grade='Form 2')
+
+    def setUp(self):
+        super().setUp()
+        self.client.force_login(self.teacher.user)
+
+    def save_sheet(self, rows, grade='Form 1'):
+        payload = {
+            'grade': grade, 'section': '', 'subject': self.subject.pk,
+            'term': 'Term 1', 'academic_year': '2026', 'rows': rows,
+        }
+        return self.client.post(
+            reverse('mark_sheet_save'), json.dumps(payload), content_type='application/json', secure=True,
+        )
+
+    def rows(self, main_exam_score='70'):
+        return [
+            {'student_id': student.pk, 'cat1_score': '60', 'cat2_score': '', 'main_exam_score': main_exam_score}
+            for student in self.students
+        ]
+
+    def test_sheet_is_graded_and_saved(self):
+        response = self.save_sheet(self.rows())
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json()['saved'], 3)
+
+        expected = calculate_total(Decimal('60'), None, Decimal('70'))
+        marks = Mark.objects.filter(subject=self.subject, term='Term 1', academic_year='2026')
+        self.assertEqual(marks.count(), 3)
+        for mark in marks:
+            self.assertEqual(mark.total_score, expected)
+            self.assertEqual(mark.grade, grade_for_score(expected))
+            self.assertEqual(mark.teacher, self.teacher)
+            self.assertIsNotNone(mark.academic_term_id)
+
+    def test_saving_again_updates_in_place(self):
+        self.save_sheet(self.rows('70'))
+        self.save_sheet(self.rows('90'))
+        marks = Mark.objects.filter(subject=self.subject)
+        self.assertEqual(marks.count(), 3)
+        self.assertEqual(set(marks.values_list('main_exam_score', flat=True)), {Decimal('90.00')})
+
+    def test_invalid_row_saves_nothing(self):
+        rows = self.rows()
+        rows[1]['main_exam_score'] = '120'
+        response = self.save_sheet(rows)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['row_errors']), ['1'])
+        self.assertFalse(Mark.objects.exists())
+
+    def test_student_outside_class_is_rejected(self):
+        rows = self.rows() + [{'student_id': self.outsider.pk, 'main_exam_score': '50'}]
+        response = self.save_sheet(rows)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Mark.objects.exists())
+
+    def test_another_teachers_marks_are_not_overwritten(self):
+        colleague = make_teacher('colleague')
+        Mark.objects.create(
+            student=self.students[0], subject=self.subject, teacher=colleague,
+            term='Term 1', academic_year='2026', main_exam_score=Decimal('40'),
+        )
+        response = self.save_sheet(self.rows('90'))
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(list(response.json()['row_errors']), ['0'])
+        mark = Mark.objects.get()
+        self.assertEqual((mark.teacher, mark.main_exam_score), (colleague, Decimal('40.00')))
+
+    def test_class_not_taught_is_forbidden(self):
+        response = self.save_sheet([{'student_id': self.outsider.pk, 'main_exam_score': '50'}], grade='Form 2')
+        self.assertEqual(response.status_code, 403)
+        self.assertFalse(Mark.objects.exists())
+
+
+class MarkImporterTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        cls.student = make_student('1001')
+        cls.other = make_student('ADM002')
+
+    def import_csv(self, text, **options):
+        return MarkImporter(term='Term 1', academic_year='2026', **options).run(
+            iter_csv_rows(io.BytesIO(text.encode()))
+        )
+
+    def test_rows_are_imported_and_graded(self):
+        importer = self.import_csv(
+            'Admission Number,Subject Code,CAT1 Score,Main Exam Score\n'
+            '1001,MAT,80,75\n'
+            'ADM002,MAT,,40\n'
+        )
+        self.assertEqual((importer.imported, importer.errors), (2, []))
+        mark = Mark.objects.get(student=self.student)
+        self.assertEqual(mark.total_score, calculate_total(Decimal('80'), None, Decimal('75')))
+        self.assertEqual(mark.grade, grade_for_score(mark.total_score))
+
+    def test_bad_rows_are_reported_and_skipped(self):
+        importer = self.import_csv(
+            'admission_number,subject_code,main_exam_score\n'
+            'NOPE,MAT,50\n'
+            '1001,XXX,50\n'
+            '1001,MAT,abc\n'
+            'ADM002,MAT,101\n'
+            '1001,MAT,55\n'
+        )
+        self.assertEqual(importer.imported, 1)
+        self.assertEqual([row for row, _ in importer.errors], [2, 3, 4, 5])
+        self.assertEqual(Mark.objects.get().main_exam_score, Decimal('55.00'))
+
+    def test_reimport_updates_existing_marks(self):
+        self.import_csv('admission_number,subject_code,main_exam_score\n1001,MAT,50\n')
+        self.import_csv('admission_number,subject_code,main_exam_score\n1001,MAT,65\n', batch_size=1)
+        self.assertEqual(Mark.objects.get().main_exam_score, Decimal('65.00'))
+
+    def test_reimport_keeps_the_marks_teacher(self):
+        teacher = make_teacher()
+        Mark.objects.create(
+            student=self.student, subject=self.subject, teacher=teacher,
+            term='Term 1', academic_year='2026', main_exam_score=Decimal('50'),
+        )
+        self.import_csv('admission_number,subject_code,main_exam_score\n1001,MAT,65\n')
+        mark = Mark.objects.get()
+        self.assertEqual((mark.teacher, mark.main_exam_score), (teacher, Decimal('65.00')))
+
+        other = make_teacher('other')
+        self.import_csv('admission_number,subject_code,main_exam_score\n1001,MAT,70\n', teacher=other)
+        self.assertEqual(Mark.objects.get().teacher, other)
+
+    def test_xlsx_numbers_match_text_columns(self):
+        from openpyxl import Workbook
+
+        workbook = Workbook()
+        workbook.active.append(['admission_number', 'subject_code', 'main_exam_score'])
+        workbook.active.append([1001, 'MAT', 67.5])
+        file = io.BytesIO()
+        workbook.save(file)
+        file.seek(0)
+
+        rows = list(iter_xlsx_rows(file))
+        self.assertEqual(rows[1], ['1001', 'MAT', '67.5'])
+        importer = MarkImporter(term='Term 1', academic_year='2026').run(rows)
+        self.assertEqual((importer.imported, importer.errors), (1, []))
+
+
+class KeysetPaginationTests(MarksTestCase):
+    ORDER = ('academic_year', 'term', 'id')
+
+    @classmethod
+    def setUpTestData(cls):
+        student = make_student('S1')
+        subjects = [Subject.objects.create(name=f'Subject {i}', code=f'S{i}', category='sciences') for i in range(4)]
+        for academic_year in ('2025', '2026'):
+            for term in ('Term 1', 'Term 2'):
+                for subject in subjects[:3 if term == 'Term 2' else 4]:
+                    Mark.objects.create(
+                        student=student, subject=subject, term=term, academic_year=academic_year,
+                        main_exam_score=Decimal('50'),
+                    )
+
+    def test_pages_cover_every_row_once_in_order(self):
+        expected = list(Mark.objects.order_by(*[f'-{field}' for field in self.ORDER]).values_list('pk', flat=True))
+        seen, cursor, pages = [], None, 0
+        while True:
+            rows, cursor = keyset_page(Mark.objects.all(), self.ORDER, cursor, page_size=3)
+            seen.extend(mark.pk for mark in rows)
+            pages += 1
+            if cursor is None:
+                break
+        self.assertEqual(seen, expected)
+        self.assertEqual(pages, 5)
+
+    def test_bad_cursors_are_rejected(self):
+        for cursor in (
+            'not base64!',
+            encode_cursor({'id': 1}),
+            encode_cursor(['2026', 'Term 1']),
+            encode_cursor(['2026', 'Term 1', 'abc']),
+            encode_cursor(['2026', 'Term 1', None]),
+            encode_cursor(['2026', ['Term 1'], 5]),
+        ):
+            with self.assertRaises(InvalidCursor, msg=cursor):
+                keyset_page(Mark.objects.all(), self.ORDER, cursor)
+
+    def test_cursor_values_are_converted(self):
+        opts = Mark._meta
+        fields = [opts.get_field(field) for field in self.ORDER]
+        self.assertEqual(decode_cursor(encode_cursor(['2026', 'Term 1', '12']), 3, fields), ['2026', 'Term 1', 12])
+
+
+def make_mark(student, subject, score, term='Term 1', academic_year='2026', **fields):
+    """A mark whose total is `score` (every component scored the same)"""
+    score = Decimal(score)
+    return Mark.objects.create(
+        student=student, subject=subject, term=term, academic_year=academic_year,
+        cat1_score=score, cat2_score=score, main_exam_score=score, **fields,
+    )
+
+
+class SubjectStatisticsTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.students = [make_student(f'S{i}') for i in range(3)]
+        maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        english = Subject.objects.create(name='English', code='ENG', category='languages')
+        for student, score in zip(cls.students, (40, 60, 80)):
+            make_mark(student, maths, score)
+        for student, score in zip(cls.students, (50, 70)):
+            make_mark(student, english, score)
+
+    def test_z_scores_use_the_subject_mean_and_spread(self):
+        statistics = subject_statistics('Term 1', '2026')
+        # English: mean 60, sd 10; Mathematics: mean 60, sd sqrt(800 / 3) = 16.33
+        self.assertEqual(
+            [(subject['subject'], subject['mean'], subject['std']) for subject in statistics['subjects']],
+            [('English', 60.0, 10.0), ('Mathematics', 60.0, 16.33)],
+        )
+        self.assertEqual(
+            [(student['admission_number'], student['z_scores']) for student in statistics['students']],
+            [('S0', [-1.0, -1.22]), ('S1', [1.0, 0.0]), ('S2', [None, 1.22])],
+        )
+
+    def test_z_scores_are_served(self):
+        self.client.force_login(User.objects.create_user(username='head', password='pw', role='admin'))
+        response = self.client.get(reverse('subject_statistics'), secure=True)
+        self.assertContains(response, 'Z-Scores')
+        self.assertContains(response, '-1.22')
+        response = self.client.get(reverse('subject_statistics_data'), secure=True)
+        self.assertEqual(response.json()['students'][2]['z_scores'], [None, 1.22])
+
+
+# Callbacks run on commit here re-rank marks inline instead of in a background thread
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class TermSummaryTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = make_student('S1')
+        cls.maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        cls.english = Subject.objects.create(name='English', code='ENG', category='languages')
+
+    def summary(self):
+        return StudentTermSummary.objects.filter(student=self.student, term='Term 1', academic_year='2026').first()
+
+    def assertSummary(self, average_score, subject_count, pass_count, best_subject, worst_subject):
+        summary = self.summary()
+        self.assertEqual(
+            (summary.average_score, summary.subject_count, summary.pass_count, summary.best_subject, summary.worst_subject),
+            (Decimal(average_score), subject_count, pass_count, best_subject, worst_subject),
+        )
+
+    def test_summary_follows_saved_and_deleted_marks(self):
+        maths = make_mark(self.student, self.maths, 80)
+        self.assertSummary('80.00', 1, 1, self.maths, self.maths)
+        english = make_mark(self.student, self.english, 25)
+        self.assertSummary('52.50', 2, 1, self.maths, self.english)
+        self.assertEqual((self.summary().grade_a_count, self.summary().grade_f_count), (1, 1))
+
+        english.main_exam_score = english.cat1_score = english.cat2_score = Decimal('90')
+        english.save()
+        self.assertSummary('85.00', 2, 2, self.english, self.maths)
+
+        maths.delete()
+        self.assertSummary('90.00', 1, 1, self.english, self.english)
+        english.delete()
+        self.assertIsNone(self.summary())
+
+    def test_summary_follows_bulk_writes(self):
+        def sheet(maths, english):
+            return [
+                Mark(student=self.student, subject=subject, term='Term 1', academic_year='2026',
+                     cat1_score=Decimal(score), cat2_score=Decimal(score), main_exam_score=Decimal(score))
+                for subject, score in ((self.maths, maths), (self.english, english))
+            ]
+
+        upsert_marks(sheet(60, 70))
+        self.assertSummary('65.00', 2, 2, self.english, self.maths)
+        upsert_marks(sheet(60, 20))
+        self.assertSummary('40.00', 2, 1, self.maths, self.english)
+
+    def test_cache_versions_are_bumped_on_commit(self):
+        versions = (term_version('Term 1', '2026'), student_version(self.student.pk), terms_version())
+        with self.captureOnCommitCallbacks(execute=True):
+            make_mark(self.student, self.maths, 80)
+            self.assertEqual(
+                (term_version('Term 1', '2026'), student_version(self.student.pk), terms_version()), versions,
+            )
+        # Writing the term's first mark also created its AcademicTerm
+        after = (term_version('Term 1', '2026'), student_version(self.student.pk), terms_version())
+        self.assertTrue(all(new > old for new, old in zip(after, versions)), (versions, after))
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class AnalyticsCacheTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.subject = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        make_mark(make_student('S1'), cls.subject, 50)
+
+    def mean(self):
+        return subject_statistics('Term 1', '2026')['subjects'][0]['mean']
+
+    def test_mark_write_refreshes_cached_analytics(self):
+        self.assertEqual(self.mean(), 50.0)
+        version = term_version('Term 1', '2026')
+        with self.captureOnCommitCallbacks(execute=True):
+            make_mark(make_student('S2'), self.subject, 70)
+        self.assertGreater(term_version('Term 1', '2026'), version)
+        self.assertEqual(self.mean(), 60.0)
+        self.assertEqual(self.mean(), 60.0)
+        self.assertEqual(
+            cache_stats(['subject_statistics'])['subject_statistics'], {'hits': 1, 'misses': 2, 'hit_rate': 33.3},
+        )
+
+    def test_rolled_back_write_leaves_cache_alone(self):
+        self.assertEqual(self.mean(), 50.0)
+        version = term_version('Term 1', '2026')
+        with self.captureOnCommitCallbacks(execute=True) as callbacks:
+            with self.assertRaises(RuntimeError):
+                with transaction.atomic():
+                    make_mark(make_student('S2'), self.subject, 70)
+                    raise RuntimeError('rolled back')
+        self.assertEqual(callbacks, [])
+        self.assertEqual(term_version('Term 1', '2026'), version)
+        self.assertEqual(self.mean(), 50.0)
+        self.assertEqual(cache_stats(['subject_statistics'])['subject_statistics']['hits'], 1)
+
+
+class ClassRankingTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        english = Subject.objects.create(name='English', code='ENG', category='languages')
+        # Averages in 1A: 80, 70, 70 (a tie), 60; 1B has one student
+        cls.students = {}
+        for admission_number, section, scores in (
+            ('A1', 'A', (85, 75)), ('A2', 'A', (70, 70)), ('A3', 'A', (60, 80)), ('A4', 'A', (60, 60)),
+            ('B1', 'B', (40, 50)),
+        ):
+            student = cls.students[admission_number] = make_student(admission_number, section=section)
+            for subject, score in zip((maths, english), scores):
+                make_mark(student, subject, score)
+
+    def positions(self, rank_method):
+        return {
+            row['student_id']: (row['position'], row['class_size'])
+            for row in class_rankings('Term 1', '2026', rank_method=rank_method)
+        }
+
+    def expected(self, *positions):
+        return {
+            self.students[admission_number].pk: position
+            for admission_number, position in zip(('A1', 'A2', 'A3', 'A4', 'B1'), positions)
+        }
+
+    def test_ties_share_a_position(self):
+        self.assertEqual(self.positions('competition'), self.expected((1, 4), (2, 4), (2, 4), (4, 4), (1, 1)))
+        self.assertEqual(self.positions('dense'), self.expected((1, 4), (2, 4), (2, 4), (3, 4), (1, 1)))
+
+    def test_reports_are_generated_and_refreshed(self):
+        self.assertEqual(generate_student_reports('Term 1', '2026'), 5)
+        StudentReport.objects.filter(student=self.students['A1']).update(teacher_comment='Well done')
+        generate_student_reports('Term 1', '2026', rank_method='dense')
+
+        reports = {
+            report.student.admission_number: report
+            for report in StudentReport.objects.filter(term='Term 1', academic_year='2026').select_related('student')
+        }
+        self.assertEqual(
+            {number: (report.class_position, report.total_students) for number, report in reports.items()},
+            {'A1': (1, 4), 'A2': (2, 4), 'A3': (2, 4), 'A4': (3, 4), 'B1': (1, 1)},
+        )
+        self.assertEqual((reports['A1'].average_score, reports['A1'].overall_grade), (Decimal('80.00'), 'A'))
+        self.assertEqual(reports['A1'].teacher_comment, 'Well done')
+        self.assertIsNotNone(reports['A1'].academic_term_id)
+
+
+class ResultsConditionalGetTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = make_student('S1')
+        cls.subject = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        make_mark(cls.student, cls.subject, 70)
+        make_mark(cls.student, cls.subject, 80, term='Term 2')
+
+    def get(self, url, **headers):
+        return self.client.get(url, secure=True, **headers)
+
+    def assertRevalidates(self, url):
+        response = self.get(url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 304)
+        self.assertEqual(self.get(url, HTTP_IF_MODIFIED_SINCE=response['Last-Modified']).status_code, 304)
+        return response
+
+    def test_results_page_is_revalidated(self):
+        self.client.force_login(self.student.user)
+        url = reverse('student_results')
+        response = self.assertRevalidates(url)
+
+        make_mark(self.student, Subject.objects.create(name='English', code='ENG', category='languages'), 60)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=response['ETag']).status_code, 200)
+
+    def test_performance_page_is_revalidated(self):
+        self.client.force_login(make_teacher().user)
+        self.assertRevalidates(reverse('student_performance_detail', args=[self.student.pk]))
+
+    def test_page_is_rendered_while_messages_are_queued(self):
+        self.client.force_login(self.student.user)
+        url = reverse('student_results')
+        etag = self.get(url)['ETag']
+        # Someone else's analysis is refused with a message for the next page
+        self.get(reverse('student_performance_detail', args=[make_student('S2').pk]))
+
+        response = self.get(url, HTTP_IF_NONE_MATCH=etag)
+        self.assertContains(response, 'Access denied.')
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 304)
+
+    def test_new_login_changes_the_validator(self):
+        self.client.force_login(self.student.user)
+        url = reverse('student_results')
+        etag = self.get(url)['ETag']
+        self.client.logout()
+        self.client.force_login(self.student.user)
+        self.assertEqual(self.get(url, HTTP_IF_NONE_MATCH=etag).status_code, 200)
+
+
+class DuplicateReportMigrationTests(TransactionTestCase):
+    """0004_studentreport_unique keeps the newest report of each student and term"""
+
+    def migrate(self, targets):
+        MigrationExecutor(connection).migrate(targets)
+        loader = MigrationExecutor(connection).loader
+        return loader.project_state(list(loader.applied_migrations)).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_only_duplicates_are_removed(self):
+        apps = self.migrate([('marks', '0003_gradingscheme')])
+        User = apps.get_model('accounts', 'User')
+        Student = apps.get_model('students', 'Student')
+        StudentReport = apps.get_model('marks', 'StudentReport')
+
+        def report(student, term):
+            return StudentReport.objects.create(
+                student=student, term=term, academic_year='2026', average_score=Decimal('50'), overall_grade='C',
+                class_position=1, total_students=2,
+            ).pk
+
+        students = [
+            Student.objects.create(
+                user=User.objects.create(username=f'S{i}', role='student'), admission_number=f'S{i}',
+                grade='Form 1', section='A', date_of_birth=datetime.date(2010, 1, 1),
+                address='-', parent_name='-', parent_phone='-',
+            )
+            for i in range(2)
+        ]
+        report(students[0], 'Term 1')
+        report(students[0], 'Term 1')
+        kept = [report(students[0], 'Term 1'), report(students[0], 'Term 2'), report(students[1], 'Term 1')]
+
+        apps = self.migrate([('marks', '0004_studentreport_unique')])
+        StudentReport = apps.get_model('marks', 'StudentReport')
+        self.assertEqual(sorted(StudentReport.objects.values_list('pk', flat=True)), kept)
+
+
+class PerformanceTrendBuildTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        cls.english = Subject.objects.create(name='English', code='ENG', category='languages')
+        cls.rising, cls.falling = make_student('S1'), make_student('S2')
+        for student, term, scores in (
+            (cls.rising, 'Term 1', (60, 50)), (cls.rising, 'Term 2', (72, 50)),
+            (cls.falling, 'Term 1', (80, 80)), (cls.falling, 'Term 2', (70, 70)),
+        ):
+            for subject, score in zip((cls.maths, cls.english), scores):
+                make_mark(student, subject, score, term=term)
+
+    def trend(self, student, term='Term 2'):
+        return PerformanceTrend.objects.get(student=student, term=term, academic_year='2026')
+
+    def test_terms_are_compared_with_the_one_before(self):
+        self.assertEqual(build_performance_trends(), (4, 0))
+
+        first = self.trend(self.rising, 'Term 1')
+        self.assertEqual(
+            (first.current_term_average, first.previous_term_average, first.trend), (Decimal('55.00'), None, 'stable'),
+        )
+        rising = self.trend(self.rising)
+        self.assertEqual((rising.current_term_average, rising.score_change), (Decimal('61.00'), Decimal('6.00')))
+        self.assertEqual((rising.trend, rising.trend_direction), ('significant_improvement', 'positive'))
+        self.assertEqual((rising.most_improved_subject, rising.improvement_amount), (self.maths, Decimal('12.00')))
+        self.assertEqual((rising.strongest_subject, rising.weakest_subject), (self.maths, self.english))
+        falling = self.trend(self.falling)
+        self.assertEqual((falling.percentage_change, falling.trend), (Decimal('-12.50'), 'significant_decline'))
+        self.assertIsNone(falling.most_improved_subject)
+
+        mark = Mark.objects.get(student=self.falling, subject=self.maths, term='Term 2')
+        mark.cat1_score = mark.cat2_score = mark.main_exam_score = Decimal(90)
+        mark.save()
+        self.assertEqual(build_performance_trends(term='Term 2'), (0, 2))
+        self.assertEqual(self.trend(self.falling).current_term_average, Decimal('80.00'))
+
+    def test_queries_do_not_grow_with_students(self):
+        def queries():
+            PerformanceTrend.objects.all().delete()
+            with CaptureQueriesContext(connection) as captured:
+                build_performance_trends()
+            return len(captured)
+
+        before = queries()
+        for number in range(3, 8):
+            student = make_student(f'S{number}')
+            for term in ('Term 1', 'Term 2'):
+                make_mark(student, self.maths, 50 + number, term=term)
+        self.assertEqual(queries(), before)
+        self.assertEqual(PerformanceTrend.objects.count(), 14)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True, ANALYTICS_JOB_CHUNK_SIZE=2)
+class AnalyticsJobTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.admin = User.objects.create_user(username='head', password='pw', role='admin')
+        maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        cls.students = [make_student(f'S{number}') for number in range(5)]
+        for student in cls.students:
+            make_mark(student, maths, 60)
+
+    def start(self):
+        self.client.force_login(self.admin)
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(
+                reverse('generate_performance_trends'), {'update_existing': 'on'},
+                secure=True, HTTP_X_REQUESTED_WITH='XMLHttpRequest',
+            )
+        self.assertEqual(response.status_code, 202)
+        return self.client.get(response.json()['status_url'], secure=True).json()
+
+    def test_job_runs_in_chunks_and_reports_progress(self):
+        status = self.start()
+        self.assertEqual(
+            (status['status'], status['total'], status['processed'], status['percent']), ('completed', 5, 5, 100),
+        )
+        self.assertEqual(status['result'], {'created': 5, 'updated': 0})
+        self.assertEqual(PerformanceTrend.objects.count(), 5)
+        self.assertIsNotNone(AnalyticsJob.objects.get().heartbeat_at)
+
+    def test_failed_chunk_is_recorded_and_the_rest_still_run(self):
+        failing = self.students[2].pk
+
+        def build(student_ids=None, **options):
+            if failing in student_ids:
+                raise ValueError('bad chunk')
+            return build_performance_trends(student_ids=student_ids, **options)
+
+        with mock.patch('marks.trends.build_performance_trends', build), self.assertLogs('marks.jobs', 'ERROR'):
+            status = self.start()
+        self.assertEqual((status['status'], status['processed'], status['error_count']), ('completed', 5, 1))
+        self.assertIn('bad chunk', status['errors'][0])
+        self.assertEqual(status['result'], {'created': 3, 'updated': 0})
+
+    def test_lost_jobs_are_requeued_then_abandoned(self):
+        long_ago = timezone.now() - datetime.timedelta(seconds=settings.ANALYTICS_JOB_STALE_AFTER + 1)
+        lost = AnalyticsJob.objects.create(
+            kind='performance_trends', status='running', started_at=long_ago, heartbeat_at=long_ago,
+            attempts=1, processed=2,
+        )
+        alive = AnalyticsJob.objects.create(
+            kind='performance_trends', status='running', started_at=long_ago, heartbeat_at=timezone.now(),
+        )
+        worn_out = AnalyticsJob.objects.create(
+            kind='performance_trends', status='running', started_at=long_ago, attempts=MAX_ATTEMPTS,
+        )
+
+        with self.assertLogs('marks.jobs', 'WARNING'):
+            self.assertEqual(recover_stale_jobs(), [lost.pk])
+        self.assertEqual(
+            {job.pk: job.status for job in AnalyticsJob.objects.all()},
+            {lost.pk: 'queued', alive.pk: 'running', worn_out.pk: 'failed'},
+        )
+        self.assertEqual(AnalyticsJob.objects.get(pk=lost.pk).processed, 0)
+
+        self.assertEqual(run_job(lost.pk).status, 'completed')
+        self.assertEqual(AnalyticsJob.objects.get(pk=lost.pk).attempts, 2)
+
+
+class AnalyzeManyTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        english = Subject.objects.create(name='English', code='ENG', category='languages')
+        cls.rising, cls.steady, cls.unmarked = make_student('S1'), make_student('S2'), make_student('S3')
+        for term, scores in (('Term 1', (50, 50)), ('Term 2', (60, 50))):
+            for subject, score in zip((maths, english), scores):
+                make_mark(cls.rising, subject, score, term=term)
+        make_mark(cls.steady, maths, 70)
+
+    def test_cohort_is_analysed_in_two_queries(self):
+        analyzer = StudentPerformanceAnalyzer()
+        with self.assertNumQueries(2):
+            analyses = analyzer.analyze_many([self.rising.pk, self.steady.pk, self.unmarked.pk])
+
+        self.assertEqual(set(analyses), {self.rising.pk, self.steady.pk})
+        rising = analyses[self.rising.pk]
+        self.assertEqual([p['average_score'] for p in rising['performances']], [50.0, 55.0])
+        self.assertEqual((rising['overall_change'], rising['overall_percentage']), (5.0, 10.0))
+        self.assertEqual(rising['overall_trend'], 'Gradually Improving')
+        comparison = rising['comparisons'][0]['comparison']
+        self.assertEqual((comparison['trend'], comparison['most_improved_subject']), ('improving', 'Mathematics'))
+        self.assertEqual(analyses[self.steady.pk]['overall_trend'], 'Insufficient Data')
+
+        self.assertEqual(analyzer.generate_trend_analysis(str(self.rising.pk)), rising)
+        self.assertIsNone(analyzer.generate_trend_analysis(self.unmarked.pk))
+
+
+class AcademicTermTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.student = make_student('S1')
+        cls.maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+
+    def test_labels_resolve_to_chronological_terms(self):
+        self.assertEqual((parse_term_ordinal('term2'), parse_term_ordinal('Mid-year')), (2, None))
+        self.assertEqual(term_index('2025/2026', 3), 20253)
+        first = make_mark(self.student, self.maths, 50, term='term 3', academic_year='2025')
+        second = make_mark(self.student, self.maths, 60, term='Term 1')
+        make_mark(make_student('S2'), self.maths, 70, term='Term 1')
+
+        self.assertEqual(AcademicTerm.objects.count(), 2)
+        self.assertEqual(second.academic_term, AcademicTerm.objects.get(academic_year='2026', ordinal=1))
+        self.assertEqual(list(AcademicTerm.with_marks()), [first.academic_term, second.academic_term])
+        self.assertEqual(second.academic_term.get_previous(), first.academic_term)
+
+    def test_current_term_is_cached_until_a_term_changes(self):
+        AcademicTerm.objects.create(academic_year='2026', ordinal=1)
+        latest = AcademicTerm.objects.create(academic_year='2026', ordinal=2)
+        with self.captureOnCommitCallbacks(execute=True):
+            flagged = AcademicTerm.objects.create(academic_year='2025', ordinal=3, is_current=True)
+        self.assertEqual(current_term(), flagged)
+        with self.assertNumQueries(0):
+            self.assertEqual(current_term(), flagged)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            flagged.is_current = False
+            flagged.save()
+        self.assertEqual(current_term(), latest)
+
+    def test_recreated_term_gets_its_marks_back(self):
+        mark = make_mark(self.student, self.maths, 50)
+        with self.captureOnCommitCallbacks(execute=True):
+            mark.academic_term.delete()
+        mark.refresh_from_db()
+        self.assertIsNone(mark.academic_term_id)
+
+        with self.captureOnCommitCallbacks(execute=True):
+            academic_term = AcademicTerm.objects.create(academic_year='2026', ordinal=1)
+        mark.refresh_from_db()
+        self.assertEqual(mark.academic_term, academic_term)
+        self.assertEqual(term_ids_for({('Term 1', '2026')}), {('Term 1', '2026'): academic_term.pk})
+
+
+class HotQueryPlanTests(MarksTestCase):
+    def explain(self, *args):
+        out = io.StringIO()
+        call_command('explain_hot_queries', *args, stdout=out)
+        return out.getvalue()
+
+    def test_queries_without_data_are_skipped(self):
+        self.assertIn('no data to sample, skipped', self.explain('term_student_averages'))
+        self.assertIn('student_marks: All marks of one student', self.explain('--list'))
+        with self.assertRaisesMessage(CommandError, 'Unknown hot queries: nope'):
+            self.explain('nope')
+
+    @skipUnless(connection.vendor == 'sqlite', 'plans differ between databases')
+    def test_hot_queries_use_their_indexes(self):
+        teacher = make_teacher()
+        maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        make_mark(make_student('S1'), maths, 60, teacher=teacher)
+
+        plans = self.explain()
+        for index in ('mark_term_student_idx', 'mark_acterm_student_idx', 'mark_teacher_entered_idx',
+                      'mark_subject_pct_idx'):
+            self.assertIn(f'USING INDEX {index}', plans)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class LeaderboardTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        english = Subject.objects.create(name='English', code='ENG', category='languages')
+        # Averages: 80, 70, 70 (a tie), 45; S4 is in Form 2
+        cls.students = {}
+        for admission_number, grade, scores in (
+            ('S1', 'Form 1', (85, 75)), ('S2', 'Form 1', (70, 70)), ('S3', 'Form 1', (60, 80)),
+            ('S4', 'Form 2', (40, 50)),
+        ):
+            student = cls.students[admission_number] = make_student(admission_number, grade=grade)
+            for subject, score in zip((cls.maths, english), scores):
+                make_mark(student, subject, score)
+
+    def ranks(self, entries):
+        return [(entry['admission_number'], entry['rank'], entry['average']) for entry in entries]
+
+    def test_students_are_ranked_in_each_scope(self):
+        term = {'term': 'Term 1', 'academic_year': '2026'}
+        self.assertEqual(
+            self.ranks(ranking(**term)),
+            [('S1', 1, 80.0), ('S2', 2, 70.0), ('S3', 2, 70.0), ('S4', 4, 45.0)],
+        )
+        self.assertEqual(self.ranks(ranking(grade='Form 2', **term)), [('S4', 1, 45.0)])
+        self.assertEqual(
+            self.ranks(ranking(subject=self.maths, **term)),
+            [('S1', 1, 85.0), ('S2', 2, 70.0), ('S3', 3, 60.0), ('S4', 4, 40.0)],
+        )
+
+        board = leaderboard(2, **term)
+        self.assertEqual(board['size'], 4)
+        self.assertEqual([entry['admission_number'] for entry in board['bottom']], ['S4', 'S3'])
+
+    def test_ranking_is_one_query_then_cached_until_a_mark_is_written(self):
+        with self.assertNumQueries(1):
+            ranking(term='Term 1', academic_year='2026')
+        with self.assertNumQueries(0):
+            ranking(term='Term 1', academic_year='2026')
+
+        with self.captureOnCommitCallbacks(execute=True):
+            make_mark(make_student('S5'), self.maths, 99)
+        self.assertEqual(ranking(term='Term 1', academic_year='2026')[0]['admission_number'], 'S5')
+
+    def test_at_a_glance_is_served_to_staff_only(self):
+        self.client.force_login(make_teacher().user)
+        response = self.client.get(reverse('analytics_at_a_glance'), {'limit': 1}, secure=True)
+        data = response.json()
+        self.assertEqual((data['term'], data['students'], data['average']), ('Term 1', 4, 66.25))
+        self.assertEqual([entry['admission_number'] for entry in data['grades']['Form 1']['top']], ['S1'])
+        self.assertEqual(data['subjects']['English']['top'][0]['admission_number'], 'S3')
+
+        self.client.force_login(self.students['S1'].user)
+        response = self.client.get(reverse('analytics_at_a_glance'), secure=True)
+        self.assertEqual(response.status_code, 403)
+
+
+class TermComparisonTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        english = Subject.objects.create(name='English', code='ENG', category='languages')
+        first, second = make_student('S1', section='A'), make_student('S2', grade='Form 2', section='B')
+        for student, subject, scores in (
+            (first, maths, (60, 80)), (first, english, (30, 50)), (second, maths, (70, 70)),
+        ):
+            for term, score in zip(('Term 1', 'Term 2'), scores):
+                make_mark(student, subject, score, term=term)
+
+    def changes(self, rows):
+        return {row['label']: (row['term1']['average'], row['term2']['average'], row['difference']) for row in rows}
+
+    def test_terms_are_compared_overall_and_by_group_in_one_query(self):
+        with self.assertNumQueries(1):
+            comparison = compare_terms('Term 1', '2026', 'Term 2', '2026')
+
+        self.assertEqual((comparison['term1']['average'], comparison['term2']['average']), (53.33, 66.67))
+        self.assertEqual((comparison['difference'], comparison['percentage_change']), (13.34, 25.01))
+        self.assertEqual((comparison['term1']['pass_rate'], comparison['pass_rate_change']), (66.67, 33.33))
+        fail = next(shift for shift in comparison['grade_shift'] if shift['grade'] == 'F')
+        self.assertEqual((fail['term1'], fail['term2'], fail['change']), (33.33, 0.0, -33.33))
+
+        self.assertEqual(
+            self.changes(comparison['subjects']),
+            {'English': (30.0, 50.0, 20.0), 'Mathematics': (65.0, 75.0, 10.0)},
+        )
+        self.assertEqual(
+            self.changes(comparison['grades']), {'Form 1': (45.0, 65.0, 20.0), 'Form 2': (70.0, 70.0, 0.0)},
+        )
+        self.assertEqual([row['label'] for row in comparison['sections']], ['Form 1 A', 'Form 2 B'])
+
+        with self.assertNumQueries(0):
+            self.assertEqual(compare_terms('Term 1', '2026', 'Term 2', '2026'), comparison)
+
+    def test_term_without_marks_has_no_comparison(self):
+        self.assertIsNone(compare_terms('Term 1', '2026', 'Term 3', '2026'))
+
+    def test_comparison_page(self):
+        self.client.force_login(make_teacher().user)
+        response = self.client.get(
+            reverse('term_comparison_analytics'), {'term1': 'Term 1|2026', 'term2': 'Term 2|2026'}, secure=True,
+        )
+        self.assertEqual(response.context['comparison_data']['difference'], 13.34)
+        self.assertContains(response, 'Form 2 B')
+
+
+class ReportCardTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        cls.students = [make_student('S1'), make_student('S2'), make_student('S3', grade='Form 2')]
+        for student, score in zip(cls.students, (70, 60, 50)):
+            make_mark(student, maths, score)
+        generate_student_reports('Term 1', '2026')
+        cls.teacher = make_teacher(classes='Form 1')
+
+    def setUp(self):
+        super().setUp()
+        # Rendered PDFs are kept in default storage
+        media = tempfile.TemporaryDirectory()
+        self.addCleanup(media.cleanup)
+        media_root = self.settings(MEDIA_ROOT=media.name)
+        media_root.enable()
+        self.addCleanup(media_root.disable)
+
+    def download(self, student):
+        report = StudentReport.objects.get(student=student)
+        return self.client.get(reverse('report_card_download', args=[report.pk]), secure=True)
+
+    def test_card_download_is_limited_to_the_teachers_classes(self):
+        self.client.force_login(self.teacher.user)
+        response = self.download(self.students[0])
+        self.assertEqual(response['Content-Type'], 'application/pdf')
+        self.assertTrue(response.content.startswith(b'%PDF'))
+        self.assertIn('S1_Term_1_2026.pdf', response['Content-Disposition'])
+        self.assertEqual(self.download(self.students[2]).status_code, 404)
+
+        self.client.force_login(self.students[0].user)
+        self.assertEqual(self.download(self.students[0]).status_code, 200)
+        self.assertEqual(self.download(self.students[1]).status_code, 404)
+
+    def test_class_cards_are_refused_for_a_class_not_taught(self):
+        self.client.force_login(self.teacher.user)
+        response = self.client.get(
+            reverse('report_cards'), {'grade': 'Form 2', 'term': 'Term 1', 'academic_year': '2026', 'output': 'pdf'},
+            secure=True,
+        )
+        self.assertContains(response, 'You do not teach this class.')
+
+    def test_zip_holds_one_pdf_per_student(self):
+        self.client.force_login(self.teacher.user)
+        response = self.client.get(
+            reverse('report_cards'), {'grade': 'Form 1', 'term': 'Term 1', 'academic_year': '2026', 'output': 'zip'},
+            secure=True,
+        )
+        self.assertTrue(response.streaming)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        self.assertEqual(sorted(archive.namelist()), ['S1_Term_1_2026.pdf', 'S2_Term_1_2026.pdf'])
+        for name in archive.namelist():
+            self.assertTrue(archive.read(name).startswith(b'%PDF'))
+
+    def test_unchanged_cards_are_not_drawn_again(self):
+        cards = report_card_data('Term 1', '2026', grade='Form 1')
+        with mock.patch('marks.report_cards.render_pdf', wraps=render_pdf) as render:
+            first = render_report_cards(cards)
+            self.assertEqual(render.call_count, 2)
+            self.assertEqual(render_report_cards(cards), first)
+            self.assertEqual(render.call_count, 2)
+
+            cards[0]['teacher_comment'] = 'Well done'
+            render_report_cards(cards)
+            self.assertEqual(render.call_count, 3)
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class StandardizedScoreTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        # 1A is marked 30 points more leniently than 1B; both spread their marks alike
+        cls.students = {}
+        for admission_number, section, score in (('A1', 'A', 80), ('A2', 'A', 60), ('B1', 'B', 50), ('B2', 'B', 30)):
+            student = cls.students[admission_number] = make_student(admission_number, section=section)
+            make_mark(student, maths, score)
+
+    def test_class_marking_is_taken_out(self):
+        self.assertEqual(store_standardized_scores('2026'), 4)
+        # Subject mean 55 and standard deviation sqrt(325); every class z-score is +1 or -1
+        self.assertEqual(
+            {mark.student.admission_number: mark.standardized_score for mark in Mark.objects.select_related('student')},
+            {'A1': Decimal('73.03'), 'A2': Decimal('36.97'), 'B1': Decimal('73.03'), 'B2': Decimal('36.97')},
+        )
+        self.assertEqual(store_standardized_scores('2026'), 0)
+
+    def test_rankings_use_standardized_scores_and_reports_keep_raw_ones(self):
+        store_standardized_scores('2026')
+        term = {'term': 'Term 1', 'academic_year': '2026'}
+        self.assertEqual(
+            [(entry['admission_number'], entry['rank']) for entry in ranking(score='standardized', **term)],
+            [('A1', 1), ('B1', 1), ('A2', 3), ('B2', 3)],
+        )
+        self.assertEqual([entry['admission_number'] for entry in ranking(**term)][:2], ['A1', 'A2'])
+
+        generate_student_reports('Term 1', '2026', score='standardized')
+        report = StudentReport.objects.get(student=self.students['B1'])
+        self.assertEqual(
+            (report.class_position, report.average_score, report.overall_grade), (1, Decimal('50.00'), 'D'),
+        )
+
+
+class TrendFitTests(SimpleTestCase):
+    def test_lines_are_fitted_per_row_ignoring_gaps(self):
+        nan = float('nan')
+        values = np.array([[50, 45, 40], [nan, 60, 70], [80, nan, nan], [10, nan, 31]])
+        intercepts, slopes, counts = fit_trends(values)
+        np.testing.assert_allclose(slopes, [-5, 10, nan, 10.5])
+        np.testing.assert_allclose(intercepts, [50, 50, nan, 10])
+        self.assertEqual(counts.tolist(), [3, 2, 1, 2])
+        # Same line as numpy.polyfit on the row's points
+        np.testing.assert_allclose(np.polyfit([0, 1, 2], [60, 50, 42], 1), [-9, 59 + 2 / 3])
+        np.testing.assert_allclose(fit_trends(np.array([[60, 50, 42]]))[1], [-9])
+
+
+@override_settings(CELERY_TASK_ALWAYS_EAGER=True)
+class EarlyWarningTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        subjects = [
+            Subject.objects.create(name=name, code=name[:3].upper(), category='sciences')
+            for name in ('Biology', 'Chemistry', 'Physics')
+        ]
+        cls.teacher = make_teacher(classes='Form 1')
+        cls.students = {}
+        for admission_number, terms in (
+            # Average 60, 50, 42: slope -9 a term, projected 32.67 next term
+            ('DOWN', [(60,), (50,), (42,)]),
+            # Average 60, 60, 50 but failed subjects 0, 1, 2
+            ('FAILS', [(60, 60, 60), (90, 30, 60), (90, 30, 30)]),
+            ('STEADY', [(70,), (70,), (70,)]),
+            ('NEW', [None, None, (20,)]),
+        ):
+            student = cls.students[admission_number] = make_student(admission_number)
+            for ordinal, scores in enumerate(terms, start=1):
+                for subject, score in zip(subjects, scores or ()):
+                    make_mark(student, subject, score, term=f'Term {ordinal}')
+
+    def flags(self):
+        return {
+            (flag.student.admission_number, flag.reason): flag
+            for flag in RiskFlag.objects.filter(is_active=True).select_related('student')
+        }
+
+    def test_students_heading_down_are_flagged_once(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            summary = flag_at_risk_students()
+        self.assertEqual(summary, {'flagged': 2, 'retired': 0, 'notifications': 1})
+
+        flags = self.flags()
+        self.assertEqual(set(flags), {('DOWN', 'declining'), ('FAILS', 'failing')})
+        down = flags[('DOWN', 'declining')]
+        self.assertEqual(
+            (down.current_average, down.projected_average, down.slope, down.terms_used),
+            (Decimal('42.00'), Decimal('32.67'), -9.0, 3),
+        )
+        fails = flags[('FAILS', 'failing')]
+        self.assertEqual((fails.fail_count, fails.previous_fail_count, fails.slope), (2, 1, -5.0))
+        self.assertEqual(down.academic_term, AcademicTerm.objects.get(academic_year='2026', ordinal=3))
+
+        notification = Notification.objects.get(user=self.teacher.user)
+        self.assertEqual(notification.title, '2 students at risk')
+
+        # Nothing new to tell on the next run
+        with self.captureOnCommitCallbacks(execute=True):
+            self.assertEqual(flag_at_risk_students()['notifications'], 0)
+
+    def test_recovered_students_have_their_flags_retired(self):
+        flag_at_risk_students(notify=False)
+        mark = Mark.objects.get(student=self.students['DOWN'], term='Term 3')
+        mark.cat1_score = mark.cat2_score = mark.main_exam_score = Decimal(80)
+        mark.save()
+
+        self.assertEqual(flag_at_risk_students(notify=False)['retired'], 1)
+        self.assertEqual(set(self.flags()), {('FAILS', 'failing')})
+
+    def test_term_still_being_marked_is_not_judged(self):
+        # One result in a new term is far from the six of the term before
+        make_mark(self.students['STEADY'], Subject.objects.get(name='Biology'), 10, academic_year='2027')
+        academic_term, _ = find_at_risk()
+        self.assertEqual((academic_term.academic_year, academic_term.ordinal), ('2026', 3))
+        self.assertEqual(find_at_risk(coverage=0)[0].academic_year, '2027')
+
+
+class MarkExportTests(MarksTestCase):
+    @classmethod
+    def setUpTestData(cls):
+        cls.maths = Subject.objects.create(name='Mathematics', code='MAT', category='sciences')
+        cls.student = make_student('S1')
+        cls.student.user.first_name, cls.student.user.last_name = 'Amina', 'Njeri'
+        cls.student.user.save()
+        make_mark(cls.student, cls.maths, 70, comments='Good, steady work')
+        make_mark(cls.student, cls.maths, 80, term='Term 2')
+        make_mark(make_student('S2', grade='Form 2'), cls.maths, 50)
+        cls.teacher = make_teacher()
+
+    def export(self, **params):
+        self.client.force_login(self.teacher.user)
+        response = self.client.get(reverse('mark_export'), params, secure=True)
+        self.assertTrue(response.streaming)
+        return response, b''.join(response.streaming_content)
+
+    def test_csv_holds_the_teachers_filtered_marks(self):
+        response, content = self.export(term='Term 1')
+        self.assertEqual(response['Content-Type'], 'text/csv')
+        rows = list(csv.reader(io.StringIO(content.decode())))
+        self.assertEqual(tuple(rows[0]), EXPORT_COLUMNS)
+        self.assertEqual(rows[1:], [[
+            'S1', 'MAT', '70.00', '70.00', '70.00', 'Term 1', '2026', 'Good, steady work',
+            'Amina Njeri', 'Form 1', 'A', 'Mathematics', '70.00', 'B',
+        ]])
+
+    def test_exported_csv_imports_again(self):
+        _, content = self.export()
+        Mark.objects.filter(student=self.student).update(main_exam_score=Decimal(0))
+        importer = MarkImporter(term='Term 1', academic_year='2026').run(iter_csv_rows(io.BytesIO(content)))
+        self.assertEqual((importer.imported, importer.errors), (2, []))
+        self.assertEqual(
+            sorted(Mark.objects.filter(student=self.student).values_list('main_exam_score', flat=True)),
+            [Decimal('70.00'), Decimal('80.00')],
+        )
+
+    def test_xlsx_matches_the_csv(self):
+        response, content = self.export(format='xlsx')
+        self.assertEqual(response['Content-Type'], CONTENT_TYPES['xlsx'])
+        sheet = openpyxl.load_workbook(io.BytesIO(content)).active
+        rows = list(sheet.iter_rows(values_only=True))
+        self.assertEqual(rows[0], EXPORT_COLUMNS)
+        self.assertEqual([row[:2] + row[5:7] for row in rows[1:]], [
+            ('S1', 'MAT', 'Term 1', '2026'), ('S1', 'MAT', 'Term 2', '2026'),
+        ])
+
+        response = self.client.get(reverse('mark_export'), {'format': 'pdf'}, secure=True)
+        self.assertEqual(response.status_code, 400)
+
+    def test_csv_is_sent_in_pieces_as_rows_arrive(self):
+        pieces = stream_export(Mark.objects.all())
+        with self.assertNumQueries(0):
+            self.assertEqual(next(pieces).decode(), ','.join(EXPORT_COLUMNS) + '\r\n')
+        with mock.patch('marks.exporters.BUFFER_SIZE', 1):
+            rest = list(pieces)
+        # One piece per row, then what is left in the buffer
+        self.assertEqual(len(rest), 4)
+        self.assertTrue(rest[0].startswith(b'S1,MAT,70.00'))
@@ -0,0 +1,191 @@
+# marks/trends.py
+from decimal import Decimal, ROUND_HALF_UP
+from django.db import transaction
+from django.db.models import Avg, Count, Q
+from django.utils import timezone
+from .grading import DEFAULT_BOUNDARIES, FAIL_GRADE, TWO_PLACES
+from .models import AcademicTerm, Mark, Subject, PerformanceTrend, GradingScheme
+from .terms import parse_term_ordinal
+
+GRADE_LETTERS = [grade for grade, _ in DEFAULT_BOUNDARIES] + [FAIL_GRADE]
+
+# Columns rewritten when a trend for the same student/term/year already exists
+TREND_UPDATE_FIELDS = [
+    'current_term_average', 'previous_term_average', 'trend', 'trend_direction',
+    'score_change', 'percentage_change',
+    'strongest_subject', 'strongest_subject_score', 'weakest_subject', 'weakest_subject_score',
+    'most_improved_subject', 'improvement_amount',
+    'subjects_passed', 'total_subjects', 'pass_rate',
+    'grade_a_count', 'grade_b_count', 'grade_c_count',
+    'grade_d_count', 'grade_e_count', 'grade_f_count',
+    'analysis_summary', 'recommendations', 'action_items',
+    'generated_by', 'last_updated', 'academic_term',
+]
+
+
+def term_sequence():
+    """AcademicTerms that have marks, oldest first"""
+    return list(AcademicTerm.with_marks())
+
+
+def _term_marks(academic_term, student_ids=None):
+    marks = Mark.objects.filter(academic_term=academic_term)
+    if student_ids is not None:
+        marks = marks.filter(student_id__in=student_ids)
+    return marks
+
+
+def term_statistics_queryset(academic_term, student_ids=None):
+    """
+    Per-student average, subject/pass counts and grade distribution for a term.
+
+    One grouped query; grade counts are conditional aggregates.
+    """
+    grade_counts = {
+        f'grade_{grade.lower()}_count': Count('id', filter=Q(grade=grade))
+        for grade in GRADE_LETTERS
+    }
+    return (
+        _term_marks(academic_term, student_ids)
+        .values('student_id')
+        .annotate(
+            average=Avg('total_score'),
+            total_subjects=Count('id'),
+            subjects_passed=Count('id', filter=~Q(grade=FAIL_GRADE)),
+            **grade_counts,
+        )
+        .order_by()
+    )
+
+
+def term_statistics(academic_term, student_ids=None):
+    """term_statistics_queryset() rows keyed by student id"""
+    return {row.pop('student_id'): row for row in term_statistics_queryset(academic_term, student_ids)}
+
+
+def subject_scores(academic_term, student_ids=None):
+    """{student_id: {subject_id: total_score}} for a term in one query"""
+    scores = {}
+    rows = _term_marks(academic_term, student_ids).values_list(
+        'student_id', 'subject_id', 'total_score'
+    )
+    for student_id, subject_id, total_score in rows:
+        scores.setdefault(student_id, {})[subject_id] = total_score
+    return scores
+
+
+def _build_trend(trend, stats, scores, previous_stats, previous_scores):
+    trend.current_term_average = Decimal(str(stats['average'])).quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+    trend.total_subjects = stats['total_subjects']
+    trend.subjects_passed = stats['subjects_passed']
+    trend.calculate_pass_rate()
+    for grade in GRADE_LETTERS:
+        field = f'grade_{grade.lower()}_count'
+        setattr(trend, field, stats[field])
+
+    strongest = max(scores, key=scores.get)
+    weakest = min(scores, key=scores.get)
+    trend.strongest_subject_id, trend.strongest_subject_score = strongest, scores[strongest]
+    trend.weakest_subject_id, trend.weakest_subject_score = weakest, scores[weakest]
+
+    trend.most_improved_subject_id = trend.improvement_amount = None
+    if previous_stats:
+        previous_average = Decimal(str(previous_stats['average'])).quantize(TWO_PLACES, rounding=ROUND_HALF_UP)
+        trend.apply_previous_average(previous_average)
+
+        changes = {
+            subject_id: score - previous_scores[subject_id]
+            for subject_id, score in scores.items()
+            if subject_id in previous_scores
+        }
+        if changes:
+            improved = max(changes, key=changes.get)
+            if changes[improved] > 0:
+                trend.most_improved_subject_id, trend.improvement_amount = improved, changes[improved]
+    else:
+        trend.previous_term_average = trend.score_change = trend.percentage_change = None
+        trend.trend, trend.trend_direction = 'stable', 'neutral'
+
+
+def build_performance_trends(academic_year=None, term=None, include_recommendations=True,
+                             update_existing=True, generated_by=None, student_ids=None, batch_size=500):
+    """
+    Create or refresh PerformanceTrend rows for every student with marks.
+
+    Each term costs two queries (grouped statistics and subject scores) plus
+    one query for its existing trends, whatever the enrolment; consecutive
+    terms are compared in memory and rows are written with bulk_create and
+    bulk_update. `academic_year` and `term` limit which terms get trends;
+    the term before each one is still read for comparison. `student_ids`
+    restricts the run to a chunk of students.
+    Returns (created, updated).
+    """
+    terms = term_sequence()
+    ordinal = parse_term_ordinal(term)
+    targets = [
+        index for index, academic_term in enumerate(terms)
+        if (not academic_year or academic_term.academic_year == academic_year)
+        and (not term or academic_term.ordinal == ordinal)
+    ]
+    subjects = Subject.objects.in_bulk()
+    now = timezone.now()
+
+    # Only the target terms and the term before each are read
+    loaded = {}
+
+    def load(index):
+        if index not in loaded:
+            loaded[index] = (
+                term_statistics(terms[index], student_ids=student_ids),
+                subject_scores(terms[index], student_ids=student_ids),
+            )
+        return loaded[index]
+
+    created = updated = 0
+    for index in targets:
+        academic_term = terms[index]
+        stats, scores = load(index)
+        previous_stats, previous_scores = load(index - 1) if index > 0 else ({}, {})
+        scheme = GradingScheme.for_year(academic_term.academic_year)
+
+        trends = PerformanceTrend.objects.filter(academic_term=academic_term)
+        if student_ids is not None:
+            trends = trends.filter(student_id__in=student_ids)
+        existing = {trend.student_id: trend for trend in trends}
+        to_create, to_update = [], []
+        for student_id, student_stats in stats.items():
+            trend = existing.get(student_id)
+            if trend is None:
+                trend = PerformanceTrend(
+                    student_id=student_id, term=academic_term.term,
+                    academic_year=academic_term.academic_year, academic_term=academic_term,
+                )
+                to_create.append(trend)
+            elif update_existing:
+                to_update.append(trend)
+            else:
+                continue
+
+            _build_trend(
+                trend, student_stats, scores[student_id],
+                previous_stats.get(student_id), previous_scores.get(student_id, {}),
+            )
+            trend.generated_by = generated_by
+            trend.last_updated = now
+            trend.grading_scheme = scheme
+            if include_recommendations:
+                # Subjects come from the in_bulk map instead of one query per FK
+                trend.strongest_subject = subjects.get(trend.strongest_subject_id)
+                trend.weakest_subject = subjects.get(trend.weakest_subject_id)
+                trend.generate_analysis()
+
+        with transaction.atomic():
+            PerformanceTrend.objects.bulk_create(to_create, batch_size=batch_size)
+            PerformanceTrend.objects.bulk_update(to_update, TREND_UPDATE_FIELDS, batch_size=batch_size)
+        created += len(to_create)
+        updated += len(to_update)
+
+        # The previous term is no longer needed once its successor is built
+        loaded.pop(index - 1, None)
+
+    return created, updated
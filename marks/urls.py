@@ -8,18 +8,31 @@ urlpatterns = [
     
     # Marks management
     path('', views.mark_list, name='mark_list'),
+    path('feed/', views.mark_list_feed, name='mark_list_feed'),
+    path('export/', views.mark_export, name='mark_export'),
     path('create/', views.mark_create, name='mark_create'),
     path('<int:pk>/update/', views.mark_update, name='mark_update'),
+    path('sheet/', views.mark_sheet, name='mark_sheet'),
+    path('sheet/save/', views.mark_sheet_save, name='mark_sheet_save'),
     
     # Student results
     path('results/', views.student_results, name='student_results'),
+    path('results/data/', views.student_results_data, name='student_results_data'),
     
     # Reports
     path('reports/create/', views.student_report_create, name='report_create'),
+    path('reports/cards/', views.report_cards, name='report_cards'),
+    path('reports/<int:report_id>/card/', views.report_card_download, name='report_card_download'),
 
      # Analytics and trends
     path('analytics/student-performance/', views.student_performance_analytics, name='student_performance_analytics'),
+    path('analytics/at-a-glance/', views.analytics_at_a_glance, name='analytics_at_a_glance'),
+    path('analytics/subjects/', views.subject_statistics_view, name='subject_statistics'),
+    path('analytics/subjects/data/', views.subject_statistics_data, name='subject_statistics_data'),
     path('analytics/student/<int:student_id>/', views.student_performance_detail, name='student_performance_detail'),
+    path('analytics/student/<int:student_id>/data/', views.student_performance_detail_data, name='student_performance_detail_data'),
     path('analytics/term-comparison/', views.term_comparison_analytics, name='term_comparison_analytics'),
     path('analytics/generate-trends/', views.generate_performance_trends, name='generate_performance_trends'),
+    path('analytics/at-risk/', views.at_risk_students, name='at_risk_students'),
+    path('analytics/jobs/<int:job_id>/', views.analytics_job_status, name='analytics_job_status'),
 ]
\ No newline at end of file
@@ -1,13 +1,34 @@
 from django.shortcuts import render, redirect, get_object_or_404
+from django.urls import reverse
 from django.contrib.auth.decorators import login_required, user_passes_test
 from django.contrib import messages  # Change from school_messages to messages
-from django.db.models import Avg, Sum
-from .models import Mark, Subject, StudentReport
-from .forms import MarkForm, MarkUpdateForm, SubjectForm, StudentReportForm
+from django.core.files.storage import default_storage
+from django.db.models import Avg, Sum, Count, Value
+from django.db.models.functions import Concat
+from .models import AcademicTerm, Mark, Subject, StudentReport, StudentTermSummary, AnalyticsJob, RiskFlag
+from .forms import (
+    MarkForm, MarkUpdateForm, SubjectForm, StudentReportForm, MarkSheetForm, MarkSheetRowForm, MarkFilterForm,
+    ReportCardForm,
+)
 from students.models import Student
 from teachers.models import Teacher
-from django.http import JsonResponse
+from django.http import HttpResponse, JsonResponse, StreamingHttpResponse
+from django.views.decorators.http import require_POST
+import json
 from .analytics import StudentPerformanceAnalyzer
+from .bulk import upsert_marks
+from .cache import cached
+from .comparison import compare_terms
+from .conditional import results_condition
+from .exporters import CONTENT_TYPES, stream_export
+from .jobs import enqueue_job, recover_stale_jobs
+from .leaderboard import at_a_glance, leaderboard
+from .pagination import keyset_page, InvalidCursor
+from .reports import SCORE_FIELDS
+from .report_cards import (
+    card_filename, merged_report_cards, render_report_cards, report_card_data, stream_report_cards_zip,
+)
+from .stats import subject_statistics
 
 def is_admin(user):
     return user.is_authenticated and user.is_admin()
@@ -34,8 +55,22 @@ def subject_create(request):
         form = SubjectForm()
     return render(request, 'marks/subject_form.html', {'form': form, 'title': 'Add Subject'})
 
-@login_required
-def mark_list(request):
+# Columns the mark list shows; everything else is left out of the query
+MARK_LIST_FIELDS = (
+    'id', 'cat1_score', 'cat2_score', 'main_exam_score', 'total_score', 'grade', 'term', 'academic_year',
+    'student__id', 'student__user__first_name', 'student__user__last_name',
+    'subject__id', 'subject__name',
+    'teacher__id', 'teacher__user__id', 'teacher__user__first_name', 'teacher__user__last_name',
+)
+
+# Keyset order of the mark list, newest first; id breaks ties
+MARK_LIST_ORDER = ('academic_year', 'term', 'id')
+
+MARK_LIST_PAGE_SIZE = 50
+
+
+def _visible_marks(request):
+    """(filter form, marks visible to the user narrowed by the filters in the query string)"""
     if request.user.is_admin():
         marks = Mark.objects.all()
     elif request.user.is_teacher():
@@ -49,7 +84,100 @@ def mark_list(request):
     else:
         marks = Mark.objects.none()
     
-    return render(request, 'marks/mark_list.html', {'marks': marks})
+    form = MarkFilterForm(request.GET or None)
+    if form.is_valid():
+        marks = form.filter(marks)
+    return form, marks
+
+
+def _mark_list_page(request):
+    """
+    Filtered page of marks visible to the user, after the ?cursor= row.
+    
+    Returns (form, marks, next_cursor); raises InvalidCursor for a bad cursor.
+    """
+    form, marks = _visible_marks(request)
+    marks = marks.select_related('student__user', 'subject', 'teacher__user').only(*MARK_LIST_FIELDS)
+    page, next_cursor = keyset_page(marks, MARK_LIST_ORDER, request.GET.get('cursor'), MARK_LIST_PAGE_SIZE)
+    return form, page, next_cursor
+
+
+def _next_page_url(request, view_name, next_cursor):
+    if not next_cursor:
+        return None
+    params = request.GET.copy()
+    params['cursor'] = next_cursor
+    return f"{reverse(view_name)}?{params.urlencode()}"
+
+
+@login_required
+def mark_list(request):
+    try:
+        form, marks, next_cursor = _mark_list_page(request)
+    except InvalidCursor:
+        return redirect('mark_list')
+    
+    return render(request, 'marks/mark_list.html', {
+        'marks': marks,
+        'filter_form': form,
+        'next_page_url': _next_page_url(request, 'mark_list', next_cursor),
+        'next_feed_url': _next_page_url(request, 'mark_list_feed', next_cursor),
+    })
+
+
+@login_required
+def mark_list_feed(request):
+    """JSON pages of the mark list for infinite scroll"""
+    try:
+        form, marks, next_cursor = _mark_list_page(request)
+    except InvalidCursor:
+        return JsonResponse({'success': False, 'error': 'Invalid cursor.'}, status=400)
+    
+    rows = []
+    for mark in marks:
+        can_edit = request.user.is_admin() or (mark.teacher and mark.teacher.user_id == request.user.pk)
+        rows.append({
+            'id': mark.pk,
+            'student': mark.student.user.get_full_name(),
+            'subject': mark.subject.name,
+            'cat1_score': mark.cat1_score,
+            'cat2_score': mark.cat2_score,
+            'main_exam_score': mark.main_exam_score,
+            'total_score': mark.total_score,
+            'grade': mark.grade,
+            'term': mark.term,
+            'academic_year': mark.academic_year,
+            'teacher': mark.teacher.user.get_full_name() if mark.teacher else '',
+            'edit_url': reverse('mark_update', args=[mark.pk]) if can_edit else None,
+        })
+    
+    return JsonResponse({
+        'success': True,
+        'marks': rows,
+        'next': _next_page_url(request, 'mark_list_feed', next_cursor),
+    })
+
+
+@login_required
+def mark_export(request):
+    """
+    Stream the marks the mark list would show, with its filters, as a CSV
+    (default) or ?format=xlsx file.
+    """
+    if not (request.user.is_admin() or request.user.is_teacher()):
+        return redirect('dashboard')
+    
+    export_format = request.GET.get('format', 'csv')
+    if export_format not in CONTENT_TYPES:
+        return HttpResponse('Unknown export format.', status=400)
+    
+    form, marks = _visible_marks(request)
+    if form.is_bound and not form.is_valid():
+        return HttpResponse('Invalid filters.', status=400)
+    
+    response = StreamingHttpResponse(stream_export(marks, export_format), content_type=CONTENT_TYPES[export_format])
+    response['Content-Disposition'] = f'attachment; filename="marks.{export_format}"'
+    return response
 
 @login_required
 @user_passes_test(is_teacher)
@@ -73,6 +201,134 @@ def mark_create(request):
     
     return render(request, 'marks/mark_form.html', {'form': form, 'title': 'Add Marks'})
 
+@login_required
+@user_passes_test(is_teacher)
+def mark_sheet(request):
+    """Enter marks for a whole class, subject and term on one screen"""
+    try:
+        teacher = Teacher.objects.get(user=request.user)
+    except Teacher.DoesNotExist:
+        messages.error(request, 'Teacher profile not found.')
+        return redirect('dashboard')
+    
+    form = MarkSheetForm(request.GET or None)
+    rows = []
+    
+    if form.is_valid():
+        if form.cleaned_data['grade'] not in teacher.get_classes_list():
+            messages.error(request, 'You do not teach this class.')
+        else:
+            # Existing marks for the sheet, fetched in one query
+            existing = {
+                mark.student_id: mark
+                for mark in Mark.objects.filter(
+                    student__in=form.get_students(),
+                    subject=form.cleaned_data['subject'],
+                    term=form.cleaned_data['term'],
+                    academic_year=form.cleaned_data['academic_year'],
+                )
+            }
+            for student in form.get_students().select_related('user'):
+                rows.append({'student': student, 'mark': existing.get(student.id)})
+    
+    return render(request, 'marks/mark_sheet.html', {
+        'form': form,
+        'rows': rows,
+        'title': 'Mark Sheet',
+    })
+
+@login_required
+@user_passes_test(is_teacher)
+@require_POST
+def mark_sheet_save(request):
+    """
+    Save a whole mark sheet submitted as JSON.
+    
+    Expects {"grade", "section", "subject", "term", "academic_year",
+    "rows": [{"student_id", "cat1_score", "cat2_score", "main_exam_score", "comments"}]}.
+    Every row is validated before anything is written; the sheet is then
+    graded and upserted in one transaction.
+    """
+    try:
+        teacher = Teacher.objects.get(user=request.user)
+    except Teacher.DoesNotExist:
+        return JsonResponse({'success': False, 'error': 'Teacher profile not found.'}, status=403)
+    
+    try:
+        data = json.loads(request.body)
+    except (ValueError, TypeError):
+        return JsonResponse({'success': False, 'error': 'Invalid JSON payload.'}, status=400)
+    
+    form = MarkSheetForm(data)
+    if not form.is_valid():
+        return JsonResponse({'success': False, 'errors': form.errors}, status=400)
+    
+    if form.cleaned_data['grade'] not in teacher.get_classes_list():
+        return JsonResponse({'success': False, 'error': 'You do not teach this class.'}, status=403)
+    
+    rows = data.get('rows')
+    if not isinstance(rows, list) or not rows:
+        return JsonResponse({'success': False, 'error': 'No rows submitted.'}, status=400)
+    
+    student_ids = set(form.get_students().values_list('id', flat=True))
+    subject = form.cleaned_data['subject']
+    term = form.cleaned_data['term']
+    academic_year = form.cleaned_data['academic_year']
+    
+    # Marks already entered keep their teacher, who alone may change them (as in mark_update)
+    owners = dict(
+        Mark.objects.filter(student_id__in=student_ids, subject=subject, term=term, academic_year=academic_year)
+        .values_list('student_id', 'teacher__user_id')
+    )
+    
+    # Validate every row in one pass before writing anything
+    marks = []
+    errors = {}
+    seen = set()
+    for index, row in enumerate(rows):
+        row_form = MarkSheetRowForm(row if isinstance(row, dict) else {})
+        if not row_form.is_valid():
+            errors[index] = row_form.errors
+            continue
+        
+        student_id = row_form.cleaned_data['student_id']
+        if student_id not in student_ids:
+            errors[index] = {'student_id': ['Student is not in this class.']}
+            continue
+        if student_id in seen:
+            errors[index] = {'student_id': ['Student appears more than once.']}
+            continue
+        seen.add(student_id)
+        if student_id in owners and owners[student_id] != request.user.pk and not request.user.is_admin():
+            errors[index] = {'student_id': ['Marks for this student were entered by another teacher.']}
+            continue
+        
+        marks.append(Mark(
+            student_id=student_id,
+            subject=subject,
+            teacher=teacher,
+            cat1_score=row_form.cleaned_data['cat1_score'],
+            cat2_score=row_form.cleaned_data['cat2_score'],
+            main_exam_score=row_form.cleaned_data['main_exam_score'],
+            comments=row_form.cleaned_data['comments'],
+            term=term,
+            academic_year=academic_year,
+        ))
+    
+    if errors:
+        return JsonResponse({'success': False, 'row_errors': errors}, status=400)
+    
+    saved = upsert_marks(marks)
+    
+    return JsonResponse({
+        'success': True,
+        'saved': saved,
+        'rows': [
+            {'student_id': mark.student_id, 'total_score': str(mark.total_score), 'grade': mark.grade}
+            for mark in marks
+        ],
+    })
+
 @login_required
 @user_passes_test(is_teacher)
 def mark_update(request, pk):
@@ -94,34 +350,40 @@ def mark_update(request, pk):
     
     return render(request, 'marks/mark_form.html', {'form': form, 'title': 'Update Marks'})
 
+def _own_student_id(request):
+    """The signed-in student's id, or None for anyone else"""
+    if not request.user.is_student():
+        return None
+    student = request.user.get_student_profile()
+    return student.pk if student else None
+
+def _student_results(student):
+    """Marks, overall statistics and reports of a student"""
+    # Calculate statistics from the per-term summaries
+    summaries = list(StudentTermSummary.objects.filter(student=student))
+    total_subjects = sum(summary.subject_count for summary in summaries)
+    passed_subjects = sum(summary.pass_count for summary in summaries)
+    if total_subjects:
+        average_score = sum(summary.average_score * summary.subject_count for summary in summaries) / total_subjects
+    else:
+        average_score = 0
+    
+    return {
+        'student': student,
+        'marks': Mark.objects.filter(student=student).select_related('subject'),
+        'average_score': average_score,
+        'total_subjects': total_subjects,
+        'passed_subjects': passed_subjects,
+        'reports': StudentReport.objects.filter(student=student),
+    }
+
 @login_required
+@results_condition(_own_student_id, page=True)
 def student_results(request):
     if request.user.is_student():
         try:
             student = Student.objects.get(user=request.user)
-            marks = Mark.objects.filter(student=student)
-            
-            # Calculate statistics
-            if marks.exists():
-                average_score = marks.aggregate(Avg('total_score'))['total_score__avg']
-                total_subjects = marks.count()
-                passed_subjects = marks.filter(grade__in=['A', 'B', 'C', 'D', 'E']).count()
-            else:
-                average_score = 0
-                total_subjects = 0
-                passed_subjects = 0
-            
-            # Get reports
-            reports = StudentReport.objects.filter(student=student)
-            
-            return render(request, 'marks/student_results.html', {
-                'student': student,
-                'marks': marks,
-                'average_score': average_score,
-                'total_subjects': total_subjects,
-                'passed_subjects': passed_subjects,
-                'reports': reports,
-            })
+            return render(request, 'marks/student_results.html', _student_results(student))
         except Student.DoesNotExist:
             messages.error(request, 'Student profile not found.')
             return redirect('dashboard')
@@ -129,6 +391,57 @@ def student_results(request):
         messages.error(request, 'Access denied.')
         return redirect('dashboard')
 
+@login_required
+@results_condition(_own_student_id)
+def student_results_data(request):
+    """The signed-in student's results as JSON"""
+    student_id = _own_student_id(request)
+    if student_id is None:
+        return JsonResponse({'error': 'Access denied.'}, status=403)
+    
+    results = _student_results(Student.objects.select_related('user').get(pk=student_id))
+    student = results['student']
+    return JsonResponse({
+        'student': {
+            'id': student.pk,
+            'name': student.user.get_full_name(),
+            'admission_number': student.admission_number,
+            'grade': student.grade,
+            'section': student.section,
+        },
+        'average_score': round(float(results['average_score']), 2),
+        'total_subjects': results['total_subjects'],
+        'passed_subjects': results['passed_subjects'],
+        'marks': [
+            {
+                'subject': mark.subject.name,
+                'cat1_score': mark.cat1_score,
+                'cat2_score': mark.cat2_score,
+                'main_exam_score': mark.main_exam_score,
+                'total_score': mark.total_score,
+                'grade': mark.grade,
+                'term': mark.term,
+                'academic_year': mark.academic_year,
+            }
+            for mark in results['marks']
+        ],
+        'reports': [
+            {
+                'term': report.term,
+                'academic_year': report.academic_year,
+                'average_score': report.average_score,
+                'overall_grade': report.overall_grade,
+                'class_position': report.class_position,
+                'total_students': report.total_students,
+                'days_present': report.days_present,
+                'total_days': report.total_days,
+                'teacher_comment': report.teacher_comment,
+                'principal_comment': report.principal_comment,
+            }
+            for report in results['reports']
+        ],
+    })
+
 @login_required
 @user_passes_test(is_admin)
 def student_report_create(request):
@@ -143,6 +456,84 @@ def student_report_create(request):
     
     return render(request, 'marks/report_form.html', {'form': form, 'title': 'Create Student Report'})
 
+@login_required
+def report_cards(request):
+    """Print report cards for a class and term as one PDF or a ZIP of PDFs"""
+    if not (request.user.is_admin() or request.user.is_teacher()):
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+    
+    form = ReportCardForm(request.GET or None)
+    if not form.is_valid():
+        return render(request, 'marks/report_cards.html', {'form': form, 'title': 'Report Cards'})
+    
+    data = form.cleaned_data
+    if request.user.is_teacher() and not request.user.is_admin():
+        teacher = Teacher.objects.filter(user=request.user).first()
+        if not teacher or data['grade'] not in teacher.get_classes_list():
+            messages.error(request, 'You do not teach this class.')
+            return render(request, 'marks/report_cards.html', {'form': form, 'title': 'Report Cards'})
+    
+    cards = report_card_data(data['term'], data['academic_year'], data['grade'], data['section'] or None)
+    if not cards:
+        messages.warning(request, 'No reports have been generated for this class and term yet.')
+        return render(request, 'marks/report_cards.html', {'form': form, 'title': 'Report Cards'})
+    
+    name = f"report_cards_{data['grade']}{data['section']}_{data['term']}_{data['academic_year']}".replace(' ', '_')
+    if data['output'] == 'zip':
+        response = StreamingHttpResponse(
+            stream_report_cards_zip(render_report_cards(cards)), content_type='application/zip'
+        )
+        response['Content-Disposition'] = f'attachment; filename="{name}.zip"'
+        return response
+    
+    response = HttpResponse(merged_report_cards(cards), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="{name}.pdf"'
+    return response
+
+@login_required
+def report_card_download(request, report_id):
+    """One student's report card PDF; a report the user may not see is a 404"""
+    reports = StudentReport.objects.select_related('student')
+    if request.user.is_admin():
+        pass
+    elif request.user.is_teacher():
+        # Only the classes they teach, as in report_cards
+        teacher = Teacher.objects.filter(user=request.user).first()
+        reports = reports.filter(student__grade__in=teacher.get_classes_list() if teacher else [])
+    elif request.user.is_student():
+        reports = reports.filter(student__user=request.user)
+    else:
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+    report = get_object_or_404(reports, pk=report_id)
+    
+    cards = report_card_data(report.term, report.academic_year, student_ids=[report.student_id])
+    [(card, path)] = render_report_cards(cards)
+    with default_storage.open(path, 'rb') as stored:
+        response = HttpResponse(stored.read(), content_type='application/pdf')
+    response['Content-Disposition'] = f'inline; filename="{card_filename(card)}"'
+    return response
+
+def _analytics_overview():
+    """Latest term, the last five terms' statistics and the mark count, for the analytics dashboard"""
+    term_stats = [
+        {
+            'term': row['term'],
+            'year': row['academic_year'],
+            'average_score': row['average_score'],
+            'total_marks': row['total_marks']
+        }
+        for row in Mark.objects.values('term', 'academic_year')
+        .annotate(average_score=Avg('total_score'), total_marks=Count('id'))
+        .order_by('-academic_term__index')[:5]
+    ]
+    return {
+        'latest_term': AcademicTerm.with_marks().last(),
+        'term_stats': term_stats,
+        'total_marks': Mark.objects.count(),
+    }
+
 @login_required
 def student_performance_analytics(request):
     """Main analytics dashboard"""
@@ -150,59 +541,115 @@ def student_performance_analytics(request):
         messages.error(request, 'Access denied.')
         return redirect('dashboard')
     
-    students = Student.objects.all()
-    analyzer = StudentPerformanceAnalyzer()
-    
-    # Get top performers
-    top_performers = []
-    for student in students[:10]:  # Limit to 10 for performance
-        marks = Mark.objects.filter(student=student)
-        if marks.exists():
-            avg = marks.aggregate(Avg('total_score'))['total_score__avg']
-            top_performers.append({
-                'student': student,
-                'average_score': avg,
-                'total_subjects': marks.count()
-            })
-    
-    # Sort by average score
-    top_performers.sort(key=lambda x: x['average_score'] or 0, reverse=True)
-    
-    # Get term-wise statistics
-    term_stats = []
-    terms = Mark.objects.values('term', 'academic_year').distinct().order_by('-academic_year', 'term')
-    
-    for term in terms[:5]:  # Last 5 terms
-        term_marks = Mark.objects.filter(
-            term=term['term'],
-            academic_year=term['academic_year']
-        )
-        if term_marks.exists():
-            avg = term_marks.aggregate(Avg('total_score'))['total_score__avg']
-            term_stats.append({
-                'term': term['term'],
-                'year': term['academic_year'],
-                'average_score': avg,
-                'total_marks': term_marks.count()
-            })
+    overview = cached('analytics_dashboard', None, (), _analytics_overview)
+    latest_term = overview['latest_term']
+    
+    # Rank everyone on the latest term with marks; cached until its marks change
+    board = {'top': [], 'bottom': [], 'size': 0}
+    if latest_term:
+        board = leaderboard(5, term=latest_term.term, academic_year=latest_term.academic_year)
     
     return render(request, 'marks/analytics_dashboard.html', {
-        'top_performers': top_performers[:5],
-        'term_stats': term_stats,
-        'total_students': students.count(),
-        'total_marks': Mark.objects.count()
+        'latest_term': latest_term,
+        'top_performers': board['top'],
+        'bottom_performers': board['bottom'],
+        'term_stats': overview['term_stats'],
+        'total_students': Student.objects.count(),
+        'total_marks': overview['total_marks']
+    })
+
+def _requested_term(request):
+    """(term, academic_year) from the query string, else the latest term with marks; (None, None) without marks"""
+    term = request.GET.get('term')
+    academic_year = request.GET.get('academic_year')
+    if not (term and academic_year):
+        latest_term = AcademicTerm.with_marks().last()
+        if latest_term is None:
+            return None, None
+        term, academic_year = latest_term.term, latest_term.academic_year
+    return term, academic_year
+
+@login_required
+def analytics_at_a_glance(request):
+    """School, grade and subject leaderboards for a term as JSON (defaults to the latest term)"""
+    if not (request.user.is_admin() or request.user.is_teacher()):
+        return JsonResponse({'error': 'Access denied.'}, status=403)
+
+    term, academic_year = _requested_term(request)
+    if not term:
+        return JsonResponse({'error': 'No marks have been entered yet.'}, status=404)
+
+    try:
+        limit = min(max(int(request.GET.get('limit', 5)), 1), 50)
+    except ValueError:
+        return JsonResponse({'error': 'limit must be a number.'}, status=400)
+
+    score = request.GET.get('score', 'raw')
+    if score not in SCORE_FIELDS:
+        return JsonResponse({'error': f"score must be one of {', '.join(SCORE_FIELDS)}."}, status=400)
+
+    return JsonResponse(at_a_glance(term, academic_year, limit, score))
+
+@login_required
+def subject_statistics_view(request):
+    """Mean, spread, quartiles and score histograms per subject and class for a term"""
+    if not (request.user.is_admin() or request.user.is_teacher()):
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+    
+    term, academic_year = _requested_term(request)
+    grade = request.GET.get('grade') or None
+    section = request.GET.get('section') or None
+    statistics = subject_statistics(term, academic_year, grade, section) if term else None
+    
+    terms = AcademicTerm.with_marks()
+    return render(request, 'marks/subject_statistics.html', {
+        'term_labels': sorted({academic_term.term for academic_term in terms}),
+        'academic_years': sorted({academic_term.academic_year for academic_term in terms}, reverse=True),
+        'statistics': statistics,
+        'selected_term': term or '',
+        'selected_year': academic_year or '',
+        'grade': grade or '',
+        'section': section or '',
     })
 
 @login_required
+def subject_statistics_data(request):
+    """subject_statistics() for a term as JSON (defaults to the latest term)"""
+    if not (request.user.is_admin() or request.user.is_teacher()):
+        return JsonResponse({'error': 'Access denied.'}, status=403)
+    
+    term, academic_year = _requested_term(request)
+    if not term:
+        return JsonResponse({'error': 'No marks have been entered yet.'}, status=404)
+    
+    return JsonResponse(subject_statistics(
+        term, academic_year, request.GET.get('grade') or None, request.GET.get('section') or None,
+    ))
+
+def _can_view_student(request, student_id):
+    """student_id if the user may see that student's analysis, else None"""
+    if request.user.is_admin() or request.user.is_teacher() or _own_student_id(request) == student_id:
+        return student_id
+    return None
+
+def _student_analysis(student_id):
+    # Cached until one of the student's marks is written
+    return cached(
+        'student_analysis', [], (student_id,),
+        lambda: StudentPerformanceAnalyzer(student_id).generate_trend_analysis(student_id),
+        students=[student_id],
+    )
+
+@login_required
+@results_condition(_can_view_student, page=True)
 def student_performance_detail(request, student_id):
     """Detailed performance analysis for a specific student"""
-    if not (request.user.is_admin() or request.user.is_teacher() or 
-           (request.user.is_student() and str(request.user.student.id) == str(student_id))):
+    if _can_view_student(request, student_id) is None:
         messages.error(request, 'Access denied.')
         return redirect('dashboard')
     
-    analyzer = StudentPerformanceAnalyzer(student_id)
-    analysis = analyzer.generate_trend_analysis(student_id)
+    analysis = _student_analysis(student_id)
     
     if not analysis:
         messages.warning(request, 'Insufficient data for performance analysis.')
@@ -214,6 +661,29 @@ def student_performance_detail(request, student_id):
         'has_comparisons': len(analysis['comparisons']) > 0
     })
 
+@login_required
+@results_condition(_can_view_student)
+def student_performance_detail_data(request, student_id):
+    """student_performance_detail() as JSON"""
+    if _can_view_student(request, student_id) is None:
+        return JsonResponse({'error': 'Access denied.'}, status=403)
+    
+    analysis = _student_analysis(student_id)
+    if not analysis:
+        return JsonResponse({'error': 'Insufficient data for performance analysis.'}, status=404)
+    
+    student = analysis['student']
+    return JsonResponse({
+        **analysis,
+        'student': {
+            'id': student.pk,
+            'name': student.user.get_full_name(),
+            'admission_number': student.admission_number,
+            'grade': student.grade,
+            'section': student.section,
+        },
+    })
+
 @login_required
 def term_comparison_analytics(request):
     """Compare performance across terms"""
@@ -221,7 +691,7 @@ def term_comparison_analytics(request):
         messages.error(request, 'Access denied.')
         return redirect('dashboard')
     
-    terms = Mark.objects.values('term', 'academic_year').distinct().order_by('-academic_year', 'term')
+    terms = AcademicTerm.with_marks().reverse()
     selected_term1 = request.GET.get('term1')
     selected_term2 = request.GET.get('term2')
     
@@ -235,24 +705,16 @@ def term_comparison_analytics(request):
             term1, year1 = term1_parts
             term2, year2 = term2_parts
             
-            # Get marks for both terms
-            marks_term1 = Mark.objects.filter(term=term1, academic_year=year1)
-            marks_term2 = Mark.objects.filter(term=term2, academic_year=year2)
-            
-            if marks_term1.exists() and marks_term2.exists():
-                avg1 = marks_term1.aggregate(Avg('total_score'))['total_score__avg']
-                avg2 = marks_term2.aggregate(Avg('total_score'))['total_score__avg']
-                
-                comparison_data = {
-                    'term1': {'term': term1, 'year': year1, 'average': avg1, 'count': marks_term1.count()},
-                    'term2': {'term': term2, 'year': year2, 'average': avg2, 'count': marks_term2.count()},
-                    'difference': avg2 - avg1,
-                    'percentage_change': ((avg2 - avg1) / avg1 * 100) if avg1 > 0 else 0
-                }
+            comparison_data = compare_terms(term1, year1, term2, year2)
     
     return render(request, 'marks/term_comparison.html', {
         'terms': terms,
         'comparison_data': comparison_data,
+        'breakdowns': [
+            ('Subject', comparison_data['subjects']),
+            ('Class', comparison_data['grades']),
+            ('Section', comparison_data['sections']),
+        ] if comparison_data else [],
         'selected_term1': selected_term1,
         'selected_term2': selected_term2
     })
@@ -264,65 +726,24 @@ def generate_performance_trends(request):
     from .models import PerformanceTrend  # Import the model
     
     if request.method == 'POST':
-        analyzer = StudentPerformanceAnalyzer()
-        students = Student.objects.all()
-        generated_count = 0
-        
-        # Get filters from form
-        academic_year = request.POST.get('academic_year')
-        term = request.POST.get('term')
+        job = AnalyticsJob.objects.create(
+            kind='performance_trends',
+            created_by=request.user,
+            parameters={
+                'academic_year': request.POST.get('academic_year', ''),
+                'term': request.POST.get('term', ''),
+                'include_recommendations': bool(request.POST.get('include_recommendations')),
+                'update_existing': bool(request.POST.get('update_existing')),
+            },
+        )
+        enqueue_job(job)
         
-        for student in students:
-            # Apply filters if specified - call with correct number of arguments
-            analysis = analyzer.generate_trend_analysis(student.id)
-            
-            # Apply filters manually after getting analysis
-            if analysis and analysis['has_multiple_terms']:
-                # Filter by academic year if specified
-                if academic_year:
-                    # Check if student has marks in the specified year
-                    has_marks_in_year = Mark.objects.filter(
-                        student=student, 
-                        academic_year=academic_year
-                    ).exists()
-                    if not has_marks_in_year:
-                        continue
-                
-                # Filter by term if specified
-                if term:
-                    # Check if student has marks in the specified term
-                    has_marks_in_term = Mark.objects.filter(
-                        student=student,
-                        term=term
-                    ).exists()
-                    if not has_marks_in_term:
-                        continue
-                
-                # Save or update trend analysis
-                try:
-                    # Check if trend already exists
-                    trend, created = PerformanceTrend.objects.update_or_create(
-                        student=student,
-                        term=analysis['latest_term'],
-                        academic_year=analysis['latest_year'],
-                        defaults={
-                            'average_score': analysis['average_scores'][-1] if analysis['average_scores'] else 0,
-                            'previous_average': analysis['average_scores'][-2] if len(analysis['average_scores']) > 1 else None,
-                            'trend': analysis['trend'],
-                            'percentage_change': analysis.get('percentage_change', 0),
-                            'strongest_subject': analysis.get('strongest_subject'),
-                            'weakest_subject': analysis.get('weakest_subject'),
-                            'most_improved_subject': analysis.get('most_improved_subject'),
-                            'analysis': analysis.get('analysis_text', ''),
-                            'recommendations': analysis.get('recommendations', '')
-                        }
-                    )
-                    generated_count += 1
-                except Exception as e:
-                    print(f"Error generating trend for {student}: {e}")
+        status_url = reverse('analytics_job_status', args=[job.pk])
+        if request.headers.get('x-requested-with') == 'XMLHttpRequest':
+            return JsonResponse({'success': True, 'job_id': job.pk, 'status_url': status_url}, status=202)
         
-        messages.success(request, f'Generated performance trends for {generated_count} students.')
-        return redirect('student_performance_analytics')
+        messages.info(request, 'Trend generation has started. Progress is shown below.')
+        return redirect(f"{reverse('generate_performance_trends')}?job={job.pk}")
     
     # GET request - show form
     # Get statistics for display
@@ -331,23 +752,57 @@ def generate_performance_trends(request):
     # Count students with marks
     students_with_marks = Student.objects.filter(marks__isnull=False).distinct().count()
     
-    # Count students with multiple terms
-    students_multiple_terms = 0
-    for student in Student.objects.all():
-        term_count = Mark.objects.filter(student=student).values('term', 'academic_year').distinct().count()
-        if term_count > 1:
-            students_multiple_terms += 1
+    # Count students with marks in more than one term
+    students_multiple_terms = (
+        Mark.objects.values('student_id')
+        .annotate(term_count=Count(Concat('term', Value('|'), 'academic_year'), distinct=True))
+        .filter(term_count__gt=1)
+        .count()
+    )
     
     # Count existing trends
     trends_generated = PerformanceTrend.objects.count()
     
     # Get unique academic years
-    academic_years = Mark.objects.values_list('academic_year', flat=True).distinct().order_by('-academic_year')
+    academic_years = AcademicTerm.with_marks().values_list('academic_year', flat=True).distinct().order_by('-academic_year')
+    
+    # A job started from this page, to resume polling after a redirect
+    job = None
+    if request.GET.get('job', '').isdigit():
+        job = AnalyticsJob.objects.filter(pk=request.GET['job'], kind='performance_trends').first()
     
     return render(request, 'marks/generate_trends.html', {
+        'job': job,
         'total_students': total_students,
         'students_with_marks': students_with_marks,
         'students_multiple_terms': students_multiple_terms,
         'trends_generated': trends_generated,
         'academic_years': academic_years,
-    })
\ No newline at end of file
+    })
+
+
+@login_required
+@user_passes_test(lambda u: u.is_admin())
+def analytics_job_status(request, job_id):
+    """Progress of a background analytics job, polled by the UI"""
+    job = get_object_or_404(AnalyticsJob, pk=job_id)
+    if job.status == 'running':
+        # A worker lost to a restart leaves its job running; start it again
+        for stale_id in recover_stale_jobs():
+            enqueue_job(AnalyticsJob(pk=stale_id))
+        job.refresh_from_db()
+    return JsonResponse(job.as_dict())
+
+@login_required
+def at_risk_students(request):
+    """Students with active early-warning flags (a teacher sees their own classes)"""
+    if not (request.user.is_admin() or request.user.is_teacher()):
+        messages.error(request, 'Access denied.')
+        return redirect('dashboard')
+    
+    flags = RiskFlag.objects.filter(is_active=True).select_related('student__user', 'academic_term')
+    if not request.user.is_admin():
+        teacher = Teacher.objects.filter(user=request.user).first()
+        flags = flags.filter(student__grade__in=teacher.get_classes_list() if teacher else [])
+    
+    return render(request, 'marks/at_risk_students.html', {'flags': flags})
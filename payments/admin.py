@@ -1,6 +1,6 @@
 from django.contrib import admin
 from unfold.admin import ModelAdmin
-from .models import FeeStructure, StudentFee, Payment, AdditionalCharge, PaymentReceipt
+from .models import FeeStructure, StudentFee, Payment, AdditionalCharge, PaymentReceipt, FeeLedgerEntry, MpesaCallbackEvent
 
 @admin.register(FeeStructure)
 class FeeStructureAdmin(ModelAdmin):
@@ -36,7 +36,11 @@ class StudentFeeAdmin(ModelAdmin):
     list_display = ('student', 'fee_structure', 'amount_due', 'amount_paid', 'balance', 'is_paid', 'due_date')
     list_filter = ('fee_structure__grade', 'fee_structure__term', 'is_paid', 'due_date')
     search_fields = ('student__user__username', 'student__admission_number', 'student__user__first_name', 'student__user__last_name')
-    readonly_fields = ('amount_due', 'balance', 'is_paid', 'created_at', 'updated_at')
+    # The totals are kept by the fee ledger; charges are added as Additional Charges
+    readonly_fields = (
+        'amount_paid', 'additional_charges', 'penalty_charges', 'paid_date',
+        'amount_due', 'balance', 'is_paid', 'created_at', 'updated_at',
+    )
     fieldsets = (
         ('Student Information', {
             'fields': ('student', 'fee_structure')
@@ -87,11 +91,24 @@ class PaymentAdmin(ModelAdmin):
             'classes': ('collapse',)
         }),
     )
-    
+    actions = ['check_mpesa_status']
+
     def amount_formatted(self, obj):
         return f"Ksh {obj.amount:,.2f}"
     amount_formatted.short_description = 'Amount'
 
+    @admin.action(description='Check status with M-Pesa')
+    def check_mpesa_status(self, request, queryset):
+        from .reconcile import check_payments
+        payments = list(queryset.filter(status='pending', payment_method='mpesa').exclude(transaction_id=''))
+        summary = check_payments(payments)
+        pending = summary['checked'] - summary['completed'] - summary['failed'] - summary['cancelled']
+        self.message_user(
+            request,
+            f"{summary['checked']} pending M-Pesa payment(s) checked: {summary['completed']} completed, "
+            f"{summary['failed']} failed, {summary['cancelled']} cancelled, {pending} still pending.",
+        )
+
 @admin.register(AdditionalCharge)
 class AdditionalChargeAdmin(ModelAdmin):
     list_display = ('student', 'charge_type', 'amount', 'is_paid', 'due_date', 'added_by')
@@ -132,4 +149,39 @@ class PaymentReceiptAdmin(ModelAdmin):
             'fields': ('generated_at',),
             'classes': ('collapse',)
         }),
-    )
\ No newline at end of file
+    )
+
+@admin.register(FeeLedgerEntry)
+class FeeLedgerEntryAdmin(ModelAdmin):
+    """Read-only: the ledger is only written through payments.ledger"""
+    list_display = ('student_fee', 'entry_type', 'amount', 'payment', 'charge', 'created_by', 'created_at')
+    list_filter = ('entry_type', 'created_at')
+    search_fields = ('student_fee__student__admission_number', 'payment__transaction_id', 'description')
+    list_select_related = ('student_fee__student__user', 'student_fee__fee_structure', 'payment', 'charge', 'created_by')
+    
+    def has_add_permission(self, request):
+        return False
+    
+    def has_change_permission(self, request, obj=None):
+        return False
+    
+    def has_delete_permission(self, request, obj=None):
+        return False
+
+@admin.register(MpesaCallbackEvent)
+class MpesaCallbackEventAdmin(ModelAdmin):
+    list_display = ('checkout_request_id', 'status', 'attempts', 'received_at', 'processed_at')
+    list_filter = ('status', 'received_at')
+    search_fields = ('checkout_request_id',)
+    readonly_fields = ('checkout_request_id', 'payload', 'attempts', 'error', 'received_at', 'processed_at')
+    actions = ['retry_events']
+    
+    def has_add_permission(self, request):
+        return False
+    
+    @admin.action(description='Retry selected callbacks')
+    def retry_events(self, request, queryset):
+        from .callbacks import enqueue_processing
+        count = queryset.exclude(status='processed').update(status='pending', attempts=0)
+        enqueue_processing()
+        self.message_user(request, f'{count} callback(s) queued again.')
@@ -6,4 +6,5 @@ class PaymentsConfig(AppConfig):
     
     def ready(self):
         # Import signals when the app is ready
-        import payments.signals
\ No newline at end of file
+        import payments.signals
+        import payments.checks
\ No newline at end of file
@@ -0,0 +1,171 @@
+# payments/callbacks.py
+"""
+Queue of M-Pesa STK push callbacks.
+
+The callback view only stores the raw payload as an MpesaCallbackEvent and
+acknowledges it; the payment, ledger and receipt work happens here, in a
+worker. Workers claim batches of pending events with SELECT ... FOR UPDATE
+SKIP LOCKED, so any number of them can drain the queue side by side without
+taking the same event twice.
+"""
+import logging
+import threading
+from django.conf import settings
+from django.db import connections, transaction
+from django.utils import timezone
+from .models import MpesaCallbackEvent, Payment
+
+logger = logging.getLogger(__name__)
+
+# Events claimed per transaction
+BATCH_SIZE = 100
+
+# Failed attempts before an event is left for a person to look at
+MAX_ATTEMPTS = 5
+
+# Only one draining thread per process when running without a broker
+_drain_lock = threading.Lock()
+_drain_running = False
+_drain_requested = False
+
+
+def store_callback(payload):
+    """
+    Save a callback payload for processing. Returns False for a payload
+    without a CheckoutRequestID; a repeat of a stored callback is ignored.
+    """
+    try:
+        checkout_request_id = payload['Body']['stkCallback']['CheckoutRequestID']
+    except (KeyError, TypeError):
+        return False
+    if not checkout_request_id:
+        return False
+
+    # One INSERT; a retried callback hits the unique constraint and is dropped
+    MpesaCallbackEvent.objects.bulk_create(
+        [MpesaCallbackEvent(checkout_request_id=checkout_request_id, payload=payload)],
+        ignore_conflicts=True,
+    )
+    return True
+
+
+def enqueue_processing():
+    """
+    Have the pending events processed once the current transaction commits:
+    by a Celery worker when CELERY_BROKER_URL is configured, otherwise by a
+    background thread of this process (inline when CELERY_TASK_ALWAYS_EAGER).
+    """
+    def dispatch():
+        if settings.CELERY_TASK_ALWAYS_EAGER:
+            process_callback_events()
+        elif settings.CELERY_BROKER_URL:
+            from .tasks import process_mpesa_callbacks
+            process_mpesa_callbacks.delay()
+        else:
+            _request_drain()
+
+    transaction.on_commit(dispatch)
+
+
+def _request_drain():
+    global _drain_running, _drain_requested
+    with _drain_lock:
+        _drain_requested = True
+        if _drain_running:
+            # The running thread drains again before it stops
+            return
+        _drain_running = True
+    threading.Thread(target=_drain_in_thread, daemon=True).start()
+
+
+def _drain_in_thread():
+    global _drain_running, _drain_requested
+    try:
+        while True:
+            with _drain_lock:
+                if not _drain_requested:
+                    _drain_running = False
+                    return
+                _drain_requested = False
+            process_callback_events()
+    except Exception:
+        logger.exception("Draining M-Pesa callbacks failed")
+        with _drain_lock:
+            _drain_running = False
+    finally:
+        connections.close_all()
+
+
+def apply_callback(payload):
+    """
+    Settle the payment a callback is about. Saving the payment posts it to
+    the fee ledger and receipts it (payments.signals). Returns the payment.
+
+    A successful callback completes the payment even if the reconciler has
+    already expired it, since the money was taken; a failure only settles a
+    payment that is still pending.
+    """
+    callback = payload['Body']['stkCallback']
+    payment = Payment.objects.select_for_update().filter(transaction_id=callback['CheckoutRequestID']).first()
+    if payment is None:
+        # The callback can beat the request that saves the payment; retried later
+        raise LookupError(f"No payment for CheckoutRequestID {callback['CheckoutRequestID']}")
+
+    # Safaricom sends the code as a number; older integrations as a string
+    succeeded = str(callback.get('ResultCode')) == '0'
+    if payment.status == 'completed' or (payment.status != 'pending' and not succeeded):
+        return payment
+
+    if succeeded:
+        items = {
+            item.get('Name'): item.get('Value')
+            for item in callback.get('CallbackMetadata', {}).get('Item', [])
+        }
+        payment.status = 'completed'
+        payment.mpesa_code = str(items.get('MpesaReceiptNumber') or '')
+        payment.receipt_number = payment.mpesa_code
+    else:
+        payment.status = 'failed'
+        payment.description = callback.get('ResultDesc') or payment.description
+    payment.save()
+    return payment
+
+
+def process_callback_events(batch_size=BATCH_SIZE):
+    """
+    Apply pending callback events a batch at a time until none are left.
+
+    Each batch is claimed and applied in one transaction; an event that
+    fails is rolled back on its own and retried by a later run until
+    MAX_ATTEMPTS. Returns the number of events handled.
+    """
+    handled = 0
+    tried = set()
+    while True:
+        with transaction.atomic():
+            events = list(
+                MpesaCallbackEvent.objects.select_for_update(skip_locked=True)
+                .filter(status='pending').exclude(pk__in=tried)
+                .order_by('received_at')[:batch_size]
+            )
+            if not events:
+                return handled
+
+            for event in events:
+                tried.add(event.pk)
+                event.attempts += 1
+                try:
+                    with transaction.atomic():
+                        apply_callback(event.payload)
+                except Exception as exc:
+                    logger.exception("M-Pesa callback %s failed", event.checkout_request_id)
+                    event.error = str(exc)
+                    if event.attempts >= MAX_ATTEMPTS:
+                        event.status = 'failed'
+                else:
+                    event.status = 'processed'
+                    event.error = ''
+                    event.processed_at = timezone.now()
+
+            MpesaCallbackEvent.objects.bulk_update(events, ['status', 'attempts', 'error', 'processed_at'])
+        handled += len(events)
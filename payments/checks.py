@@ -0,0 +1,32 @@
+# payments/checks.py
+"""
+System checks for the payments app.
+
+The M-Pesa clients share their OAuth token and its refresh lock through the
+default cache, which only works across processes on a shared backend.
+"""
+from django.conf import settings
+from django.core.checks import Warning, register
+
+# Backends that keep their entries inside one process
+PROCESS_LOCAL_CACHES = (
+    'django.core.cache.backends.locmem.LocMemCache',
+    'django.core.cache.backends.dummy.DummyCache',
+)
+
+
+@register()
+def check_mpesa_token_cache(app_configs, **kwargs):
+    """Warn when M-Pesa is configured but its token cache is per process"""
+    if not settings.MPESA_CONFIG.get('CONSUMER_KEY'):
+        return []
+    backend = settings.CACHES.get('default', {}).get('BACKEND', '')
+    if backend not in PROCESS_LOCAL_CACHES:
+        return []
+    return [Warning(
+        'M-Pesa is configured but the default cache is process-local, so every '
+        'process and worker fetches and refreshes its own OAuth token.',
+        hint='Set REDIS_URL or CACHE_DIR so the token is shared.',
+        obj=backend,
+        id='payments.W001',
+    )]
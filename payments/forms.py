@@ -25,11 +25,10 @@ class StudentFeeForm(forms.ModelForm):
     
     class Meta:
         model = StudentFee
-        fields = ['student', 'fee_structure', 'additional_charges', 'penalty_charges', 'due_date']
+        # Charges and penalties are added as AdditionalCharges, which post to the ledger
+        fields = ['student', 'fee_structure', 'due_date']
         widgets = {
             'due_date': forms.DateInput(attrs={'type': 'date'}),
-            'additional_charges': forms.NumberInput(attrs={'step': '0.01'}),
-            'penalty_charges': forms.NumberInput(attrs={'step': '0.01'}),
         }
 
 class AdditionalChargeForm(forms.ModelForm):
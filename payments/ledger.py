@@ -0,0 +1,218 @@
+# payments/ledger.py
+"""
+Posting to the fee ledger.
+
+Every change to what a student owes or has paid is an append-only
+FeeLedgerEntry; the totals on StudentFee are kept as running sums of those
+entries. Posting locks the StudentFee row, inserts the entry and moves the
+totals with one UPDATE of F() expressions, so concurrent postings (parallel
+M-Pesa callbacks, say) queue on the lock instead of overwriting each other.
+Postings tied to a payment or charge are idempotent: posting one twice is a
+no-op. A payment is posted while its payment entries outnumber its
+reversals, so one that is reversed and completed again is posted again.
+StudentFee.save() never writes the totals itself; a change of fee
+structure goes through restate_amount_due(). verify_ledger() replays the
+entries to check the totals.
+"""
+from decimal import Decimal
+from django.db import transaction
+from django.db.models import Case, DateField, F, Q, Sum, Value, When
+from django.db.models.lookups import LessThanOrEqual
+from django.utils import timezone
+from .models import FeeLedgerEntry, StudentFee
+
+# StudentFee column each entry type moves, and in which direction
+EFFECTS = {
+    'charge': ('additional_charges', 1),
+    'penalty': ('penalty_charges', 1),
+    'payment': ('amount_paid', 1),
+    'reversal': ('amount_paid', -1),
+}
+
+# Columns that make up amount_due besides the fee structure's total
+DUE_FIELDS = ('additional_charges', 'penalty_charges')
+
+# FeeStructure columns summed by FeeStructure.total_fee
+STRUCTURE_FIELDS = (
+    'tuition_fee', 'boarding_fee', 'activity_fee', 'exam_fee', 'library_fee',
+    'medical_fee', 'sports_fee', 'development_fee', 'other_charges',
+)
+
+ZERO = Decimal('0.00')
+
+
+def _balance_updates(entry_type, amount):
+    """UPDATE expressions applying an entry of `amount` to a StudentFee row"""
+    field, sign = EFFECTS[entry_type]
+    amount = Decimal(amount) * sign
+    # Charges raise the balance, payments lower it
+    balance_change = amount if field in DUE_FIELDS else -amount
+    # Expressions in an UPDATE all see the row as it was, so the new
+    # balance is written out rather than read back
+    settled = Q(balance__lte=-balance_change)
+
+    updates = {
+        field: F(field) + amount,
+        'balance': F('balance') + balance_change,
+        'is_paid': Case(When(settled, then=Value(True)), default=Value(False)),
+        'paid_date': Case(
+            When(settled, paid_date__isnull=True, then=Value(timezone.now().date())),
+            When(settled, then=F('paid_date')),
+            default=Value(None),
+            output_field=DateField(),
+        ),
+        'updated_at': timezone.now(),
+    }
+    if field in DUE_FIELDS:
+        updates['amount_due'] = F('amount_due') + amount
+    return updates
+
+
+def _payment_postings(payment):
+    """How many times `payment` stands posted: its payment entries less its reversals"""
+    return FeeLedgerEntry.objects.filter(payment=payment).aggregate(
+        net=Sum(Case(When(entry_type='payment', then=Value(1)), default=Value(-1)))
+    )['net'] or 0
+
+
+def post_entry(student_fee_id, entry_type, amount, payment=None, charge=None, description='', created_by=None):
+    """
+    Append an entry to a fee's ledger and move the fee's totals.
+
+    One SELECT ... FOR UPDATE of the fee row, one SELECT for whether the
+    payment or charge was posted already, one INSERT and one UPDATE.
+    A payment entry is only added while the payment is not posted, and a
+    reversal only while it is. Returns the new entry, or None when there
+    was nothing to post.
+    """
+    with transaction.atomic():
+        StudentFee.objects.select_for_update().filter(pk=student_fee_id).values_list('pk', flat=True).get()
+        # Earlier postings are looked up only once the lock is held, in a
+        # statement of their own: under READ COMMITTED a statement sees what
+        # was committed when it started, so a check made in the locking
+        # SELECT would miss a posting by the transaction it waited for
+        if payment is not None:
+            if (_payment_postings(payment) > 0) == (entry_type == 'payment'):
+                return None
+        elif charge is not None:
+            if FeeLedgerEntry.objects.filter(student_fee_id=student_fee_id, entry_type=entry_type, charge=charge).exists():
+                return None
+
+        entry = FeeLedgerEntry.objects.create(
+            student_fee_id=student_fee_id,
+            entry_type=entry_type,
+            amount=amount,
+            payment=payment,
+            charge=charge,
+            description=description,
+            created_by=created_by,
+        )
+        StudentFee.objects.filter(pk=student_fee_id).update(**_balance_updates(entry_type, amount))
+    return entry
+
+
+def post_payment(payment, created_by=None):
+    """Post a completed payment to its fee; a no-op if it is already posted"""
+    return post_entry(
+        payment.student_fee_id, 'payment', payment.amount, payment=payment,
+        description=f"{payment.get_payment_method_display()} {payment.receipt_number or payment.transaction_id}".strip(),
+        created_by=created_by or payment.confirmed_by,
+    )
+
+
+def reverse_payment(payment, created_by=None, description=''):
+    """Undo a posted payment; a no-op if it was never posted or is reversed already"""
+    return post_entry(
+        payment.student_fee_id, 'reversal', payment.amount, payment=payment,
+        description=description or f'Reversal of payment {payment.pk}', created_by=created_by,
+    )
+
+
+def post_charge(charge, student_fee, entry_type='charge', created_by=None):
+    """Post an AdditionalCharge to a fee as a charge or penalty; a no-op if already posted"""
+    return post_entry(
+        student_fee.pk, entry_type, charge.amount, charge=charge,
+        description=charge.description[:255], created_by=created_by or charge.added_by,
+    )
+
+
+def restate_amount_due(student_fee_id, structure_total):
+    """
+    Set a fee's amount due, balance and paid status from its fee
+    structure's total and the charges and payments already posted, in one
+    UPDATE that queues on the row lock like a posting.
+    """
+    due = Value(Decimal(structure_total)) + F('additional_charges') + F('penalty_charges')
+    settled = LessThanOrEqual(due - F('amount_paid'), ZERO)
+    StudentFee.objects.filter(pk=student_fee_id).update(
+        amount_due=due,
+        balance=due - F('amount_paid'),
+        is_paid=Case(When(settled, then=Value(True)), default=Value(False)),
+        paid_date=Case(
+            When(settled, paid_date__isnull=True, then=Value(timezone.now().date())),
+            When(settled, then=F('paid_date')),
+            default=Value(None),
+            output_field=DateField(),
+        ),
+    )
+
+
+def _ledger_totals(fee_ids=None):
+    """{student_fee_id: {column: net of its entries}} for the columns entries move, from one query"""
+    entries = FeeLedgerEntry.objects.order_by().values('student_fee_id')
+    if fee_ids is not None:
+        entries = entries.filter(student_fee_id__in=fee_ids)
+    rows = entries.annotate(**{
+        f'{entry_type}_total': Sum('amount', filter=Q(entry_type=entry_type)) for entry_type in EFFECTS
+    })
+
+    totals = {}
+    for row in rows:
+        columns = {field: ZERO for field, _ in EFFECTS.values()}
+        for entry_type, (field, sign) in EFFECTS.items():
+            columns[field] += (row[f'{entry_type}_total'] or ZERO) * sign
+        totals[row['student_fee_id']] = columns
+    return totals
+
+
+def verify_ledger(fee_ids=None, fix=False):
+    """
+    Replay the ledger and compare it with the totals stored on StudentFee.
+
+    Returns a list of {'student_fee_id', 'field', 'stored', 'expected'} for
+    every total that disagrees; with fix=True the fees are rewritten from
+    their ledgers in one bulk update.
+    """
+    totals = _ledger_totals(fee_ids)
+    fees = StudentFee.objects.order_by('pk').values(
+        'pk', 'amount_due', 'amount_paid', 'balance', *DUE_FIELDS,
+        *(f'fee_structure__{field}' for field in STRUCTURE_FIELDS),
+    )
+    if fee_ids is not None:
+        fees = fees.filter(pk__in=fee_ids)
+
+    mismatches = []
+    fixed = []
+    for fee in fees:
+        expected = {field: ZERO for field, _ in EFFECTS.values()}
+        expected.update(totals.get(fee['pk'], {}))
+        expected['amount_due'] = (
+            sum(fee[f'fee_structure__{field}'] for field in STRUCTURE_FIELDS)
+            + sum(expected[field] for field in DUE_FIELDS)
+        )
+        expected['balance'] = expected['amount_due'] - expected['amount_paid']
+
+        wrong = [field for field, value in expected.items() if fee[field] != value]
+        for field in wrong:
+            mismatches.append({
+                'student_fee_id': fee['pk'], 'field': field, 'stored': fee[field], 'expected': expected[field],
+            })
+        if wrong and fix:
+            fixed.append(StudentFee(pk=fee['pk'], is_paid=expected['balance'] <= 0, **expected))
+
+    if fixed:
+        with transaction.atomic():
+            StudentFee.objects.bulk_update(
+                fixed, ['amount_due', 'amount_paid', 'balance', 'is_paid', *DUE_FIELDS], batch_size=500,
+            )
+    return mismatches
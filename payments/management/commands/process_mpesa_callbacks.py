@@ -0,0 +1,20 @@
+import time
+from django.core.management.base import BaseCommand
+from payments.callbacks import BATCH_SIZE, process_callback_events
+
+class Command(BaseCommand):
+    help = 'Applies stored M-Pesa callbacks to their payments; several can run at once'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--batch-size', type=int, default=BATCH_SIZE, help='Events claimed per transaction')
+        parser.add_argument('--loop', action='store_true', help='Keep polling for new callbacks instead of exiting when drained')
+        parser.add_argument('--interval', type=float, default=2.0, help='Seconds between polls with --loop')
+    
+    def handle(self, *args, **options):
+        while True:
+            count = process_callback_events(options['batch_size'])
+            if count or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(f'Processed {count} M-Pesa callbacks'))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
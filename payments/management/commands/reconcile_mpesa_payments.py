@@ -0,0 +1,24 @@
+import time
+from django.core.management.base import BaseCommand
+from payments.reconcile import BATCH_LIMIT, reconcile_pending_payments
+
+class Command(BaseCommand):
+    help = 'Queries M-Pesa for pending payments whose callback has not arrived and settles or expires them'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--limit', type=int, default=BATCH_LIMIT, help='Payments queried per run')
+        parser.add_argument('--concurrency', type=int, help='Status queries in flight at once (default MPESA_QUERY_CONCURRENCY)')
+        parser.add_argument('--loop', action='store_true', help='Keep reconciling instead of exiting after one run')
+        parser.add_argument('--interval', type=float, default=15.0, help='Seconds between runs with --loop')
+    
+    def handle(self, *args, **options):
+        while True:
+            summary = reconcile_pending_payments(options['limit'], options['concurrency'])
+            if any(summary.values()) or not options['loop']:
+                self.stdout.write(self.style.SUCCESS(
+                    f"Checked {summary['checked']}: {summary['completed']} completed, {summary['failed']} failed, "
+                    f"{summary['cancelled']} cancelled; {summary['expired']} expired"
+                ))
+            if not options['loop']:
+                break
+            time.sleep(options['interval'])
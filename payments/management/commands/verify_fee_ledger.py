@@ -0,0 +1,25 @@
+from django.core.management.base import BaseCommand
+from payments.ledger import verify_ledger
+
+class Command(BaseCommand):
+    help = 'Replays the fee ledger and reports student fees whose stored totals disagree with it'
+    
+    def add_arguments(self, parser):
+        parser.add_argument('--fee', dest='fee_ids', type=int, action='append', help='Only check this StudentFee id (repeatable)')
+        parser.add_argument('--fix', action='store_true', help='Rewrite disagreeing totals from the ledger')
+    
+    def handle(self, *args, **options):
+        mismatches = verify_ledger(options['fee_ids'], fix=options['fix'])
+        for mismatch in mismatches:
+            self.stdout.write(
+                f"StudentFee {mismatch['student_fee_id']}: {mismatch['field']} is {mismatch['stored']}, "
+                f"ledger says {mismatch['expected']}"
+            )
+        
+        fees = len({mismatch['student_fee_id'] for mismatch in mismatches})
+        if not mismatches:
+            self.stdout.write(self.style.SUCCESS('Every fee matches its ledger'))
+        elif options['fix']:
+            self.stdout.write(self.style.SUCCESS(f'Rewrote {fees} fee(s) from the ledger'))
+        else:
+            self.stdout.write(self.style.WARNING(f'{fees} fee(s) disagree with the ledger; run with --fix to rewrite them'))
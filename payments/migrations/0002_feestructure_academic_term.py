@@ -0,0 +1,26 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:47
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def link_academic_terms(apps, schema_editor):
+    from marks.terms import link_academic_terms
+    
+    link_academic_terms(apps.get_model('marks', 'AcademicTerm'), [apps.get_model('payments', 'FeeStructure')])
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('marks', '0007_academicterm'),
+        ('payments', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='feestructure',
+            name='academic_term',
+            field=models.ForeignKey(blank=True, editable=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='fee_structures', to='marks.academicterm'),
+        ),
+        migrations.RunPython(link_academic_terms, migrations.RunPython.noop),
+    ]
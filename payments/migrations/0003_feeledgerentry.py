@@ -0,0 +1,72 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:11
+
+from decimal import Decimal
+from django.conf import settings
+import django.core.validators
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+def open_ledgers(apps, schema_editor):
+    """Post existing completed payments and charges so the ledger matches current totals"""
+    Payment = apps.get_model('payments', 'Payment')
+    StudentFee = apps.get_model('payments', 'StudentFee')
+    FeeLedgerEntry = apps.get_model('payments', 'FeeLedgerEntry')
+    
+    entries = [
+        FeeLedgerEntry(
+            student_fee_id=student_fee_id, entry_type='payment', amount=amount, payment_id=payment_id,
+            description='Posted when the ledger was opened',
+        )
+        for payment_id, student_fee_id, amount in Payment.objects.filter(status='completed', amount__gt=0)
+        .values_list('pk', 'student_fee_id', 'amount').iterator(chunk_size=5000)
+    ]
+    # Charges were added straight onto the fee, so they are carried over as opening balances
+    for student_fee_id, additional_charges, penalty_charges in StudentFee.objects.values_list(
+        'pk', 'additional_charges', 'penalty_charges',
+    ).iterator(chunk_size=5000):
+        for entry_type, amount in (('charge', additional_charges), ('penalty', penalty_charges)):
+            if amount > 0:
+                entries.append(FeeLedgerEntry(
+                    student_fee_id=student_fee_id, entry_type=entry_type, amount=amount,
+                    description='Opening balance',
+                ))
+    FeeLedgerEntry.objects.bulk_create(entries, batch_size=1000)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('payments', '0002_feestructure_academic_term'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='FeeLedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('entry_type', models.CharField(choices=[('charge', 'Charge'), ('penalty', 'Penalty'), ('payment', 'Payment'), ('reversal', 'Payment Reversal')], max_length=20)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10, validators=[django.core.validators.MinValueValidator(Decimal('0.01'))])),
+                ('description', models.CharField(blank=True, max_length=255)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('charge', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='ledger_entries', to='payments.additionalcharge')),
+                ('created_by', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, to=settings.AUTH_USER_MODEL)),
+                ('payment', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.RESTRICT, related_name='ledger_entries', to='payments.payment')),
+                ('student_fee', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_entries', to='payments.studentfee')),
+            ],
+            options={
+                'verbose_name_plural': 'Fee ledger entries',
+                'ordering': ['student_fee', 'id'],
+            },
+        ),
+        migrations.AddConstraint(
+            model_name='feeledgerentry',
+            constraint=models.UniqueConstraint(condition=models.Q(('payment__isnull', False)), fields=('payment', 'entry_type'), name='ledger_one_entry_per_payment'),
+        ),
+        migrations.AddConstraint(
+            model_name='feeledgerentry',
+            constraint=models.UniqueConstraint(condition=models.Q(('charge__isnull', False)), fields=('charge', 'entry_type'), name='ledger_one_entry_per_charge'),
+        ),
+        migrations.RunPython(open_ledgers, migrations.RunPython.noop),
+    ]
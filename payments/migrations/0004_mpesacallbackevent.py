@@ -0,0 +1,32 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:13
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0003_feeledgerentry'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='MpesaCallbackEvent',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('checkout_request_id', models.CharField(max_length=100, unique=True)),
+                ('payload', models.JSONField()),
+                ('status', models.CharField(choices=[('pending', 'Pending'), ('processed', 'Processed'), ('failed', 'Failed')], default='pending', max_length=10)),
+                ('attempts', models.PositiveIntegerField(default=0)),
+                ('error', models.TextField(blank=True)),
+                ('received_at', models.DateTimeField(auto_now_add=True)),
+                ('processed_at', models.DateTimeField(blank=True, null=True)),
+            ],
+            options={
+                'verbose_name': 'M-Pesa Callback',
+                'verbose_name_plural': 'M-Pesa Callbacks',
+                'ordering': ['-received_at'],
+                'indexes': [models.Index(fields=['status', 'received_at'], name='payments_mp_status_b6b284_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,27 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:15
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0004_mpesacallbackevent'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payment',
+            name='next_status_check',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='payment',
+            name='status_checks',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddIndex(
+            model_name='payment',
+            index=models.Index(fields=['status', 'next_status_check'], name='payment_status_check_idx'),
+        ),
+    ]
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:35
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('payments', '0005_payment_status_checks'),
+    ]
+
+    operations = [
+        migrations.RemoveConstraint(
+            model_name='feeledgerentry',
+            name='ledger_one_entry_per_payment',
+        ),
+    ]
@@ -1,7 +1,8 @@
-from django.db import models
+from django.db import models, transaction
 from students.models import Student
 from django.core.validators import MinValueValidator
 from decimal import Decimal
+from marks.terms import assign_academic_terms
 
 class FeeStructure(models.Model):
     TERM_CHOICES = (
@@ -25,6 +26,8 @@ class FeeStructure(models.Model):
     grade = models.CharField(max_length=20, choices=GRADE_CHOICES)
     term = models.CharField(max_length=20, choices=TERM_CHOICES)
     academic_year = models.CharField(max_length=20)
+    academic_term = models.ForeignKey('marks.AcademicTerm', on_delete=models.SET_NULL, null=True, blank=True,
+                                      related_name='fee_structures', editable=False)
     
     # Fee breakdown
     tuition_fee = models.DecimalField(max_digits=10, decimal_places=2, default=0)
@@ -51,6 +54,10 @@ class FeeStructure(models.Model):
     def __str__(self):
         return f"{self.name} - {self.grade} {self.term} {self.academic_year}"
     
+    def save(self, *args, **kwargs):
+        assign_academic_terms([self])
+        super().save(*args, **kwargs)
+    
     @property
     def total_fee(self):
         total = sum([
@@ -94,18 +101,43 @@ class StudentFee(models.Model):
     def __str__(self):
         return f"{self.student} - {self.fee_structure} - Balance: {self.balance}"
     
+    # Kept by payments.ledger as running sums of the fee's ledger entries
+    LEDGER_FIELDS = ('amount_due', 'amount_paid', 'balance', 'additional_charges', 'penalty_charges', 'is_paid', 'paid_date')
+    
     def save(self, *args, **kwargs):
-        # Calculate total amount due
-        total_fee = self.fee_structure.total_fee
-        self.amount_due = total_fee + self.additional_charges + self.penalty_charges
-        
-        # Calculate balance
-        self.balance = self.amount_due - self.amount_paid
+        """
+        Save the fee's own fields. The totals are never written from memory,
+        where they may be stale: a new fee starts at its structure's total
+        with any starting charges posted to its ledger, and an existing one
+        has its totals recomputed in the database and reloaded.
+        """
+        from .ledger import post_entry, restate_amount_due
         
-        # Update payment status
-        self.is_paid = self.balance <= 0
+        if self._state.adding:
+            if self.amount_paid:
+                raise ValueError('Record payments against a fee as Payments, not as amount_paid.')
+            charges = [('charge', self.additional_charges), ('penalty', self.penalty_charges)]
+            self.additional_charges = self.penalty_charges = 0
+            self.amount_due = self.balance = self.fee_structure.total_fee
+            self.is_paid = self.balance <= 0
+            self.paid_date = None
+            with transaction.atomic():
+                super().save(*args, **kwargs)
+                for entry_type, amount in charges:
+                    if amount:
+                        post_entry(self.pk, entry_type, amount, description='Charged when the fee was assigned')
+            if any(amount for _, amount in charges):
+                self.refresh_from_db(fields=self.LEDGER_FIELDS)
+            return
         
-        super().save(*args, **kwargs)
+        update_fields = kwargs.pop('update_fields', None)
+        if update_fields is None:
+            update_fields = [field.name for field in self._meta.concrete_fields if not field.primary_key]
+        update_fields = [name for name in update_fields if name not in self.LEDGER_FIELDS]
+        with transaction.atomic():
+            restate_amount_due(self.pk, self.fee_structure.total_fee)
+            self.refresh_from_db(fields=self.LEDGER_FIELDS)
+            super().save(*args, update_fields=update_fields, **kwargs)
     
     @property
     def total_charges(self):
@@ -148,11 +180,18 @@ class Payment(models.Model):
     confirmed_by = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True, blank=True)
     confirmed_at = models.DateTimeField(null=True, blank=True)
     
+    # Status queries to M-Pesa for a pending payment (payments.reconcile)
+    status_checks = models.PositiveIntegerField(default=0)
+    next_status_check = models.DateTimeField(null=True, blank=True)
+    
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
     
     class Meta:
         ordering = ['-payment_date']
+        indexes = [
+            models.Index(fields=['status', 'next_status_check'], name='payment_status_check_idx'),
+        ]
     
     def __str__(self):
         return f"{self.student} - {self.amount} - {self.payment_method} - {self.status}"
@@ -200,9 +239,92 @@ class PaymentReceipt(models.Model):
     def generate_receipt_number(self):
         from datetime import datetime
         date_str = datetime.now().strftime('%Y%m%d')
-        return f"RCPT-{date_str}-{self.id:06d}"
+        # Numbered by payment, which is known before the receipt is saved and has one receipt at most
+        return f"RCPT-{date_str}-{self.payment_id:06d}"
     
     def save(self, *args, **kwargs):
         if not self.receipt_number:
             self.receipt_number = self.generate_receipt_number()
-        super().save(*args, **kwargs)
\ No newline at end of file
+        super().save(*args, **kwargs)
+
+class FeeLedgerEntry(models.Model):
+    """
+    One movement on a student's fee account. Entries are only ever added;
+    a mistaken payment is undone by a reversal entry, never by editing or
+    deleting. The StudentFee totals are running sums of these entries (see
+    payments.ledger).
+    """
+    ENTRY_TYPE_CHOICES = (
+        ('charge', 'Charge'),
+        ('penalty', 'Penalty'),
+        ('payment', 'Payment'),
+        ('reversal', 'Payment Reversal'),
+    )
+    
+    student_fee = models.ForeignKey(StudentFee, on_delete=models.CASCADE, related_name='ledger_entries')
+    entry_type = models.CharField(max_length=20, choices=ENTRY_TYPE_CHOICES)
+    amount = models.DecimalField(max_digits=10, decimal_places=2, validators=[MinValueValidator(Decimal('0.01'))])
+    
+    # What the entry posts: at most one entry of each type per charge, while a
+    # payment's payment and reversal entries alternate (see payments.ledger).
+    # RESTRICT keeps them from being deleted except along with the fee itself
+    payment = models.ForeignKey(Payment, on_delete=models.RESTRICT, null=True, blank=True, related_name='ledger_entries')
+    charge = models.ForeignKey(AdditionalCharge, on_delete=models.RESTRICT, null=True, blank=True, related_name='ledger_entries')
+    
+    description = models.CharField(max_length=255, blank=True)
+    created_by = models.ForeignKey('accounts.User', on_delete=models.SET_NULL, null=True, blank=True)
+    created_at = models.DateTimeField(auto_now_add=True)
+    
+    class Meta:
+        ordering = ['student_fee', 'id']
+        verbose_name_plural = 'Fee ledger entries'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['charge', 'entry_type'], condition=models.Q(charge__isnull=False),
+                name='ledger_one_entry_per_charge',
+            ),
+        ]
+    
+    def __str__(self):
+        return f"{self.get_entry_type_display()} {self.amount} - {self.student_fee}"
+    
+    def save(self, *args, **kwargs):
+        if self.pk:
+            raise ValueError('Ledger entries cannot be changed; post a reversal instead.')
+        super().save(*args, **kwargs)
+    
+    def delete(self, *args, **kwargs):
+        raise ValueError('Ledger entries cannot be deleted; post a reversal instead.')
+
+
+class MpesaCallbackEvent(models.Model):
+    """
+    An STK push callback from Safaricom, stored as received and applied to
+    its payment later by payments.callbacks. The unique CheckoutRequestID
+    turns Safaricom's retries of the same callback into no-ops.
+    """
+    STATUS_CHOICES = (
+        ('pending', 'Pending'),
+        ('processed', 'Processed'),
+        ('failed', 'Failed'),
+    )
+    
+    checkout_request_id = models.CharField(max_length=100, unique=True)
+    payload = models.JSONField()
+    status = models.CharField(max_length=10, choices=STATUS_CHOICES, default='pending')
+    attempts = models.PositiveIntegerField(default=0)
+    error = models.TextField(blank=True)
+    
+    received_at = models.DateTimeField(auto_now_add=True)
+    processed_at = models.DateTimeField(null=True, blank=True)
+    
+    class Meta:
+        ordering = ['-received_at']
+        verbose_name = 'M-Pesa Callback'
+        verbose_name_plural = 'M-Pesa Callbacks'
+        indexes = [
+            models.Index(fields=['status', 'received_at']),
+        ]
+    
+    def __str__(self):
+        return f"{self.checkout_request_id} ({self.get_status_display()})"
@@ -1,10 +1,89 @@
-import requests
+# payments/mpesa.py
+"""
+Client for Safaricom's Daraja API (STK push and status queries).
+
+Calls go through one requests.Session per process, which keeps connections
+to Daraja alive between calls and retries failed connections with backoff.
+The OAuth token is kept in the default Django cache until shortly before it
+expires; when it has to be fetched, one caller fetches it while the others
+wait for the result instead of all asking at once. Processes only share the
+token, and the lock, on a shared cache (Redis or files, see settings.CACHES);
+on the local-memory default each process has its own, and the
+payments.W001 check says so.
+Bulk status queries go through the asyncio client in payments.mpesa_async.
+"""
 import base64
+import hashlib
+import json
+import logging
+import threading
+import time
 from datetime import datetime
+import requests
 from django.conf import settings
-import json
+from django.core.cache import cache
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+logger = logging.getLogger(__name__)
+
+BASE_URLS = {
+    'sandbox': 'https://sandbox.safaricom.co.ke',
+    'production': 'https://api.safaricom.co.ke',
+}
+
+# (connect, read) timeouts in seconds
+TIMEOUT = (5, 30)
+
+# A cached token is dropped this many seconds before Safaricom expires it
+TOKEN_SAFETY_MARGIN = 60
+
+# Longest a caller may hold the token refresh, and others wait on it, in seconds
+TOKEN_LOCK_TIMEOUT = 10
+TOKEN_WAIT = 5
+
+# Connections kept alive per process
+POOL_SIZE = 20
+
+_session = None
+_session_lock = threading.Lock()
+_token_lock = threading.Lock()
+
+
+def get_session():
+    """
+    The process's pooled session for Daraja. Connection failures are
+    retried with exponential backoff for every call; 429 and 5xx responses
+    only for GETs, since repeating an STK push POST could charge twice.
+    """
+    global _session
+    with _session_lock:
+        if _session is None:
+            retry = Retry(
+                total=3, connect=3, read=2, status=3,
+                backoff_factor=0.5,
+                status_forcelist=(429, 500, 502, 503, 504),
+                allowed_methods=frozenset({'GET'}),
+                raise_on_status=False,
+            )
+            session = requests.Session()
+            session.mount('https://', HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=retry))
+            session.mount('http://', HTTPAdapter(pool_connections=2, pool_maxsize=POOL_SIZE, max_retries=retry))
+            _session = session
+        return _session
+
+
+def daraja_base_url(config=None):
+    """MPESA_CONFIG['BASE_URL'] if set (a local stand-in, say), else the URL of the environment"""
+    config = settings.MPESA_CONFIG if config is None else config
+    if config.get('BASE_URL'):
+        return config['BASE_URL'].rstrip('/')
+    return BASE_URLS['production'] if config.get('ENVIRONMENT') == 'production' else BASE_URLS['sandbox']
 
-class MpesaAPI:
+
+class BaseMpesaAPI:
+    """Configuration, request payloads and result shapes shared by the sync and async clients"""
+    
     def __init__(self):
         self.consumer_key = settings.MPESA_CONFIG.get('CONSUMER_KEY', '')
         self.consumer_secret = settings.MPESA_CONFIG.get('CONSUMER_SECRET', '')
@@ -12,152 +91,89 @@ class MpesaAPI:
         self.passkey = settings.MPESA_CONFIG.get('PASSKEY', '')
         self.callback_url = settings.MPESA_CONFIG.get('CALLBACK_URL', '')
         self.environment = settings.MPESA_CONFIG.get('ENVIRONMENT', 'sandbox')
+        self.base_url = daraja_base_url()
         
-        if self.environment == 'sandbox':
-            self.base_url = 'https://sandbox.safaricom.co.ke'
-        else:
-            self.base_url = 'https://api.safaricom.co.ke'
-        
-        self.access_token = None
-        self.token_expiry = None
+        # Tokens are per app and per Daraja instance, in the default cache
+        # (shared across processes only on Redis or the file cache)
+        digest = hashlib.md5(f"{self.base_url}|{self.consumer_key}".encode()).hexdigest()
+        self.token_key = f'mpesa:token:{digest}'
+        self.token_lock_key = f'mpesa:token-lock:{digest}'
     
-    def get_access_token(self):
-        """Get OAuth access token from Safaricom API"""
-        try:
-            url = f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
-            auth_string = f"{self.consumer_key}:{self.consumer_secret}"
-            encoded_auth = base64.b64encode(auth_string.encode()).decode()
-            
-            headers = {
-                'Authorization': f'Basic {encoded_auth}'
-            }
-            
-            response = requests.get(url, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                self.access_token = data['access_token']
-                self.token_expiry = datetime.now().timestamp() + data['expires_in']
-                return self.access_token
-            else:
-                print(f"Token Error: {response.status_code} - {response.text}")
-                return None
-                
-        except Exception as e:
-            print(f"Token Exception: {str(e)}")
-            return None
+    def _token_url(self):
+        return f"{self.base_url}/oauth/v1/generate?grant_type=client_credentials"
     
-    def stk_push(self, phone_number, amount, account_reference, transaction_desc):
-        """Initiate STK Push payment request"""
-        try:
-            if not self.access_token or datetime.now().timestamp() >= self.token_expiry:
-                if not self.get_access_token():
-                    return {'success': False, 'error': 'Failed to get access token'}
-            
-            url = f"{self.base_url}/mpesa/stkpush/v1/processrequest"
-            
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            password = base64.b64encode(
-                f"{self.shortcode}{self.passkey}{timestamp}".encode()
-            ).decode()
-            
-            payload = {
-                "BusinessShortCode": self.shortcode,
-                "Password": password,
-                "Timestamp": timestamp,
-                "TransactionType": "CustomerPayBillOnline",
-                "Amount": str(int(amount)),
-                "PartyA": phone_number,
-                "PartyB": self.shortcode,
-                "PhoneNumber": phone_number,
-                "CallBackURL": self.callback_url,
-                "AccountReference": account_reference,
-                "TransactionDesc": transaction_desc
-            }
-            
-            headers = {
-                'Authorization': f'Bearer {self.access_token}',
-                'Content-Type': 'application/json'
-            }
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                if data.get('ResponseCode') == '0':
-                    return {
-                        'success': True,
-                        'response_code': data.get('ResponseCode'),
-                        'merchant_request_id': data.get('MerchantRequestID'),
-                        'checkout_request_id': data.get('CheckoutRequestID'),
-                        'response_description': data.get('ResponseDescription'),
-                        'customer_message': data.get('CustomerMessage')
-                    }
-                else:
-                    return {
-                        'success': False,
-                        'error': data.get('ResponseDescription', 'Payment request failed'),
-                        'response_code': data.get('ResponseCode')
-                    }
-            else:
-                return {
-                    'success': False,
-                    'error': f"HTTP {response.status_code}",
-                    'details': response.text
-                }
-                
-        except Exception as e:
+    def _token_headers(self):
+        encoded_auth = base64.b64encode(f"{self.consumer_key}:{self.consumer_secret}".encode()).decode()
+        return {'Authorization': f'Basic {encoded_auth}'}
+    
+    def _token_lifetime(self, data):
+        """Seconds to cache a token response's token for"""
+        return max(int(data.get('expires_in', 3599)) - TOKEN_SAFETY_MARGIN, 1)
+    
+    def _password(self, timestamp):
+        return base64.b64encode(f"{self.shortcode}{self.passkey}{timestamp}".encode()).decode()
+    
+    def _stk_push_payload(self, phone_number, amount, account_reference, transaction_desc):
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return {
+            "BusinessShortCode": self.shortcode,
+            "Password": self._password(timestamp),
+            "Timestamp": timestamp,
+            "TransactionType": "CustomerPayBillOnline",
+            "Amount": str(int(amount)),
+            "PartyA": phone_number,
+            "PartyB": self.shortcode,
+            "PhoneNumber": phone_number,
+            "CallBackURL": self.callback_url,
+            "AccountReference": account_reference,
+            "TransactionDesc": transaction_desc
+        }
+    
+    def _query_payload(self, checkout_request_id):
+        timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
+        return {
+            "BusinessShortCode": self.shortcode,
+            "Password": self._password(timestamp),
+            "Timestamp": timestamp,
+            "CheckoutRequestID": checkout_request_id
+        }
+    
+    def _stk_push_result(self, status_code, text):
+        """stk_push() result for a Daraja response"""
+        if status_code != 200:
             return {
                 'success': False,
-                'error': str(e)
-            }
-    
-    def check_transaction_status(self, checkout_request_id):
-        """Check status of a transaction"""
-        try:
-            if not self.access_token or datetime.now().timestamp() >= self.token_expiry:
-                if not self.get_access_token():
-                    return {'success': False, 'error': 'Failed to get access token'}
-            
-            url = f"{self.base_url}/mpesa/stkpushquery/v1/query"
-            
-            timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
-            password = base64.b64encode(
-                f"{self.shortcode}{self.passkey}{timestamp}".encode()
-            ).decode()
-            
-            payload = {
-                "BusinessShortCode": self.shortcode,
-                "Password": password,
-                "Timestamp": timestamp,
-                "CheckoutRequestID": checkout_request_id
+                'error': f"HTTP {status_code}",
+                'details': text
             }
-            
-            headers = {
-                'Authorization': f'Bearer {self.access_token}',
-                'Content-Type': 'application/json'
+        data = json.loads(text)
+        if data.get('ResponseCode') == '0':
+            return {
+                'success': True,
+                'response_code': data.get('ResponseCode'),
+                'merchant_request_id': data.get('MerchantRequestID'),
+                'checkout_request_id': data.get('CheckoutRequestID'),
+                'response_description': data.get('ResponseDescription'),
+                'customer_message': data.get('CustomerMessage')
             }
-            
-            response = requests.post(url, json=payload, headers=headers, timeout=30)
-            
-            if response.status_code == 200:
-                data = response.json()
-                return {
-                    'success': True,
-                    'data': data
-                }
-            else:
-                return {
-                    'success': False,
-                    'error': f"HTTP {response.status_code}",
-                    'details': response.text
-                }
-                
-        except Exception as e:
+        return {
+            'success': False,
+            'error': data.get('ResponseDescription', 'Payment request failed'),
+            'response_code': data.get('ResponseCode')
+        }
+    
+    def _status_result(self, status_code, text):
+        """check_transaction_status() result for a Daraja response"""
+        if status_code != 200:
             return {
                 'success': False,
-                'error': str(e)
+                'error': f"HTTP {status_code}",
+                'details': text
             }
+        return {
+            'success': True,
+            'data': json.loads(text)
+        }
     
     def validate_callback_data(self, callback_data):
         """Validate M-Pesa callback data"""
@@ -222,4 +238,108 @@ class MpesaAPI:
             return {
                 'success': False,
                 'error': f"Parse error: {str(e)}"
-            }
\ No newline at end of file
+            }
+
+
+class MpesaAPI(BaseMpesaAPI):
+    def __init__(self):
+        super().__init__()
+        self.session = get_session()
+    
+    def _fetch_access_token(self):
+        """Ask Safaricom for a new token and share it through the cache"""
+        try:
+            response = self.session.get(self._token_url(), headers=self._token_headers(), timeout=TIMEOUT)
+            
+            if response.status_code == 200:
+                data = response.json()
+                cache.set(self.token_key, data['access_token'], self._token_lifetime(data))
+                return data['access_token']
+            else:
+                logger.error("M-Pesa token error: %s - %s", response.status_code, response.text)
+                return None
+                
+        except Exception as e:
+            logger.error("M-Pesa token exception: %s", e)
+            return None
+    
+    def get_access_token(self, stale_token=None):
+        """
+        A valid OAuth token, from the cache when possible.
+        
+        Only one caller fetches a new token at a time (across processes when
+        the cache is shared); the rest wait for it to appear in the cache.
+        Pass the token Daraja just rejected as `stale_token` to have it
+        replaced.
+        """
+        token = cache.get(self.token_key)
+        if token and token != stale_token:
+            return token
+        
+        # Threads of this process queue here; processes queue on the cache lock below
+        with _token_lock:
+            token = cache.get(self.token_key)
+            if token and token != stale_token:
+                return token
+            
+            if cache.add(self.token_lock_key, 1, TOKEN_LOCK_TIMEOUT):
+                try:
+                    return self._fetch_access_token()
+                finally:
+                    cache.delete(self.token_lock_key)
+            
+            deadline = time.monotonic() + TOKEN_WAIT
+            while time.monotonic() < deadline:
+                time.sleep(0.05)
+                token = cache.get(self.token_key)
+                if token and token != stale_token:
+                    return token
+            # Whoever held the lock gave up; fetch our own
+            return self._fetch_access_token()
+    
+    def _post(self, path, payload):
+        """POST to Daraja with the shared token, replacing it once if it was rejected"""
+        token = self.get_access_token()
+        if not token:
+            return None
+        
+        for attempt in range(2):
+            headers = {
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json'
+            }
+            response = self.session.post(f"{self.base_url}{path}", json=payload, headers=headers, timeout=TIMEOUT)
+            if response.status_code != 401 or attempt:
+                return response
+            token = self.get_access_token(stale_token=token)
+            if not token:
+                return response
+    
+    def stk_push(self, phone_number, amount, account_reference, transaction_desc):
+        """Initiate STK Push payment request"""
+        try:
+            payload = self._stk_push_payload(phone_number, amount, account_reference, transaction_desc)
+            response = self._post('/mpesa/stkpush/v1/processrequest', payload)
+            if response is None:
+                return {'success': False, 'error': 'Failed to get access token'}
+            return self._stk_push_result(response.status_code, response.text)
+                
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
+    
+    def check_transaction_status(self, checkout_request_id):
+        """Check status of a transaction"""
+        try:
+            response = self._post('/mpesa/stkpushquery/v1/query', self._query_payload(checkout_request_id))
+            if response is None:
+                return {'success': False, 'error': 'Failed to get access token'}
+            return self._status_result(response.status_code, response.text)
+                
+        except Exception as e:
+            return {
+                'success': False,
+                'error': str(e)
+            }
@@ -0,0 +1,230 @@
+# payments/mpesa_async.py
+"""
+Asyncio client for Safaricom's Daraja API, for many calls at once.
+
+AsyncMpesaAPI makes the same calls as payments.mpesa.MpesaAPI and returns
+results of the same shape, over one aiohttp session whose connector caps
+the connections open to Daraja. query_many() sends hundreds of status
+queries concurrently, at most MPESA_QUERY_CONCURRENCY in flight and
+MPESA_QUERY_RATE started per second, so a batch takes about as long as
+its slowest few round trips rather than one round trip per payment. The
+OAuth token is the one MpesaAPI keeps in the Django cache.
+
+From synchronous code, call query_statuses().
+"""
+import asyncio
+import json
+import logging
+import aiohttp
+from asgiref.sync import async_to_sync
+from django.conf import settings
+from django.core.cache import cache
+from .mpesa import TIMEOUT, TOKEN_LOCK_TIMEOUT, TOKEN_WAIT, BaseMpesaAPI
+
+logger = logging.getLogger(__name__)
+
+# Defaults for settings.MPESA_QUERY_CONCURRENCY and MPESA_QUERY_RATE:
+# requests in flight at once, and requests started per second
+CONCURRENCY = 50
+RATE = 100
+
+# Attempts after a failed connection, waiting BACKOFF * 2 ** attempt seconds
+RETRIES = 3
+BACKOFF = 0.5
+
+# Responses a token request is repeated for; other calls are POSTs, which
+# are only repeated when the connection failed before anything was sent
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+def _setting(name, default):
+    return getattr(settings, f'MPESA_{name}', default)
+
+
+class RateLimiter:
+    """Spaces the starts of requests at least 1/rate seconds apart"""
+
+    def __init__(self, rate):
+        self.interval = 1 / rate if rate else 0
+        self._next = 0
+        self._lock = asyncio.Lock()
+
+    async def wait(self):
+        if not self.interval:
+            return
+        loop = asyncio.get_running_loop()
+        async with self._lock:
+            now = loop.time()
+            delay = self._next - now
+            self._next = max(now, self._next) + self.interval
+        if delay > 0:
+            await asyncio.sleep(delay)
+
+
+class AsyncMpesaAPI(BaseMpesaAPI):
+    """
+    Use as `async with AsyncMpesaAPI() as api:`; every call made through
+    `api` shares its session, connection limit and rate limit.
+    """
+
+    def __init__(self, concurrency=None, rate=None):
+        super().__init__()
+        self.concurrency = concurrency or _setting('QUERY_CONCURRENCY', CONCURRENCY)
+        self.rate = _setting('QUERY_RATE', RATE) if rate is None else rate
+        self.session = None
+        self._limiter = None
+        self._token_lock = None
+
+    async def __aenter__(self):
+        self.open()
+        return self
+
+    async def __aexit__(self, *exc_info):
+        await self.close()
+
+    def open(self):
+        """Start the session; must run inside the event loop it will be used from"""
+        if self.session is None:
+            self.session = aiohttp.ClientSession(
+                connector=aiohttp.TCPConnector(limit=self.concurrency, limit_per_host=self.concurrency),
+                timeout=aiohttp.ClientTimeout(sock_connect=TIMEOUT[0], sock_read=TIMEOUT[1]),
+            )
+            self._limiter = RateLimiter(self.rate)
+            self._token_lock = asyncio.Lock()
+
+    async def close(self):
+        if self.session is not None:
+            await self.session.close()
+            self.session = None
+
+    async def _request(self, method, url, retry_status=False, **kwargs):
+        """(status, body text) of a request, retrying failed connections with backoff"""
+        for attempt in range(RETRIES + 1):
+            await self._limiter.wait()
+            try:
+                async with self.session.request(method, url, **kwargs) as response:
+                    text = await response.text()
+                    if not (retry_status and response.status in RETRY_STATUSES and attempt < RETRIES):
+                        return response.status, text
+            except aiohttp.ClientConnectorError:
+                if attempt == RETRIES:
+                    raise
+            await asyncio.sleep(BACKOFF * 2 ** attempt)
+
+    async def _fetch_access_token(self):
+        """Ask Safaricom for a new token and share it through the cache"""
+        try:
+            status, text = await self._request(
+                'GET', self._token_url(), retry_status=True, headers=self._token_headers(),
+            )
+            if status == 200:
+                data = json.loads(text)
+                await cache.aset(self.token_key, data['access_token'], self._token_lifetime(data))
+                return data['access_token']
+            logger.error("M-Pesa token error: %s - %s", status, text)
+            return None
+
+        except Exception as e:
+            logger.error("M-Pesa token exception: %s", e)
+            return None
+
+    async def get_access_token(self, stale_token=None):
+        """
+        A valid OAuth token, from the cache when possible. As with
+        MpesaAPI.get_access_token(), one caller fetches it at a time.
+        """
+        token = await cache.aget(self.token_key)
+        if token and token != stale_token:
+            return token
+
+        # Tasks of this client queue here; processes queue on the cache lock below
+        async with self._token_lock:
+            token = await cache.aget(self.token_key)
+            if token and token != stale_token:
+                return token
+
+            if await cache.aadd(self.token_lock_key, 1, TOKEN_LOCK_TIMEOUT):
+                try:
+                    return await self._fetch_access_token()
+                finally:
+                    await cache.adelete(self.token_lock_key)
+
+            loop = asyncio.get_running_loop()
+            deadline = loop.time() + TOKEN_WAIT
+            while loop.time() < deadline:
+                await asyncio.sleep(0.05)
+                token = await cache.aget(self.token_key)
+                if token and token != stale_token:
+                    return token
+            # Whoever held the lock gave up; fetch our own
+            return await self._fetch_access_token()
+
+    async def _post(self, path, payload):
+        """(status, body text) of a POST with the shared token, replaced once if rejected; None without a token"""
+        token = await self.get_access_token()
+        if not token:
+            return None
+
+        for attempt in range(2):
+            headers = {
+                'Authorization': f'Bearer {token}',
+                'Content-Type': 'application/json'
+            }
+            status, text = await self._request('POST', f"{self.base_url}{path}", json=payload, headers=headers)
+            if status != 401 or attempt:
+                return status, text
+            token = await self.get_access_token(stale_token=token)
+            if not token:
+                return status, text
+
+    async def stk_push(self, phone_number, amount, account_reference, transaction_desc):
+        """Initiate STK Push payment request"""
+        try:
+            payload = self._stk_push_payload(phone_number, amount, account_reference, transaction_desc)
+            response = await self._post('/mpesa/stkpush/v1/processrequest', payload)
+            if response is None:
+                return {'success': False, 'error': 'Failed to get access token'}
+            return self._stk_push_result(*response)
+
+        except Exception as e:
+            return {'success': False, 'error': str(e) or type(e).__name__}
+
+    async def check_transaction_status(self, checkout_request_id):
+        """Check status of a transaction"""
+        try:
+            response = await self._post('/mpesa/stkpushquery/v1/query', self._query_payload(checkout_request_id))
+            if response is None:
+                return {'success': False, 'error': 'Failed to get access token'}
+            return self._status_result(*response)
+
+        except Exception as e:
+            return {'success': False, 'error': str(e) or type(e).__name__}
+
+    async def query_many(self, checkout_request_ids):
+        """{CheckoutRequestID: check_transaction_status() result} for all the ids, queried concurrently"""
+        checkout_request_ids = list(dict.fromkeys(checkout_request_ids))
+        if not checkout_request_ids:
+            return {}
+
+        # Fetch the token once up front rather than have every query wait on it
+        await self.get_access_token()
+
+        semaphore = asyncio.Semaphore(self.concurrency)
+
+        async def query(checkout_request_id):
+            async with semaphore:
+                return await self.check_transaction_status(checkout_request_id)
+
+        results = await asyncio.gather(*(query(checkout_request_id) for checkout_request_id in checkout_request_ids))
+        return dict(zip(checkout_request_ids, results))
+
+
+async def query_many(checkout_request_ids, concurrency=None, rate=None):
+    """AsyncMpesaAPI.query_many() on a client of its own"""
+    async with AsyncMpesaAPI(concurrency, rate) as api:
+        return await api.query_many(checkout_request_ids)
+
+
+def query_statuses(checkout_request_ids, concurrency=None, rate=None):
+    """query_many() for synchronous callers (commands, Celery tasks, admin actions)"""
+    return async_to_sync(query_many)(checkout_request_ids, concurrency, rate)
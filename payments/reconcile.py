@@ -0,0 +1,193 @@
+# payments/reconcile.py
+"""
+Reconciliation of pending M-Pesa payments.
+
+The callback normally settles an STK push payment; when it has not arrived
+within a grace period, the payment's status is queried from M-Pesa here,
+in a background run rather than on page views. A batch of payments is
+queried concurrently through payments.mpesa_async; a payment M-Pesa has no answer for yet is asked
+again later, waiting twice as long each time. One left unconfirmed past
+MPESA_PENDING_EXPIRY is queried a last time and failed only if M-Pesa still
+has no answer. Outcomes are written with bulk updates.
+"""
+from datetime import timedelta
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+from .ledger import post_payment
+from .models import Payment, PaymentReceipt
+from .mpesa_async import query_statuses
+
+# Defaults for the settings.MPESA_* values
+GRACE = 60
+PENDING_EXPIRY = 30 * 60
+
+# Payments queried per run
+BATCH_LIMIT = 500
+
+# Seconds before the first repeat query, doubling up to BACKOFF_MAX
+BACKOFF_BASE = 30
+BACKOFF_MAX = 30 * 60
+
+# STK push result codes meaning the customer called it off
+CANCELLED_RESULT_CODES = {'1031', '1032'}
+
+
+def _setting(name, default):
+    return getattr(settings, f'MPESA_{name}', default)
+
+
+def backoff(checks):
+    """Seconds to wait before querying a payment that has been queried `checks` times"""
+    return min(BACKOFF_BASE * 2 ** max(checks - 1, 0), BACKOFF_MAX)
+
+
+def due_for_check(now=None, limit=BATCH_LIMIT):
+    """
+    Pending M-Pesa payments past the grace period whose next query is due,
+    oldest first. Those past MPESA_PENDING_EXPIRY are left to expire_stale().
+    """
+    now = now or timezone.now()
+    return (
+        Payment.objects.filter(
+            status='pending', payment_method='mpesa',
+            created_at__lte=now - timedelta(seconds=_setting('RECONCILE_GRACE', GRACE)),
+            created_at__gte=now - timedelta(seconds=_setting('PENDING_EXPIRY', PENDING_EXPIRY)),
+        )
+        .exclude(transaction_id='')
+        .filter(Q(next_status_check__isnull=True) | Q(next_status_check__lte=now))
+        .order_by('created_at')[:limit]
+    )
+
+
+def outcome(result):
+    """
+    (status, description) a status query settles a payment with, or None
+    while M-Pesa has no final answer (it answers with an error until then).
+    """
+    if not result or not result.get('success'):
+        return None
+    data = result['data']
+    code = data.get('ResultCode')
+    if code is None or code == '':
+        return None
+    code = str(code)
+    if code == '0':
+        return 'completed', data.get('ResultDesc', '')
+    if code in CANCELLED_RESULT_CODES:
+        return 'cancelled', data.get('ResultDesc', '')
+    return 'failed', data.get('ResultDesc', '')
+
+
+def settle(outcomes):
+    """
+    Apply {payment id: (status, description)} to payments still pending, in
+    one bulk update; completed ones are posted to the fee ledger and
+    receipted. Payments another worker (or the callback) holds are skipped.
+    Returns the settled payments.
+    """
+    now = timezone.now()
+    with transaction.atomic():
+        payments = list(
+            Payment.objects.select_for_update(skip_locked=True).filter(pk__in=list(outcomes), status='pending')
+        )
+        for payment in payments:
+            payment.status, description = outcomes[payment.pk]
+            if payment.status != 'completed':
+                payment.description = description or payment.description
+            payment.updated_at = now
+        Payment.objects.bulk_update(payments, ['status', 'description', 'updated_at'], batch_size=500)
+
+        # bulk_update() sends no post_save, so do what the payment signals would
+        for payment in payments:
+            if payment.status == 'completed':
+                post_payment(payment)
+                PaymentReceipt.objects.get_or_create(payment=payment)
+    return payments
+
+
+def _reached_daraja(result):
+    """Whether a status query got a response from Daraja, an error response included"""
+    return bool(result) and (result.get('success') or 'details' in result)
+
+
+def _query(payments, now, concurrency=None):
+    """
+    Query M-Pesa for the payments at once, schedule their next query and
+    settle those it has an answer for. Returns (check_transaction_status()
+    results by transaction id, settled payments).
+    """
+    results = query_statuses([payment.transaction_id for payment in payments], concurrency)
+    outcomes = {}
+    for payment in payments:
+        payment.status_checks += 1
+        payment.next_status_check = now + timedelta(seconds=backoff(payment.status_checks))
+        found = outcome(results.get(payment.transaction_id))
+        if found:
+            outcomes[payment.pk] = found
+    Payment.objects.bulk_update(payments, ['status_checks', 'next_status_check'], batch_size=500)
+    return results, settle(outcomes)
+
+
+def _summary(checked, settled):
+    summary = {'checked': checked, 'completed': 0, 'failed': 0, 'cancelled': 0}
+    for payment in settled:
+        summary[payment.status] += 1
+    return summary
+
+
+def expire_stale(now=None, limit=BATCH_LIMIT, concurrency=None):
+    """
+    Settle or fail pending M-Pesa payments left unconfirmed past
+    MPESA_PENDING_EXPIRY. Each is queried a last time first, so one M-Pesa
+    confirmed without a callback reaching us is completed, not failed; one
+    whose query did not reach Daraja stays pending for the next run.
+    Returns counts per outcome of the last queries, plus how many expired.
+    """
+    now = now or timezone.now()
+    expiry = _setting('PENDING_EXPIRY', PENDING_EXPIRY)
+    stale = list(
+        Payment.objects.filter(
+            status='pending', payment_method='mpesa', created_at__lt=now - timedelta(seconds=expiry),
+        ).order_by('created_at')[:limit]
+    )
+    queried = [payment for payment in stale if payment.transaction_id]
+    results, settled = _query(queried, now, concurrency) if queried else ({}, [])
+
+    keep = {payment.pk for payment in settled}
+    keep.update(
+        payment.pk for payment in queried if not _reached_daraja(results.get(payment.transaction_id))
+    )
+    expired = Payment.objects.filter(
+        pk__in=[payment.pk for payment in stale if payment.pk not in keep], status='pending',
+    ).update(
+        status='failed',
+        description=f'No confirmation from M-Pesa within {expiry // 60} minutes',
+        updated_at=now,
+    )
+    return {**_summary(len(queried), settled), 'expired': expired}
+
+
+def check_payments(payments, now=None, concurrency=None):
+    """
+    Query M-Pesa for the given pending payments at once and settle those it
+    has an answer for; the rest are scheduled for another query. Returns
+    counts per outcome.
+    """
+    if not payments:
+        return _summary(0, [])
+    _, settled = _query(payments, now or timezone.now(), concurrency)
+    return _summary(len(payments), settled)
+
+
+def reconcile_pending_payments(limit=BATCH_LIMIT, concurrency=None):
+    """
+    One reconciliation run: give stale payments a last query and expire
+    those still unanswered, query the ones due and settle those M-Pesa has
+    an answer for. Returns counts per outcome.
+    """
+    now = timezone.now()
+    expired = expire_stale(now, limit, concurrency)
+    checked = check_payments(list(due_for_check(now, limit)), now, concurrency)
+    return {**{key: checked[key] + expired[key] for key in checked}, 'expired': expired['expired']}
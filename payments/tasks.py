@@ -0,0 +1,16 @@
+# payments/tasks.py
+from celery import shared_task
+
+
+@shared_task
+def process_mpesa_callbacks():
+    """Celery entry point: apply the M-Pesa callbacks stored by the callback view"""
+    from .callbacks import process_callback_events
+    return process_callback_events()
+
+
+@shared_task
+def reconcile_mpesa_payments():
+    """Periodic reconciliation of pending M-Pesa payments (schedule every minute or so with celery beat)"""
+    from .reconcile import reconcile_pending_payments
+    return reconcile_pending_payments()
@@ -0,0 +1,551 @@
+import datetime
+import json
+import threading
+import time
+from decimal import Decimal
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from unittest import mock
+from django.core.cache import cache
+from django.db import connection
+from django.db.migrations.executor import MigrationExecutor
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from accounts.models import User
+from marks.terms import clear_term_caches
+from students.models import Student
+from .callbacks import process_callback_events, store_callback
+from .ledger import post_charge, post_entry, post_payment, reverse_payment, verify_ledger
+from .models import AdditionalCharge, FeeLedgerEntry, FeeStructure, MpesaCallbackEvent, Payment, PaymentReceipt, StudentFee
+from .mpesa import MpesaAPI
+from .mpesa_async import AsyncMpesaAPI, query_statuses
+from .reconcile import expire_stale, settle
+
+
+def make_student(username='pupil', admission_number='A001'):
+    user = User.objects.create_user(username=username, password='pw', role='student', first_name='Pat')
+    return Student.objects.create(
+        user=user, admission_number=admission_number, grade='Form 1', section='A',
+        date_of_birth=datetime.date(2010, 1, 1), address='-', parent_name='-', parent_phone='-',
+    )
+
+
+class FeeTestCase(TestCase):
+    @classmethod
+    def setUpTestData(cls):
+        # Fee structures link to AcademicTerms, whose ids are cached per process
+        clear_term_caches()
+        cls.student = make_student()
+        cls.structure = FeeStructure.objects.create(
+            name='Term 1', grade='form1', term='term1', academic_year='2026', tuition_fee=Decimal('1000.00'),
+        )
+
+    def setUp(self):
+        self.fee = StudentFee.objects.create(
+            student=self.student, fee_structure=self.structure, due_date=datetime.date.today() + datetime.timedelta(days=30),
+        )
+
+    def pay(self, amount, status='completed', transaction_id='TX1'):
+        return Payment.objects.create(
+            student_fee=self.fee, student=self.student, amount=Decimal(amount),
+            payment_method='cash', status=status, transaction_id=transaction_id,
+        )
+
+    def assertTotals(self, **expected):
+        """The fee's stored totals, which must also agree with its ledger"""
+        self.fee.refresh_from_db()
+        for field, value in expected.items():
+            self.assertEqual(getattr(self.fee, field), value, field)
+        self.assertEqual(verify_ledger([self.fee.pk]), [])
+
+    def entry_types(self, payment):
+        return list(FeeLedgerEntry.objects.filter(payment=payment).values_list('entry_type', flat=True))
+
+
+class LedgerTests(FeeTestCase):
+    def test_new_fee_owes_its_structure_total(self):
+        self.assertTotals(amount_due=Decimal('1000.00'), balance=Decimal('1000.00'), is_paid=False)
+
+    def test_post_entry_moves_totals(self):
+        post_entry(self.fee.pk, 'charge', Decimal('50.00'))
+        post_entry(self.fee.pk, 'penalty', Decimal('25.00'))
+        self.assertTotals(
+            additional_charges=Decimal('50.00'), penalty_charges=Decimal('25.00'),
+            amount_due=Decimal('1075.00'), balance=Decimal('1075.00'),
+        )
+
+    def test_completed_payment_is_posted(self):
+        self.pay('300.00')
+        self.assertTotals(amount_paid=Decimal('300.00'), balance=Decimal('700.00'), is_paid=False)
+
+    def test_payment_is_posted_once(self):
+        payment = self.pay('300.00')
+        payment.save()
+        self.assertIsNone(post_payment(payment))
+        self.assertEqual(self.entry_types(payment), ['payment'])
+        self.assertTotals(amount_paid=Decimal('300.00'))
+
+    def test_postings_are_checked_after_the_lock(self):
+        # A check inside the locking SELECT would read a snapshot from before the lock wait
+        payment = self.pay('300.00', status='pending')
+        with CaptureQueriesContext(connection) as queries:
+            post_payment(payment)
+        lock, check = [query['sql'] for query in queries.captured_queries if query['sql'].startswith('SELECT')][:2]
+        self.assertIn('payments_studentfee', lock)
+        self.assertNotIn('payments_feeledgerentry', lock)
+        self.assertIn('payments_feeledgerentry', check)
+
+    def test_pending_payment_is_not_posted(self):
+        payment = self.pay('300.00', status='pending')
+        self.assertEqual(self.entry_types(payment), [])
+        self.assertIsNone(reverse_payment(payment))
+        self.assertTotals(amount_paid=Decimal('0.00'))
+
+    def test_failed_payment_is_reversed_once(self):
+        payment = self.pay('300.00')
+        payment.status = 'failed'
+        payment.save()
+        payment.save()
+        self.assertIsNone(reverse_payment(payment))
+        self.assertEqual(self.entry_types(payment), ['payment', 'reversal'])
+        self.assertTotals(amount_paid=Decimal('0.00'), balance=Decimal('1000.00'))
+
+    def test_reversed_payment_is_posted_again_when_completed(self):
+        payment = self.pay('300.00')
+        for status in ('failed', 'completed', 'completed'):
+            payment.status = status
+            payment.save()
+        self.assertEqual(self.entry_types(payment), ['payment', 'reversal', 'payment'])
+        self.assertTotals(amount_paid=Decimal('300.00'), balance=Decimal('700.00'))
+
+    def test_full_payment_settles_fee(self):
+        self.pay('1000.00')
+        self.assertTotals(balance=Decimal('0.00'), is_paid=True, paid_date=datetime.date.today())
+
+    def test_charge_is_posted_once(self):
+        charge = AdditionalCharge.objects.create(
+            student=self.student, charge_type='other', description='Trip', amount=Decimal('80.00'),
+            due_date=datetime.date.today(),
+        )
+        self.assertIsNone(post_charge(charge, self.fee))
+        self.assertTotals(additional_charges=Decimal('80.00'), amount_due=Decimal('1080.00'))
+
+    def test_stale_save_keeps_posted_totals(self):
+        stale = StudentFee.objects.get(pk=self.fee.pk)
+        self.pay('300.00')
+        stale.due_date = datetime.date(2030, 1, 31)
+        stale.amount_paid = Decimal('0.00')
+        stale.save()
+        self.assertEqual(stale.amount_paid, Decimal('300.00'))
+        self.assertTotals(amount_paid=Decimal('300.00'), balance=Decimal('700.00'), due_date=datetime.date(2030, 1, 31))
+
+    def test_starting_charges_are_posted(self):
+        fee = StudentFee.objects.create(
+            student=make_student('other', 'A002'), fee_structure=self.structure,
+            due_date=datetime.date.today(), additional_charges=Decimal('40.00'),
+        )
+        self.assertEqual(fee.amount_due, Decimal('1040.00'))
+        self.assertEqual(FeeLedgerEntry.objects.filter(student_fee=fee, entry_type='charge').count(), 1)
+        self.assertEqual(verify_ledger([fee.pk]), [])
+
+    def test_verify_ledger_finds_and_fixes_drift(self):
+        self.pay('300.00')
+        StudentFee.objects.filter(pk=self.fee.pk).update(amount_paid=Decimal('999.00'))
+        mismatches = verify_ledger([self.fee.pk], fix=True)
+        self.assertEqual(
+            {(row['field'], row['expected']) for row in mismatches},
+            {('amount_paid', Decimal('300.00'))},
+        )
+        self.assertTotals(amount_paid=Decimal('300.00'), balance=Decimal('700.00'))
+
+
+def stk_callback(checkout_request_id, result_code=0, receipt='QWE123', amount=300):
+    callback = {'CheckoutRequestID': checkout_request_id, 'ResultCode': result_code, 'ResultDesc': 'done'}
+    if result_code == 0:
+        callback['CallbackMetadata'] = {'Item': [
+            {'Name': 'Amount', 'Value': amount},
+            {'Name': 'MpesaReceiptNumber', 'Value': receipt},
+            {'Name': 'PhoneNumber', 'Value': 254700000000},
+        ]}
+    return {'Body': {'stkCallback': callback}}
+
+
+class CallbackProcessingTests(FeeTestCase):
+    def mpesa_payment(self, checkout_request_id='ws_CO_1', status='pending'):
+        return Payment.objects.create(
+            student_fee=self.fee, student=self.student, amount=Decimal('300.00'),
+            payment_method='mpesa', status=status, transaction_id=checkout_request_id,
+        )
+
+    def test_callback_is_stored_once(self):
+        self.assertTrue(store_callback(stk_callback('ws_CO_1')))
+        self.assertTrue(store_callback(stk_callback('ws_CO_1')))
+        self.assertFalse(store_callback({'Body': {}}))
+        self.assertEqual(MpesaCallbackEvent.objects.count(), 1)
+
+    def test_successful_callback_completes_and_posts_payment(self):
+        payment = self.mpesa_payment()
+        store_callback(stk_callback('ws_CO_1'))
+        self.assertEqual(process_callback_events(), 1)
+
+        payment.refresh_from_db()
+        self.assertEqual((payment.status, payment.mpesa_code), ('completed', 'QWE123'))
+        self.assertTrue(PaymentReceipt.objects.filter(payment=payment).exists())
+        self.assertEqual(MpesaCallbackEvent.objects.get().status, 'processed')
+        self.assertTotals(amount_paid=Decimal('300.00'), balance=Decimal('700.00'))
+
+    def test_failed_callback_fails_pending_payment(self):
+        payment = self.mpesa_payment()
+        store_callback(stk_callback('ws_CO_1', result_code=1032))
+        process_callback_events()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'failed')
+        self.assertTotals(amount_paid=Decimal('0.00'))
+
+    def test_success_after_expiry_completes_payment(self):
+        payment = self.mpesa_payment(status='failed')
+        store_callback(stk_callback('ws_CO_1'))
+        process_callback_events()
+        payment.refresh_from_db()
+        self.assertEqual(payment.status, 'completed')
+        self.assertTotals(amount_paid=Decimal('300.00'))
+
+    def test_callback_before_its_payment_is_retried(self):
+        store_callback(stk_callback('ws_CO_1'))
+        with self.assertLogs('payments.callbacks', 'ERROR'):
+            process_callback_events()
+        event = MpesaCallbackEvent.objects.get()
+        self.assertEqual((event.status, event.attempts), ('pending', 1))
+
+        self.mpesa_payment()
+        process_callback_events()
+        event.refresh_from_db()
+        self.assertEqual((event.status, event.attempts), ('processed', 2))
+        self.assertTotals(amount_paid=Decimal('300.00'))
+
+
+class OpeningBalanceMigrationTests(TransactionTestCase):
+    """0003_feeledgerentry posts what fees held before the ledger existed"""
+    before = [('payments', '0002_feestructure_academic_term')]
+    after = [('payments', '0003_feeledgerentry')]
+
+    def migrate(self, targets):
+        MigrationExecutor(connection).migrate(targets)
+        # Models as of every migration now applied, other apps' included
+        loader = MigrationExecutor(connection).loader
+        return loader.project_state(list(loader.applied_migrations)).apps
+
+    def tearDown(self):
+        executor = MigrationExecutor(connection)
+        executor.migrate(executor.loader.graph.leaf_nodes())
+
+    def test_existing_totals_are_posted(self):
+        apps = self.migrate(self.before)
+        User = apps.get_model('accounts', 'User')
+        Student = apps.get_model('students', 'Student')
+        FeeStructure = apps.get_model('payments', 'FeeStructure')
+        StudentFee = apps.get_model('payments', 'StudentFee')
+        Payment = apps.get_model('payments', 'Payment')
+
+        student = Student.objects.create(
+            user=User.objects.create(username='pupil', role='student'), admission_number='A001',
+            grade='Form 1', section='A', date_of_birth=datetime.date(2010, 1, 1),
+            address='-', parent_name='-', parent_phone='-',
+        )
+        structure = FeeStructure.objects.create(
+            name='Term 1', grade='form1', term='term1', academic_year='2026', tuition_fee=Decimal('1000.00'),
+        )
+        fee = StudentFee.objects.create(
+            student=student, fee_structure=structure, due_date=datetime.date(2026, 3, 1),
+            additional_charges=Decimal('40.00'), penalty_charges=Decimal('10.00'), amount_paid=Decimal('300.00'),
+            amount_due=Decimal('1050.00'), balance=Decimal('750.00'),
+        )
+        for transaction_id, status in (('TX1', 'completed'), ('TX2', 'pending'), ('TX3', 'failed')):
+            Payment.objects.create(
+                student_fee=fee, student=student, amount=Decimal('300.00') if status == 'completed' else Decimal('5.00'),
+                status=status, transaction_id=transaction_id,
+            )
+
+        apps = self.migrate(self.after)
+        FeeLedgerEntry = apps.get_model('payments', 'FeeLedgerEntry')
+        self.assertEqual(
+            sorted(FeeLedgerEntry.objects.filter(student_fee_id=fee.pk).values_list('entry_type', 'amount')),
+            [('charge', Decimal('40.00')), ('payment', Decimal('300.00')), ('penalty', Decimal('10.00'))],
+        )
+
+        self.migrate(MigrationExecutor(connection).loader.graph.leaf_nodes())
+        self.assertEqual(verify_ledger([fee.pk]), [])
+
+
+class DarajaHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        self.respond()
+
+    def do_POST(self):
+        self.respond()
+
+    def respond(self):
+        server = self.server
+        path = self.path.split('?')[0]
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or 'null')
+        with server.lock:
+            server.calls.append((self.command, path, self.headers.get('Authorization'), time.monotonic()))
+            server.in_flight += 1
+            server.max_in_flight = max(server.max_in_flight, server.in_flight)
+            status, data = server.next_response(path, body)
+        try:
+            time.sleep(server.delay)
+        finally:
+            with server.lock:
+                server.in_flight -= 1
+        payload = json.dumps(data).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(payload)))
+        self.end_headers()
+        self.wfile.write(payload)
+
+    def log_message(self, *args):
+        pass
+
+
+class DarajaStandIn(ThreadingHTTPServer):
+    """
+    A local stand-in for Daraja's token, STK push and status query endpoints.
+
+    Each token it issues is new (token-1, token-2, ...); responses queued in
+    `script[path]` are served before the usual successful ones.
+    """
+    daemon_threads = True
+    TOKEN_PATH = '/oauth/v1/generate'
+    STK_PUSH_PATH = '/mpesa/stkpush/v1/processrequest'
+    QUERY_PATH = '/mpesa/stkpushquery/v1/query'
+
+    def __init__(self, port=0):
+        super().__init__(('127.0.0.1', port), DarajaHandler)
+        self.lock = threading.Lock()
+        self.calls = []
+        self.script = {}
+        self.delay = 0
+        self.in_flight = self.max_in_flight = 0
+        self.tokens_issued = 0
+
+    @property
+    def url(self):
+        return f'http://127.0.0.1:{self.server_address[1]}'
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, kwargs={'poll_interval': 0.05}, daemon=True).start()
+        return self
+
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+    def calls_to(self, path):
+        return [call for call in self.calls if call[1] == path]
+
+    def next_response(self, path, body):
+        if self.script.get(path):
+            return self.script[path].pop(0)
+        if path == self.TOKEN_PATH:
+            self.tokens_issued += 1
+            return 200, {'access_token': f'token-{self.tokens_issued}', 'expires_in': '3599'}
+        if path == self.STK_PUSH_PATH:
+            return 200, {
+                'ResponseCode': '0', 'MerchantRequestID': 'mr-1', 'CheckoutRequestID': 'ws_CO_1',
+                'ResponseDescription': 'Success', 'CustomerMessage': 'Success',
+            }
+        return 200, {
+            'ResponseCode': '0', 'ResultCode': '0', 'ResultDesc': 'The service request is processed successfully.',
+            'CheckoutRequestID': body['CheckoutRequestID'],
+        }
+
+
+def use_daraja(test):
+    """Start a DarajaStandIn for the test and point MPESA_CONFIG at it, with no token cached"""
+    daraja = DarajaStandIn().start()
+    test.addCleanup(daraja.stop)
+    settings = override_settings(MPESA_CONFIG={
+        'CONSUMER_KEY': 'key', 'CONSUMER_SECRET': 'secret', 'SHORTCODE': '174379',
+        'PASSKEY': 'passkey', 'CALLBACK_URL': 'https://example.com/callback', 'BASE_URL': daraja.url,
+    })
+    settings.enable()
+    test.addCleanup(settings.disable)
+    cache.clear()
+    return daraja
+
+
+class DarajaTestCase(SimpleTestCase):
+    def setUp(self):
+        self.daraja = use_daraja(self)
+
+
+class MpesaClientTests(DarajaTestCase):
+    def test_token_is_reused_until_it_expires(self):
+        # Tokens are dropped TOKEN_SAFETY_MARGIN seconds early, so this one lives for a second
+        self.daraja.script[DarajaStandIn.TOKEN_PATH] = [(200, {'access_token': 'short', 'expires_in': '1'})]
+        api = MpesaAPI()
+        self.assertEqual(api.get_access_token(), 'short')
+        self.assertEqual(MpesaAPI().get_access_token(), 'short')
+        self.assertEqual(len(self.daraja.calls_to(DarajaStandIn.TOKEN_PATH)), 1)
+
+        time.sleep(1.1)
+        self.assertEqual(api.get_access_token(), 'token-1')
+        self.assertEqual(len(self.daraja.calls_to(DarajaStandIn.TOKEN_PATH)), 2)
+
+    def test_concurrent_callers_fetch_one_token(self):
+        self.daraja.delay = 0.2
+        tokens = []
+        threads = [threading.Thread(target=lambda: tokens.append(MpesaAPI().get_access_token())) for _ in range(8)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(tokens, ['token-1'] * 8)
+        self.assertEqual(len(self.daraja.calls_to(DarajaStandIn.TOKEN_PATH)), 1)
+
+    def test_rejected_token_is_replaced_and_the_call_retried_once(self):
+        self.daraja.script[DarajaStandIn.QUERY_PATH] = [(401, {'errorMessage': 'Invalid Access Token'})]
+        result = MpesaAPI().check_transaction_status('ws_CO_1')
+        self.assertTrue(result['success'])
+        self.assertEqual(
+            [(method, authorization) for method, path, authorization, _ in self.daraja.calls if method == 'POST'],
+            [('POST', 'Bearer token-1'), ('POST', 'Bearer token-2')],
+        )
+        self.assertEqual(cache.get(MpesaAPI().token_key), 'token-2')
+
+    def test_server_errors_on_posts_are_not_retried(self):
+        self.daraja.script[DarajaStandIn.STK_PUSH_PATH] = [(503, {'errorMessage': 'Service unavailable'})]
+        result = MpesaAPI().stk_push('254700000000', 300, 'A001', 'School fees')
+        self.assertEqual((result['success'], result['error']), (False, 'HTTP 503'))
+        self.assertEqual(len(self.daraja.calls_to(DarajaStandIn.STK_PUSH_PATH)), 1)
+
+    def test_failed_token_request_gives_no_token(self):
+        self.daraja.script[DarajaStandIn.TOKEN_PATH] = [(400, {'errorMessage': 'Invalid credentials'})]
+        with self.assertLogs('payments.mpesa', 'ERROR'):
+            self.assertIsNone(MpesaAPI().get_access_token())
+        self.assertIsNone(cache.get(MpesaAPI().token_key))
+        self.assertEqual(MpesaAPI().check_transaction_status('ws_CO_1')['success'], True)
+
+
+@mock.patch('payments.mpesa_async.BACKOFF', 0.05)
+class AsyncMpesaClientTests(DarajaTestCase):
+    def post_times(self):
+        return [started for method, path, _, started in self.daraja.calls if path == DarajaStandIn.QUERY_PATH]
+
+    def test_concurrency_is_capped(self):
+        self.daraja.delay = 0.1
+        results = query_statuses([f'ws_CO_{i}' for i in range(12)], concurrency=3, rate=0)
+        self.assertEqual(len(results), 12)
+        self.assertEqual(self.daraja.max_in_flight, 3)
+
+    def test_queries_are_spaced_by_the_rate(self):
+        query_statuses([f'ws_CO_{i}' for i in range(6)], rate=20)
+        times = self.post_times()
+        self.assertEqual(len(times), 6)
+        # Five gaps of at least 1/20 s, less some scheduling slack
+        self.assertGreaterEqual(times[-1] - times[0], 0.2)
+
+    def test_duplicate_ids_are_queried_once(self):
+        results = query_statuses(['ws_CO_1', 'ws_CO_2', 'ws_CO_1'], rate=0)
+        self.assertEqual(list(results), ['ws_CO_1', 'ws_CO_2'])
+        self.assertEqual(len(self.post_times()), 2)
+
+    def test_results_match_the_sync_client(self):
+        self.daraja.script[DarajaStandIn.QUERY_PATH] = [(500, {'errorMessage': 'Internal error'})]
+        results = query_statuses(['ws_CO_1', 'ws_CO_2'], concurrency=1, rate=0)
+        self.daraja.script[DarajaStandIn.QUERY_PATH] = [(500, {'errorMessage': 'Internal error'})]
+        api = MpesaAPI()
+        self.assertEqual(results, {
+            'ws_CO_1': api.check_transaction_status('ws_CO_1'),
+            'ws_CO_2': api.check_transaction_status('ws_CO_2'),
+        })
+        self.assertEqual(results['ws_CO_1']['error'], 'HTTP 500')
+        self.assertEqual(results['ws_CO_2']['data']['CheckoutRequestID'], 'ws_CO_2')
+
+    def test_server_errors_are_retried_for_the_token_only(self):
+        self.daraja.script[DarajaStandIn.TOKEN_PATH] = [(503, {}), (503, {})]
+        self.daraja.script[DarajaStandIn.QUERY_PATH] = [(503, {'errorMessage': 'Service unavailable'})]
+        results = query_statuses(['ws_CO_1'], rate=0)
+        self.assertEqual(results['ws_CO_1']['error'], 'HTTP 503')
+        self.assertEqual(len(self.daraja.calls_to(DarajaStandIn.TOKEN_PATH)), 3)
+        self.assertEqual(len(self.post_times()), 1)
+
+    @mock.patch('payments.mpesa_async.BACKOFF', 0.2)
+    def test_failed_connections_are_retried(self):
+        # Daraja is down for the first attempts (0 and 0.2 s) and back for the third (0.6 s)
+        port = self.daraja.server_address[1]
+        self.daraja.stop()
+        cache.set(AsyncMpesaAPI().token_key, 'token-0')
+        restarted = []
+
+        def restart():
+            restarted.append(DarajaStandIn(port).start())
+            self.addCleanup(restarted[0].stop)
+
+        threading.Timer(0.3, restart).start()
+        results = query_statuses(['ws_CO_1'], rate=0)
+        self.assertTrue(results['ws_CO_1']['success'])
+        self.assertEqual(len(restarted[0].calls_to(DarajaStandIn.QUERY_PATH)), 1)
+
+
+class ReconcileTests(FeeTestCase):
+    def setUp(self):
+        super().setUp()
+        self.daraja = use_daraja(self)
+
+    def mpesa_payment(self, checkout_request_id='ws_CO_1', age=datetime.timedelta(hours=1)):
+        payment = Payment.objects.create(
+            student_fee=self.fee, student=self.student, amount=Decimal('300.00'),
+            payment_method='mpesa', status='pending', transaction_id=checkout_request_id,
+        )
+        Payment.objects.filter(pk=payment.pk).update(created_at=timezone.now() - age)
+        return payment
+
+    def status(self, payment):
+        payment.refresh_from_db()
+        return payment.status
+
+    def test_settled_payment_is_posted_and_receipted_once(self):
+        payment = self.mpesa_payment(age=datetime.timedelta(minutes=5))
+        self.assertEqual([settled.pk for settled in settle({payment.pk: ('completed', 'Paid')})], [payment.pk])
+        self.assertEqual(settle({payment.pk: ('completed', 'Paid')}), [])
+
+        self.assertEqual(self.status(payment), 'completed')
+        self.assertEqual(self.entry_types(payment), ['payment'])
+        self.assertEqual(PaymentReceipt.objects.filter(payment=payment).count(), 1)
+        self.assertTotals(amount_paid=Decimal('300.00'))
+
+    def test_stale_payment_is_queried_before_it_is_failed(self):
+        confirmed = self.mpesa_payment('ws_CO_1')
+        unanswered = self.mpesa_payment('ws_CO_2')
+        # Daraja's answer while it has no result for a payment yet
+        self.daraja.script[DarajaStandIn.QUERY_PATH] = [
+            (500, {'errorCode': '500.001.1001', 'errorMessage': 'The transaction is being processed'}),
+        ]
+        summary = expire_stale()
+        self.assertEqual(len(self.daraja.calls_to(DarajaStandIn.QUERY_PATH)), 2)
+        self.assertEqual((summary['checked'], summary['completed'], summary['expired']), (2, 1, 1))
+        self.assertEqual({self.status(confirmed), self.status(unanswered)}, {'completed', 'failed'})
+        self.assertTotals(amount_paid=Decimal('300.00'))
+
+    @mock.patch('payments.mpesa_async.BACKOFF', 0)
+    def test_stale_payment_stays_pending_while_daraja_is_unreachable(self):
+        payment = self.mpesa_payment()
+        self.daraja.stop()
+        with self.assertLogs('payments.mpesa_async', 'ERROR'):
+            self.assertEqual(expire_stale()['expired'], 0)
+        self.assertEqual(self.status(payment), 'pending')
+
+    def test_success_callback_after_expiry_completes_payment(self):
+        payment = self.mpesa_payment()
+        self.daraja.script[DarajaStandIn.QUERY_PATH] = [(500, {'errorMessage': 'The transaction is being processed'})]
+        expire_stale()
+        self.assertEqual(self.status(payment), 'failed')
+
+        store_callback(stk_callback('ws_CO_1'))
+        process_callback_events()
+        self.assertEqual(self.status(payment), 'completed')
+        self.assertEqual(self.entry_types(payment), ['payment'])
+        self.assertTotals(amount_paid=Decimal('300.00'), balance=Decimal('700.00'))
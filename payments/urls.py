@@ -17,6 +17,7 @@ urlpatterns = [
     path('my-finances/', views.student_financial_dashboard, name='student_financial_dashboard'),
     path('make-payment/', views.make_payment, name='make_payment'),
     path('payment-status/<int:payment_id>/', views.payment_status, name='payment_status'),
+    path('payment-status/<int:payment_id>/data/', views.payment_status_data, name='payment_status_data'),
     path('payment-history/', views.payment_history, name='payment_history'),
     
     # M-Pesa callback
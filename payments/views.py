@@ -13,6 +13,7 @@ from .forms import (
     FeeStructureForm, StudentFeeForm, AdditionalChargeForm, 
     MpesaPaymentForm, PaymentForm
 )
+from .callbacks import enqueue_processing, store_callback
 from .mpesa import MpesaAPI
 from students.models import Student
 from accounts.models import User
@@ -111,8 +112,6 @@ def assign_fee_to_student(request):
                             confirmed_at=timezone.now(),
                             description='Initial payment'
                         )
-                        student_fee.amount_paid = initial_amount
-                        student_fee.save()
                 except ValueError:
                     pass
             
@@ -133,19 +132,10 @@ def add_additional_charge(request):
             charge.added_by = request.user
             charge.save()
             
-            # Update student's fee balance
-            try:
-                student_fee = StudentFee.objects.filter(
-                    student=charge.student,
-                    fee_structure__is_active=True
-                ).latest('created_at')
-                
-                student_fee.additional_charges += charge.amount
-                student_fee.save()
-                
+            # The charge is posted to the student's fee ledger when saved
+            if StudentFee.objects.filter(student=charge.student, fee_structure__is_active=True).exists():
                 messages.success(request, f'Additional charge added to {charge.student} successfully!')
-                
-            except StudentFee.DoesNotExist:
+            else:
                 messages.warning(request, 'No active fee structure found for this student.')
             
             return redirect('student_fee_list')
@@ -164,16 +154,9 @@ def record_payment(request):
             payment.status = 'completed'
             payment.confirmed_by = request.user
             payment.confirmed_at = timezone.now()
+            # Saving a completed payment posts it to the fee ledger and generates its receipt
             payment.save()
             
-            # Update student fee balance
-            student_fee = payment.student_fee
-            student_fee.amount_paid += payment.amount
-            student_fee.save()
-            
-            # Generate receipt
-            PaymentReceipt.objects.create(payment=payment)
-            
             messages.success(request, f'Payment of {payment.amount} recorded successfully!')
             return redirect('payment_list')
     else:
@@ -318,32 +301,35 @@ def make_payment(request):
 @login_required
 @user_passes_test(is_student)
 def payment_status(request, payment_id):
+    """
+    Status of a payment as stored. A pending M-Pesa payment is settled by
+    its callback or by the reconciler (payments.reconcile), never from here;
+    the page polls payment_status_data until it changes.
+    """
     payment = get_object_or_404(Payment, id=payment_id, student__user=request.user)
     
-    # Check payment status
-    if payment.status == 'pending' and payment.transaction_id:
-        mpesa = MpesaAPI()
-        result = mpesa.check_transaction_status(payment.transaction_id)
-        
-        if result['success'] and result['data'].get('ResultCode') == '0':
-            payment.status = 'completed'
-            payment.mpesa_code = result['data'].get('MpesaReceiptNumber')
-            payment.receipt_number = result['data'].get('MpesaReceiptNumber')
-            payment.save()
-            
-            # Update student fee
-            student_fee = payment.student_fee
-            student_fee.amount_paid += payment.amount
-            student_fee.save()
-            
-            # Generate receipt
-            PaymentReceipt.objects.create(payment=payment)
-    
     return render(request, 'payments/payment_status.html', {
         'payment': payment,
         'student': payment.student,
     })
 
+@login_required
+@user_passes_test(is_student)
+def payment_status_data(request, payment_id):
+    """The stored status of a payment as JSON; one query, no call to M-Pesa"""
+    payment = get_object_or_404(
+        Payment.objects.only('id', 'status', 'mpesa_code', 'receipt_number', 'description'),
+        id=payment_id, student__user=request.user,
+    )
+    return JsonResponse({
+        'id': payment.pk,
+        'status': payment.status,
+        'status_display': payment.get_status_display(),
+        'mpesa_code': payment.mpesa_code,
+        'receipt_number': payment.receipt_number,
+        'description': payment.description,
+    })
+
 @login_required
 @user_passes_test(is_student)
 def payment_history(request):
@@ -364,50 +350,23 @@ def payment_history(request):
 
 @csrf_exempt
 def mpesa_callback(request):
-    """Handle M-Pesa callback"""
-    if request.method == 'POST':
-        try:
-            data = json.loads(request.body)
-            callback_data = data.get('Body', {}).get('stkCallback', {})
-            
-            checkout_request_id = callback_data.get('CheckoutRequestID')
-            result_code = callback_data.get('ResultCode')
-            result_desc = callback_data.get('ResultDesc')
-            
-            # Find the payment
-            payment = Payment.objects.filter(
-                transaction_id=checkout_request_id,
-                status='pending'
-            ).first()
-            
-            if payment:
-                if result_code == '0':
-                    # Payment successful
-                    payment.status = 'completed'
-                    payment.mpesa_code = callback_data.get('CallbackMetadata', {}).get('Item', [{}])[1].get('Value', '')
-                    payment.receipt_number = callback_data.get('CallbackMetadata', {}).get('Item', [{}])[1].get('Value', '')
-                    
-                    # Update student fee
-                    student_fee = payment.student_fee
-                    student_fee.amount_paid += payment.amount
-                    student_fee.save()
-                    
-                    # Generate receipt
-                    PaymentReceipt.objects.create(payment=payment)
-                    
-                else:
-                    # Payment failed
-                    payment.status = 'failed'
-                    payment.description = result_desc
-                
-                payment.save()
-            
-            return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Success'})
-            
-        except Exception as e:
-            return JsonResponse({'ResultCode': 1, 'ResultDesc': str(e)})
+    """
+    Handle M-Pesa callback: store it and acknowledge straight away. The
+    payment is settled by a worker (payments.callbacks).
+    """
+    if request.method != 'POST':
+        return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Invalid request method'})
+    
+    try:
+        data = json.loads(request.body)
+    except ValueError:
+        return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Invalid JSON'})
+    
+    if not store_callback(data):
+        return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Missing CheckoutRequestID'})
     
-    return JsonResponse({'ResultCode': 1, 'ResultDesc': 'Invalid request method'})
+    enqueue_processing()
+    return JsonResponse({'ResultCode': 0, 'ResultDesc': 'Accepted'})
 
 # ===== Public Views =====
 
@@ -0,0 +1,10 @@
+import os
+from celery import Celery
+
+os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'school_a.settings')
+
+app = Celery('school_a')
+
+# All CELERY_* settings in settings.py configure the app
+app.config_from_object('django.conf:settings', namespace='CELERY')
+app.autodiscover_tasks()
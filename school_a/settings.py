@@ -154,6 +154,44 @@ else:
         }
     }
 
+# Covering indexes (Index.include) only take effect on PostgreSQL; SQLite builds them without the extra columns
+SILENCED_SYSTEM_CHECKS = ['models.W040']
+
+# =============================================
+# CACHE
+# =============================================
+
+# Redis when REDIS_URL is set, else files under CACHE_DIR, else per-process memory.
+# Analytics versions and counters (marks.cache) and the M-Pesa OAuth token
+# (payments.mpesa) are only shared across processes with Redis or the file cache.
+REDIS_URL = os.getenv('REDIS_URL', '')
+CACHE_DIR = os.getenv('CACHE_DIR', '')
+
+if REDIS_URL:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': REDIS_URL,
+        }
+    }
+elif CACHE_DIR:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.filebased.FileBasedCache',
+            'LOCATION': CACHE_DIR,
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+        }
+    }
+
+# Cache alias holding analytics results, and how long an entry lives in seconds
+ANALYTICS_CACHE_ALIAS = 'default'
+ANALYTICS_CACHE_TIMEOUT = int(os.getenv('ANALYTICS_CACHE_TIMEOUT', 60 * 60 * 24))
+
 # =============================================
 # PASSWORD VALIDATION
 # =============================================
@@ -223,8 +261,54 @@ MPESA_CONFIG = {
     'PASSKEY': os.getenv('MPESA_PASSKEY', ''),
     'CALLBACK_URL': os.getenv('MPESA_CALLBACK_URL', ''),
     'ENVIRONMENT': os.getenv('MPESA_ENVIRONMENT', 'sandbox'),
+    # Overrides the sandbox/production URL, e.g. to point at a local stand-in
+    'BASE_URL': os.getenv('MPESA_BASE_URL', ''),
 }
 
+# Pending M-Pesa payments (payments.reconcile): seconds to wait for the callback
+# before querying M-Pesa, and seconds after which an unconfirmed payment expires
+MPESA_RECONCILE_GRACE = int(os.getenv('MPESA_RECONCILE_GRACE', 60))
+MPESA_PENDING_EXPIRY = int(os.getenv('MPESA_PENDING_EXPIRY', 30 * 60))
+
+# Bulk status queries (payments.mpesa_async): queries in flight at once, and
+# queries started per second (0 for no limit)
+MPESA_QUERY_CONCURRENCY = int(os.getenv('MPESA_QUERY_CONCURRENCY', 50))
+MPESA_QUERY_RATE = float(os.getenv('MPESA_QUERY_RATE', 100))
+
+# =============================================
+# BACKGROUND JOBS (Celery)
+# =============================================
+
+# Without a broker, analytics jobs run in a background thread of the web process
+CELERY_BROKER_URL = os.getenv('CELERY_BROKER_URL', '')
+CELERY_RESULT_BACKEND = os.getenv('CELERY_RESULT_BACKEND', '') or None
+CELERY_TASK_ALWAYS_EAGER = os.getenv('CELERY_TASK_ALWAYS_EAGER', 'False').lower() in ('true', '1', 't')
+CELERY_TIMEZONE = TIME_ZONE
+
+# Students per chunk and worker processes per analytics job
+ANALYTICS_JOB_CHUNK_SIZE = int(os.getenv('ANALYTICS_JOB_CHUNK_SIZE', 200))
+ANALYTICS_JOB_WORKERS = int(os.getenv('ANALYTICS_JOB_WORKERS', 1))
+
+# Seconds without progress after which a running analytics job counts as lost
+# (its worker died) and is queued again
+ANALYTICS_JOB_STALE_AFTER = int(os.getenv('ANALYTICS_JOB_STALE_AFTER', 10 * 60))
+
+# Keep Mark.standardized_score up to date in the background as marks are written,
+# with the percentile ranks (otherwise run the standardize_scores command before
+# ranking on standardized scores)
+STANDARDIZE_SCORES = os.getenv('STANDARDIZE_SCORES', 'False').lower() in ('true', '1', 't')
+
+# Early warning (marks.early_warning): flag students whose trend projects next
+# term's average below this, once they have results for this many terms
+RISK_AVERAGE_THRESHOLD = float(os.getenv('RISK_AVERAGE_THRESHOLD', 40))
+RISK_MIN_TERMS = int(os.getenv('RISK_MIN_TERMS', 2))
+# A term in progress is only judged once it has ended or has this share of the
+# previous term's results; until then the previous term's flags stand
+RISK_TERM_COVERAGE = float(os.getenv('RISK_TERM_COVERAGE', 0.8))
+
+# Worker processes drawing report card PDFs in batch (marks.report_cards)
+REPORT_CARD_WORKERS = int(os.getenv('REPORT_CARD_WORKERS', 1))
+
 # =============================================
 # EMAIL CONFIGURATION
 # =============================================
@@ -322,6 +406,21 @@ UNFOLD = {
                         "icon": "grade",
                         "link": "/admin/marks/mark/",
                     },
+                    {
+                        "title": "Academic Terms",
+                        "icon": "calendar_month",
+                        "link": "/admin/marks/academicterm/",
+                    },
+                    {
+                        "title": "Grading Schemes",
+                        "icon": "rule",
+                        "link": "/admin/marks/gradingscheme/",
+                    },
+                    {
+                        "title": "Import Marks",
+                        "icon": "upload_file",
+                        "link": "/admin/marks/mark/import/",
+                    },
                     {
                         "title": "Student Reports",
                         "icon": "description",
@@ -332,6 +431,16 @@ UNFOLD = {
                         "icon": "trending_up",
                         "link": "/admin/marks/performancetrend/",
                     },
+                    {
+                        "title": "Analytics Jobs",
+                        "icon": "pending_actions",
+                        "link": "/admin/marks/analyticsjob/",
+                    },
+                    {
+                        "title": "Risk Flags",
+                        "icon": "warning",
+                        "link": "/admin/marks/riskflag/",
+                    },
                 ],
             },
             {
@@ -348,6 +457,16 @@ UNFOLD = {
                         "icon": "request_quote",
                         "link": "/admin/payments/feestructure/",
                     },
+                    {
+                        "title": "Fee Ledger",
+                        "icon": "receipt_long",
+                        "link": "/admin/payments/feeledgerentry/",
+                    },
+                    {
+                        "title": "M-Pesa Callbacks",
+                        "icon": "sync_alt",
+                        "link": "/admin/payments/mpesacallbackevent/",
+                    },
                 ],
             },
             {
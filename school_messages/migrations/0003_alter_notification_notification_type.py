@@ -0,0 +1,18 @@
+# Generated by Django 4.2.11 on 2026-10-17 04:04
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('school_messages', '0002_alter_broadcastschedule_options_and_more'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='notification',
+            name='notification_type',
+            field=models.CharField(choices=[('message', 'New Message'), ('fee', 'Fee Reminder'), ('mark', 'Marks Posted'), ('holiday', 'Holiday Notice'), ('event', 'Upcoming Event'), ('system', 'System Update'), ('risk', 'Students At Risk')], max_length=20),
+        ),
+    ]
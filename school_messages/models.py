@@ -172,6 +172,7 @@ class Notification(models.Model):
         ('holiday', 'Holiday Notice'),
         ('event', 'Upcoming Event'),
         ('system', 'System Update'),
+        ('risk', 'Students At Risk'),
     )
     
     user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name='notifications')
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.11 on 2026-10-17 03:50
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('students', '0002_student_initial_password'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='student',
+            index=models.Index(fields=['grade', 'section'], name='student_class_idx'),
+        ),
+    ]
@@ -37,4 +37,8 @@ class Student(models.Model):
         super().save(*args, **kwargs)
     
     class Meta:
-        ordering = ['grade', 'section', 'admission_number']
\ No newline at end of file
+        ordering = ['grade', 'section', 'admission_number']
+        indexes = [
+            # Class lookups (mark list and mark sheets filter marks by student grade/section)
+            models.Index(fields=['grade', 'section'], name='student_class_idx'),
+        ]